@@ -18,7 +18,7 @@ from memos.models.Memo import Memo
 app = create_app()
 @app.context_processor
 def inject_pinned():
-    return dict(get_pinned=Memo.get_pinned)
+    return dict(get_pinned=Memo.get_pinned,get_inbox_count=Memo.get_inbox_count)
     
 if __name__ == '__main__':
     app.run(debug=True)
@@ -1,10 +1,11 @@
-from flask import Flask
+import os
+import click
+from flask import Flask, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_mail import Mail
-from flaskext.markdown import Markdown
-from flask_migrate import Migrate
+from markupsafe import Markup
 
 from memos.extensions import ldap
 from memos.config import Config
@@ -15,22 +16,48 @@ login_manager = LoginManager()
 login_manager.login_view = 'users.login'
 login_manager.login_message_category = 'info'
 mail = Mail()
-migrate = Migrate()
+
+# Markdown (only the help page), flask_migrate & alembic (only the flask db commands) and
+# PIL (only the profile pictures) are imported when they are first used so the workers start faster
+
+def markdown_filter(text):
+    import markdown
+    return Markup(markdown.markdown(text))
+
+def file_root():
+    """The directory the memo files, the blobstore and the search index are kept in"""
+    return current_app.config.get('FILE_ROOT') or os.path.join(current_app.root_path,"static")
+
+def init_migrate(app):
+    from flask_migrate import Migrate
+    Migrate(app,db)
 
 def create_app(config_class=Config):
     app = Flask(__name__)
-    Markdown(app)
+    app.jinja_env.filters['markdown'] = markdown_filter
+    from memos.fragments import memo_card
+    app.jinja_env.globals['memo_card'] = memo_card
     app.config.from_object(Config)
 
     db.init_app(app)
     bcrypt.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
-    migrate.init_app(app,db)
+    from memos import mailer
+    mailer.init_app(app)
+    from memos import search
+    search.init_app(app)
+    if click.get_current_context(silent=True) is not None: # pragma nocover -- run by the flask command e.g. flask db upgrade
+        init_migrate(app)
     
     if ldap:
         ldap.init_app(app) #pragma nocover  -- testing ldap is very environment centric.
 
+    if app.config['QUERY_SCAN_CHECK']: # pragma nocover -- the tests install their own check
+        from memos import querycheck
+        with app.app_context():
+            querycheck.install(db.engine,lambda table,statement: app.logger.warning(f"Full scan of {table}: {statement}"))
+
     from memos.users.routes import users
     from memos.main.routes import main
     from memos.memos.routes import memos
@@ -0,0 +1,202 @@
+"""
+The archive of the whole memo store
+
+export writes the users, their delegates and subscriptions and every memo with its
+signatures, references, files, distribution and history to one line delimited json
+file (gzipped if the name ends with .gz).  Each table starts with a line that names
+its columns, followed by one json array per row:
+    {"archive": "memos", "version": 1}
+    {"table": "memo", "columns": ["id", "user_id", ...]}
+    [1, "avgUser", ...]
+The rows are read with a streaming cursor and written as they arrive, so the export
+uses the same memory for ten memos as for a million.
+
+ArchiveLoad reads an archive into a database that has no memos, whichever database it
+came from.  The rows of each table are inserted batch_size at a time with one
+statement, all in one transaction.  The memos get new ids, which their rows are
+pointed at.  A user that is already in the database is kept as it is, with its
+delegates and subscriptions.  The files themselves are not in the archive... copy
+the memos/static directory (and its blobstore) along with it.
+"""
+import enum
+import gzip
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import DateTime, Enum, select
+
+from memos import db, metadata
+from memos import search as search_index
+from memos.flask_sqlalchemy_txns import transaction
+from memos.importer import BulkImport, InvalidImport
+from memos.models.Memo import Memo
+from memos.models.MemoDistribution import MemoDistribution
+from memos.models.MemoFile import MemoFile
+from memos.models.MemoHistory import MemoHistory
+from memos.models.MemoReference import MemoReference
+from memos.models.MemoSignature import MemoSignature
+from memos.models.MemoSubscription import MemoSubscription
+from memos.models.User import Delegate, User
+
+VERSION = 1
+
+# In the order they are loaded... a row only refers to rows of the tables before it
+MODELS = (User, Delegate, MemoSubscription, Memo, MemoSignature, MemoReference, MemoFile, MemoDistribution, MemoHistory)
+
+# The user a row of these tables belongs to... it is not loaded if the user was already there
+_OWNER = {'delegate': 'owner_id', 'memo_subscription': 'subscriber_id'}
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def _encode(value):
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not in an archive")
+
+
+def _line(value):
+    return json.dumps(value, default=_encode, separators=(',', ':')) + "\n"
+
+
+def export(path, batch_size=1000, log=print):
+    """Write the memo store to the archive at path... returns {table: rows}"""
+    counts = {}
+    start = time.monotonic()
+    with _open(path, 'w') as f:
+        f.write(_line({'archive': 'memos', 'version': VERSION}))
+        for model in MODELS:
+            table = model.__table__
+            f.write(_line({'table': table.name, 'columns': [column.name for column in table.columns]}))
+            query = select(table).order_by(*table.primary_key.columns).execution_options(stream_results=True)
+            count = 0
+            for rows in db.session.execute(query).partitions(batch_size):
+                f.writelines(_line(list(row)) for row in rows)
+                count = count + len(rows)
+            counts[table.name] = count
+            log(f"Exported {count} {table.name} rows")
+    db.session.commit()     # end the read transaction
+    log(f"Exported {sum(counts.values())} rows in {time.monotonic() - start:.1f}s")
+    return counts
+
+
+class ArchiveLoad(BulkImport):
+    def __init__(self, path, batch_size=1000, log=print):
+        super().__init__(batch_size=batch_size, log=log)
+        self.path = path
+        self.memo_ids = {}          # the id of each memo in the archive -> its id in this database
+        self.kept = set()           # the users that were already here
+        self.counts = {}
+
+    def batches(self, f):
+        """(model, columns, rows) for batch_size rows at a time of each table in the archive"""
+        first = json.loads(f.readline() or 'null')
+        if not isinstance(first, dict) or first.get('archive') != 'memos':
+            raise InvalidImport(f"{self.path} is not a memo archive")
+        if first.get('version') != VERSION:
+            raise InvalidImport(f"{self.path} is version {first.get('version')} of the archive... this reads version {VERSION}")
+
+        models = {model.__table__.name: model for model in MODELS}
+        model = None
+        rows = []
+        for number, line in enumerate(f, 2):
+            value = json.loads(line)
+            if isinstance(value, list):
+                if model is None:
+                    raise InvalidImport(f"line {number}: a row before the table it is in")
+                rows.append(value)
+                if len(rows) == self.batch_size:
+                    yield model, columns, rows
+                    rows = []
+                continue
+            if rows:
+                yield model, columns, rows
+                rows = []
+            model = models.get(value.get('table'))
+            if model is None:
+                raise InvalidImport(f"line {number}: there is no table {value.get('table')}")
+            columns = value['columns']
+            unknown = set(columns) - set(model.__table__.columns.keys())
+            if unknown:
+                raise InvalidImport(f"line {number}: {model.__table__.name} has no column {', '.join(sorted(unknown))}")
+        if rows:
+            yield model, columns, rows
+
+    def decoders(self, model, columns):
+        """{column: the function that turns the json value back into the column's value}"""
+        decoders = {}
+        for name in columns:
+            column_type = model.__table__.columns[name].type
+            if isinstance(column_type, DateTime):
+                decoders[name] = datetime.fromisoformat
+            elif isinstance(column_type, Enum) and column_type.enum_class is not None:
+                decoders[name] = column_type.enum_class.__getitem__
+        return decoders
+
+    def memo_id(self, column, old_id):
+        """The new id of the memo a row refers to"""
+        if old_id in self.memo_ids:
+            return self.memo_ids[old_id]
+        if column.nullable:
+            return None     # the history of a memo that was deleted
+        raise InvalidImport(f"{column.table.name} refers to memo {old_id} which is not in the archive")
+
+    def load(self, model, columns, rows):
+        table = model.__table__
+        decoders = self.decoders(model, columns)
+        memo_columns = [column for column in table.columns
+                        if column.name in columns and any(fk.column is Memo.__table__.c.id for fk in column.foreign_keys)]
+        records = []
+        for values in rows:
+            record = dict(zip(columns, values))
+            for name, decode in decoders.items():
+                if record[name] is not None:
+                    record[name] = decode(record[name])
+            for column in memo_columns:
+                if record[column.name] is not None:
+                    record[column.name] = self.memo_id(column, record[column.name])
+            records.append(record)
+
+        if model is User:
+            records = [record for record in records if record['username'] not in self.kept]
+        elif table.name in _OWNER:
+            records = [record for record in records if record[_OWNER[table.name]] not in self.kept]
+
+        old_ids = [record.pop('id', None) for record in records]
+        if model is Memo:
+            ids = self.insert_memos(records)
+            for old_id, record in zip(old_ids, records):
+                self.memo_ids[old_id] = ids[(record['user_id'], record['number'], record['version'])]
+        else:
+            self.insert_rows(model, records)
+        self.counts[table.name] = self.counts.get(table.name, 0) + len(records)
+
+    def run(self):
+        """Load the archive... returns {table: rows}"""
+        if db.session.query(Memo.id).first() is not None:
+            raise InvalidImport("The database already has memos... an archive can only be loaded into one that has none")
+        self.kept = {username for username, in db.session.query(User.username)}
+
+        with transaction():
+            with _open(self.path, 'r') as f:
+                for model, columns, rows in self.batches(f):
+                    self.load(model, columns, rows)
+            Memo.flags_changed('pinned', 'template')
+            Delegate.invalidate()
+        for name, count in self.counts.items():
+            self.log(f"Loaded {count} {name} rows")
+
+        # The search index and the meta data files are keyed by the new ids & written from what was loaded
+        search_index.clear()
+        memo_ids = sorted(self.memo_ids.values())
+        search_index.index_memos(memo_ids)
+        metadata.write(memo_ids)
+        self.log(f"Loaded {sum(self.counts.values())} rows in {self.stats.seconds:.1f}s")
+        return self.counts
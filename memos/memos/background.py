@@ -0,0 +1,52 @@
+"""
+Lazily started background threads
+
+uwsgi forks its workers after the app has been imported, so a thread that was
+started at import time would only be running in the master.  A Worker starts its
+thread the first time it is started or woken in each process and then runs every
+interval seconds, or sooner when it is woken.
+"""
+import os
+import threading
+
+from memos import db
+
+
+class Worker:
+    def __init__(self, name, run, interval=60):
+        self.name = name
+        self.run = run
+        self.interval = interval
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _running(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def start(self, app):
+        """Start the thread in this process if it is not running... it is cheap to call on every request"""
+        if self._running():
+            return
+        with self._lock:
+            if not self._running():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop,args=(app,),name=self.name,daemon=True)
+                self._thread.start()
+
+    def wake(self, app):
+        self.start(app)
+        self._event.set()
+
+    def _loop(self, app):
+        while True:
+            self._event.wait(self.interval)
+            self._event.clear()
+            with app.app_context():
+                try:
+                    self.run()
+                except Exception: # pragma nocover - the worker has to keep going... the next pass will retry
+                    app.logger.exception(f"{self.name} failed")
+                finally:
+                    db.session.remove()
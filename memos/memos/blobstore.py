@@ -0,0 +1,170 @@
+"""
+The content addressed store for the memo files
+
+A file is kept once in static/blobs/<sha[0:2]>/<sha[2:4]>/<sha256> no matter how
+many memos it is attached to.  The reference count of a blob is the number of
+MemoFile rows that have its sha256, so it can not drift away from the database,
+and MemoFile removes the blob when the last of those rows is deleted.
+
+A transaction that stores blobs holds the lock file static/blobs/.lock shared from
+before it stores the first one until it commits or rolls back.  Blobs are only
+removed with the lock held exclusively, so the rows of every transaction that could
+refer to a blob are committed (or gone) when its references are counted.
+"""
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+from memos import file_root, filelock
+
+CHUNK = 1024*1024
+
+# The first bytes of the file types that show up as memo documents
+_signatures = [
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'PK\x03\x04', 'application/zip'),                             # docx, xlsx, pptx... and zip
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),  # doc, xls, ppt
+]
+
+
+class UploadError(Exception):
+    """The file is too big for the per file or per user quota"""
+    pass
+
+
+def root():
+    return os.path.join(file_root(),"blobs")
+
+
+def relative_path(sha256):
+    """The path of the blob relative to the file root"""
+    return '/'.join(["blobs",sha256[0:2],sha256[2:4],sha256])
+
+
+def path(sha256):
+    return os.path.join(root(),sha256[0:2],sha256[2:4],sha256)
+
+
+def hash_file(filename):
+    sha = hashlib.sha256()
+    with open(filename,"rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _tempfile():
+    tmpdir = os.path.join(root(),"tmp")
+    os.makedirs(tmpdir,exist_ok=True)
+    return tempfile.mkstemp(dir=tmpdir)
+
+
+def sniff(head, filename=''):
+    """The mimetype from the first bytes of the file.  The name only picks between the
+    types that share a container (e.g. docx & xlsx are both zip files)"""
+    guess = mimetypes.guess_type(filename or '')[0]
+    for signature,mimetype in _signatures:
+        if head.startswith(signature):
+            if mimetype in ('application/zip','application/x-ole-storage') and guess:
+                return guess
+            return mimetype
+    try:
+        head.decode('utf-8')
+        return 'text/plain'         # never text/html... an uploaded page must not run in the browser
+    except UnicodeDecodeError as e:
+        if e.start > len(head) - 4:  # a multibyte character cut off at the end of the head
+            return 'text/plain'
+        return 'application/octet-stream'
+
+
+def _place(tmp, sha256):
+    """Atomically move the finished temporary file to the blob"""
+    dst = path(sha256)
+    if os.path.exists(dst):
+        os.remove(tmp)
+    else:
+        os.makedirs(os.path.dirname(dst),exist_ok=True)
+        os.replace(tmp,dst)
+
+
+def store(filename, name=''):
+    """Move filename into the store... returns the sha256, size and mimetype.  If the
+    blob is already there the file is just removed"""
+    sha256 = hash_file(filename)
+    size = os.path.getsize(filename)
+    with open(filename,"rb") as f:
+        head = f.read(512)
+    _place(filename,sha256)
+    return sha256,size,sniff(head,name)
+
+
+def store_stream(stream, filename='', limit=None):
+    """Copy a stream into the store CHUNK bytes at a time.  Returns the sha256, size and
+    mimetype.  Raises UploadError (and keeps nothing) if it is longer than limit"""
+    sha = hashlib.sha256()
+    size = 0
+    head = b''
+    fd,tmp = _tempfile()
+    try:
+        with os.fdopen(fd,"wb") as f:
+            for chunk in iter(lambda: stream.read(CHUNK), b''):
+                size = size + len(chunk)
+                if limit is not None and size > limit:
+                    raise UploadError(f"{filename} is larger than the {limit} byte limit")
+                if len(head) < 512:
+                    head = head + chunk[:512-len(head)]
+                sha.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+    sha256 = sha.hexdigest()
+    _place(tmp,sha256)
+    return sha256,size,sniff(head,filename)
+
+
+def store_file(src, filename=''):
+    """Copy src into the store... returns the sha256, size and mimetype"""
+    with open(src,"rb") as f:
+        return store_stream(f,filename or src)
+
+
+def store_upload(upload, limit=None):
+    """Stream a werkzeug FileStorage into the store... returns the sha256, size and mimetype"""
+    return store_stream(upload.stream,upload.filename,limit)
+
+
+def _lock(shared):
+    os.makedirs(root(),exist_ok=True)
+    f = open(os.path.join(root(),".lock"),"a")
+    filelock.lock(f,shared)
+    return f
+
+
+def hold():
+    """Take the lock shared... the blobs stored until the returned file is closed are not removed"""
+    return _lock(shared=True)
+
+
+def collect(sha256s, in_use):
+    """Remove the blobs that in_use(sha256) says no file refers to... returns how many"""
+    removed = 0
+    with _lock(shared=False):
+        for sha256 in sha256s:
+            if not in_use(sha256):
+                remove(sha256)
+                removed = removed + 1
+    return removed
+
+
+def remove(sha256):
+    try:
+        os.remove(path(sha256))
+    except FileNotFoundError: # pragma nocover - it is already gone... which is what we want
+        pass
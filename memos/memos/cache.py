@@ -0,0 +1,127 @@
+"""
+Small process wide caches
+
+Each worker process has its own copy.  A TTLCache entry can be up to its ttl seconds
+stale in the other processes, and whatever changes the underlying rows should delete
+the entry in its own process.  A VersionedCache entry is kept until a version that
+every process can read (e.g. a CacheVersion row) changes.  An LRUCache has no
+expiry... its keys have to change when the value would.
+"""
+import threading
+from collections import OrderedDict
+import time
+
+_missing = object()
+
+
+class TTLCache:
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = {}          # key -> (expires, value)... oldest first
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return default
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries.pop(key,None)
+            if len(self._entries) >= self.maxsize:
+                self._evict()
+            self._entries[key] = (time.monotonic() + ttl, value)
+
+    def get_or_load(self, key, load, ttl=None):
+        """The cached value... or the value of load() which is then cached"""
+        value = self.get(key,_missing)
+        if value is _missing:
+            value = load()
+            self.set(key,value,ttl)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key,None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [key for key,(expires,value) in self._entries.items() if expires <= now]:
+            del self._entries[key]
+        while len(self._entries) >= self.maxsize:
+            del self._entries[next(iter(self._entries))]
+
+
+class VersionedCache:
+    def __init__(self, version):
+        self.version = version      # version(name)... the current version of name
+        self._entries = {}          # name -> (version, when it was checked, value)
+        self._lock = threading.Lock()
+
+    def get_or_load(self, name, load, interval=0):
+        """The cached value of name... or the value of load() if the version has changed.
+        The version is only read again after interval seconds"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is not None and now - entry[1] < interval:
+            return entry[2]
+
+        version = self.version(name)    # before the load... a change in between is seen next time
+        if entry is not None and entry[0] == version:
+            value = entry[2]
+        else:
+            value = load()
+        with self._lock:
+            self._entries[name] = (version,now,value)
+        return value
+
+    def delete(self, name):
+        with self._lock:
+            self._entries.pop(name,None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()   # least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,67 @@
+"""
+Conditional GET for the memo lists
+
+A list is made from the memo tables and from who is looking at it, so the weak ETag of
+the page is a hash of the versions of those tables (each is bumped by every commit that
+writes it), the viewer, the URL and the build (see build_id).  The search results are also made from the search
+index, which is written after the commit, so their ETag has the version of the index too.  A browser that already has the page is answered
+304 before anything is queried or rendered.  A page that shows flashed messages is never
+tagged... the messages are only shown once.
+"""
+import hashlib
+import os
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+
+from memos.models.CacheVersion import CacheVersion
+
+# The browser keeps the page but asks every time it is shown
+REVALIDATE = 'private, no-cache'
+
+# The files a page is made from besides the database... a deploy that changes one of them
+# changes every ETag, so no browser keeps a page rendered by the old code
+BUILD_SUFFIXES = ('.py','.html','.css','.js','.md')
+_build_id = None
+
+
+def build_id():
+    """The hash of the code, templates and CSS of this deploy... read once by each worker"""
+    global _build_id
+    if _build_id is None:
+        sha = hashlib.sha1()
+        for dirpath,dirnames,filenames in os.walk(current_app.root_path):
+            dirnames[:] = sorted(name for name in dirnames if name not in ('static','__pycache__'))
+            for name in sorted(filenames):
+                if name.endswith(BUILD_SUFFIXES):
+                    path = os.path.join(dirpath,name)
+                    sha.update(os.path.relpath(path,current_app.root_path).encode())
+                    with open(path,"rb") as f:
+                        sha.update(f.read())
+        _build_id = sha.hexdigest()
+    return _build_id
+
+
+def page_etag(*versions):
+    """The ETag of the page for this request, with the versions of anything else it is made
+    from... None if it can not be tagged"""
+    if not current_app.config['PAGE_ETAGS'] or session.get('_flashes'):
+        return None
+    viewer = '' if current_user.is_anonymous else current_user.username
+    key = '\n'.join((build_id(),str(CacheVersion.get_pages()+versions),viewer,request.full_path))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def not_modified(etag, cache_control=REVALIDATE):
+    """The 304 response if the browser already has the page... None if it has to be made"""
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    return validated(current_app.response_class(status=304),etag,cache_control)
+
+
+def validated(body, etag, cache_control=REVALIDATE):
+    """The response for body with its ETag and Cache-Control"""
+    response = make_response(body)
+    if etag is not None:
+        response.set_etag(etag,weak=True)
+    response.headers['Cache-Control'] = cache_control
+    return response
@@ -16,6 +16,15 @@ class Config:
     else:
         SQLALCHEMY_ECHO=False
 
+    # Log a warning for every query that reads a whole table (SQLite only... it doubles the cost of each query)
+    QUERY_SCAN_CHECK = os.environ.get('MEMOS_QUERY_SCAN_CHECK') == 'True'
+
+    # How a page of memos reads their files, signatures and references... 'selectin' (one more
+    # query for each) or 'joined' (in the query for the memos)
+    RELATIONSHIP_LOADING = os.environ.get('MEMOS_RELATIONSHIP_LOADING','selectin')
+
+    # The memo lists count the matching rows up to this many (0 for no count)... more shows as "1000+"
+    PAGE_COUNT_LIMIT = int(os.environ.get('MEMOS_PAGE_COUNT_LIMIT','1000'))
 
 
     SECRET_KEY = os.environ.get('MEMOS_SECRET_KEY')
@@ -25,13 +34,44 @@ class Config:
     MAIL_USE_TLS = True
     MAIL_USERNAME = os.environ.get('MEMOS_EMAIL_USER')
     MAIL_PASSWORD = os.environ.get('MEMOS_EMAIL_PASS')
+    MAIL_BATCH = int(os.environ.get('MEMOS_EMAIL_BATCH','50'))      # the most recipients on one queued message
  
     ADMIN_USER = os.environ.get('MEMOS_ADMIN_USER')
     ADMIN_PASSWORD = os.environ.get('MEMOS_ADMIN_PASSWORD')
     ADMIN_EMAIL = os.environ.get('MEMOS_ADMIN_EMAIL')
     
     MEMO_ROOT = os.environ.get('MEMOS_MEMO_ROOT')
+
+    # Where the memo files, the blobstore and the search index are kept... default memos/static
+    FILE_ROOT = os.environ.get('MEMOS_FILE_ROOT')
+
+    # The internal nginx location of the static directory e.g. /protected... if set nginx sends the files
+    FILE_ACCEL_REDIRECT = os.environ.get('MEMOS_FILE_ACCEL_REDIRECT')
+
+    # The upload limits in bytes... no limit if they are not set
+    MAX_FILE_SIZE = int(os.environ['MEMOS_MAX_FILE_SIZE']) if os.environ.get('MEMOS_MAX_FILE_SIZE') else None
+    USER_QUOTA = int(os.environ['MEMOS_USER_QUOTA']) if os.environ.get('MEMOS_USER_QUOTA') else None
+
+    # How many seconds each worker process keeps the delegation graph before reading it again
+    DELEGATE_CACHE_TTL = int(os.environ.get('MEMOS_DELEGATE_CACHE_TTL','60'))
+
+    # How many seconds each worker process trusts its copy of the pinned memos and the templates
+    # before it checks (with one small query) whether another worker changed them
+    LIST_CACHE_INTERVAL = int(os.environ.get('MEMOS_LIST_CACHE_INTERVAL','5'))
+
+    # How many rendered memo cards each worker process keeps (0 to render them every time)
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('MEMOS_FRAGMENT_CACHE_SIZE','2000'))
+
+    # Tag the memo lists, searches and templates with an ETag and answer 304 when they have not changed
+    PAGE_ETAGS = os.environ.get('MEMOS_PAGE_ETAGS','True') != 'False'
+
+    SEARCH_INDEX = os.environ.get('MEMOS_SEARCH_INDEX')  # The full text search database... default <FILE_ROOT>/sqlite/search.db
     
+    # How many seconds a user found in LDAP and a name that is
+    # not in LDAP are remembered
+    USER_CACHE_TTL = int(os.environ.get('MEMOS_USER_CACHE_TTL','600'))
+    USER_NEGATIVE_TTL = int(os.environ.get('MEMOS_USER_NEGATIVE_TTL','300'))
+
     LDAP_SCHEMA = os.getenv('LDAP_SCHEMA')
     LDAP_PORT = os.getenv('LDAP_PORT')
     LDAP_HOST = os.getenv('LDAP_HOST')
@@ -1,7 +1,8 @@
 import os
-from flask_simpleldap import LDAP
 
 if os.getenv('LDAP_HOST') and len(os.getenv('LDAP_HOST')) > 0: #pragma nocover  -- testing ldap is very environment centric.
+    # python-ldap is only needed (and only installed) where LDAP is used
+    from flask_simpleldap import LDAP
     ldap = LDAP()
 else:
-    ldap = None
\ No newline at end of file
+    ldap = None
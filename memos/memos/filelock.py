@@ -0,0 +1,26 @@
+"""
+Locks on files, on every platform the memos run on
+
+fcntl.flock where there is one.  Windows has no shared locks, so there a shared lock
+is exclusive too (one holder at a time is slower, but still safe) and the lock is the
+first byte of the file.  Either way the lock is released when the file is closed.
+"""
+try:
+    import fcntl
+except ImportError:  # pragma: no cover -- Windows
+    fcntl = None
+    import msvcrt
+
+
+def lock(f, shared=False):
+    """Wait until f is locked... shared or exclusive"""
+    if fcntl is not None:
+        fcntl.flock(f,fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        return
+    f.seek(0)       # pragma: no cover -- Windows
+    while True:     # pragma: no cover
+        try:
+            msvcrt.locking(f.fileno(),msvcrt.LK_LOCK,1)
+            return
+        except OSError:     # LK_LOCK gives up after 10 seconds... keep waiting
+            pass
@@ -0,0 +1,74 @@
+"""
+The rendered memo cards
+
+An Active or Obsolete memo only changes when it is pinned, made a template, made
+confidential, obsoleted, cited by another memo or a memo it cites is renamed, so
+its card (memo_template.html) is kept by each worker in an LRU cache.  The key holds everything the card shows
+that can change plus the class of the viewer, which decides the buttons:
+anonymous, reader, owner (the owner and their delegates) and admin, and for a card
+with an Obsolete button the cursor of the page it links back to.  Drafts and
+memos in signoff are rendered every time... their buttons depend on who has signed.
+"""
+from flask import current_app, has_request_context, request
+from jinja2 import pass_context
+from markupsafe import Markup
+
+from memos.cache import LRUCache
+from memos.models.MemoState import MemoState
+
+_cards = LRUCache(maxsize=2000)
+
+
+def viewer_class(memo, user):
+    """anonymous, admin, owner or reader... None for a viewer the card can not be cached for"""
+    if user is None:
+        return 'anonymous'
+    if getattr(user,'username',None) is None:
+        return None
+    if user.admin:
+        return 'admin'
+    if memo.can_revise(delegate=user):
+        return 'owner'
+    return 'reader'
+
+
+def card_key(memo, user=None, delegate=None, detail=False, next_page=None, cursor=None):
+    """The key of the rendered card... None if it has to be rendered every time"""
+    if memo.memo_state not in (MemoState.Active, MemoState.Obsolete):
+        return None
+    viewer = viewer_class(memo,user)
+    if viewer is None:
+        return None
+
+    if not memo.can_obsolete(delegate=user):     # the only link with the cursor in it
+        cursor = None
+    key = (memo.id, memo.action_date, memo.memo_state, bool(memo.pinned), bool(memo.template), bool(memo.confidential),
+           memo.user.image_file, viewer, memo.can_access(user,delegate), next_page, cursor, bool(detail))
+    if detail:
+        key = key + (tuple(memo.references['reflist']),tuple(memo.backrefs['reflist']))
+    return key
+
+
+@pass_context
+def memo_card(context, memo):
+    """memo_template.html for memo... from the cache when it can be"""
+    variables = dict(context.get_all(),memo=memo)
+    key = None
+    if current_app.config['FRAGMENT_CACHE_SIZE'] > 0:
+        cursor = request.args.get('cursor') if has_request_context() else None
+        key = card_key(memo,*[variables.get(name) for name in ('user','delegate','detail','next_page')],cursor)
+
+    if key is not None:
+        html = _cards.get(key)
+        if html is not None:
+            return html
+
+    html = Markup(context.environment.get_template('memo_template.html').render(variables))
+    if key is not None:
+        _cards.maxsize = current_app.config['FRAGMENT_CACHE_SIZE']
+        _cards.set(key,html)
+    return html
+
+
+def clear():
+    _cards.clear()
@@ -0,0 +1,610 @@
+"""
+The bulk import of a legacy memo archive
+
+CsvImport reads a CSV file where each row is one Active memo:
+    replace,current-owner,new-owner,confidential,doc,number,rev,title,date
+and its files are in import_system/<current-owner>/<doc>/<rev>/ beside the CSV.
+JsonImport reads a tree of the meta-<user>-<number>-<version>.json files that
+Memo.saveJson writes, with the files beside them or in the blobstore.
+
+Everything is checked before anything is written, against the users and memos read
+from the database once.  The memos are then imported batch_size at a time: the
+files of the batch are copied into the blobstore by a pool of threads, then the
+memos and their rows are inserted with one statement per table and committed
+together.  The CSV import writes the number of the last line of each batch to a
+checkpoint file, so an import that was stopped can be started again where it left off.
+"""
+import csv
+import json
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert
+
+from memos import db
+from memos import blobstore
+from memos import search as search_index
+from memos.flask_sqlalchemy_txns import transaction
+from memos.models.Memo import Memo
+from memos.models.MemoDistribution import MemoDistribution
+from memos.models.MemoFile import MemoFile
+from memos.models.MemoReference import MemoReference
+from memos.models.MemoSignature import MemoSignature
+from memos.models.MemoState import MemoState
+from memos.models.User import User
+from memos.revletter import valid_rev
+
+COLUMNS = ('current-owner','doc','number','rev','title','date')
+
+
+class InvalidImport(Exception):
+    """The CSV can not be imported... the message has every problem that was found"""
+    pass
+
+
+class Row:
+    """One checked line of the CSV"""
+    def __init__(self, line, fields, files_dir, files):
+        self.line = line
+        self.owner = fields['current-owner']
+        self.new_owner = fields.get('new-owner') or None
+        self.replace = bool(fields.get('replace'))
+        self.confidential = fields.get('confidential') or ''
+        self.doc = fields['doc']
+        self.number = int(fields['number'])
+        self.version = fields['rev']
+        self.title = fields['title']
+        self.date = datetime.strptime(fields['date'],"%x")
+        self.files_dir = files_dir
+        self.files = files
+
+    @property
+    def username(self):
+        """The user who will own the memo"""
+        return self.new_owner or self.owner
+
+    @property
+    def key(self):
+        return (self.username,self.number,self.version)
+
+
+class Stats:
+    def __init__(self):
+        self.rows = 0
+        self.skipped = 0
+        self.files = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+
+    @property
+    def seconds(self):
+        return max(time.monotonic() - self.start,1e-6)
+
+    def __str__(self):
+        return (f"{self.rows} memos {self.files} files {self.bytes/1e6:.1f} MB {self.skipped} skipped in {self.seconds:.1f}s"
+                f" ({self.rows/self.seconds:.1f} rows/s {self.bytes/1e6/self.seconds:.1f} MB/s)")
+
+
+def _files(files_dir):
+    """The files to attach from files_dir... the pdf files first"""
+    names = sorted(name for name in os.listdir(files_dir) if os.path.isfile(os.path.join(files_dir,name)))
+    names = [name for name in names if '?' not in name]
+    return [name for name in names if os.path.splitext(name)[1] == '.pdf'] + \
+           [name for name in names if os.path.splitext(name)[1] != '.pdf']
+
+
+def read_csv(datacsv, user_filter=None, start_line=0):
+    """The checked rows of datacsv after start_line... raises InvalidImport with every problem"""
+    base_dir = os.path.dirname(datacsv)
+    rows = []
+    problems = []
+    keys = {}
+    with open(datacsv, newline='') as csvfile:
+        reader = csv.DictReader(csvfile,delimiter=',')
+        missing = [column for column in COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise InvalidImport(f"{datacsv} does not have the columns {', '.join(missing)}")
+
+        for fields in reader:
+            line = reader.line_num
+            if line <= start_line or (user_filter is not None and fields['current-owner'] != user_filter):
+                continue
+
+            errors = []
+            if not fields['current-owner']:
+                errors.append("no current-owner")
+            if not re.fullmatch('[0-9]+',fields['number'] or ''):
+                errors.append(f"number {fields['number']!r} is not a number")
+            if not valid_rev(fields['rev']):
+                errors.append(f"rev {fields['rev']!r} is not a revision letter")
+            try:
+                datetime.strptime(fields['date'] or '',"%x")
+            except ValueError:
+                errors.append(f"date {fields['date']!r} is not a date")
+            files_dir = os.path.join(base_dir,"import_system",fields['current-owner'] or '',fields['doc'] or '',fields['rev'] or '')
+            if not os.path.isdir(files_dir):
+                errors.append(f"there is no directory {files_dir}")
+            if errors:
+                problems.append(f"line {line}: {', '.join(errors)}")
+                continue
+
+            row = Row(line,fields,files_dir,_files(files_dir))
+            if row.key in keys:
+                problems.append(f"line {line}: {row.username}-{row.number}{row.version} is also on line {keys[row.key]}")
+                continue
+            keys[row.key] = line
+            rows.append(row)
+
+    if problems:
+        raise InvalidImport('\n'.join(problems))
+    return rows
+
+
+def resolve_users(rows, log=print):
+    """The users that own the rows or are on their distributions.  The current owners that
+    are not users are created... a new-owner that is not a user is an error"""
+    tokens = set()
+    for row in rows:
+        tokens.update([row.owner] + ([row.new_owner] if row.new_owner else []) + re.split(r"[\s:;,]+",row.confidential))
+    found = User.lookup(tokens)
+    usernames = {user.username for user in found}
+
+    problems = [f"line {row.line}: new-owner {row.new_owner} is not a user" for row in rows
+                if row.new_owner and row.new_owner not in usernames]
+    if problems:
+        raise InvalidImport('\n'.join(problems))
+
+    for username in sorted({row.owner for row in rows if row.new_owner is None and row.owner not in usernames}):
+        log(f"Creating new user {username}")
+        user = User(username=username,password="*",email="unknown@unknown.local")
+        db.session.add(user)
+        found.append(user)
+    return found
+
+
+class BulkImport:
+    """What the CSV and the JSON imports share: the memos of a batch are inserted with one
+    statement per table, their files are copied into the blobstore by a pool of threads and
+    their meta data files are written by the same pool"""
+    def __init__(self, batch_size=500, workers=8, log=print):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.log = log
+        self.stats = Stats()
+
+    def detach(self, users):
+        """Keep the users that were looked up... the commits of the batches would expire them"""
+        db.session.flush()
+        for user in users:
+            db.session.expunge(user)
+
+    def existing(self, usernames):
+        """{(username,number,version): (memo id, state)} for every memo of the users"""
+        usernames = sorted(usernames)
+        existing = {}
+        for i in range(0,len(usernames),500):
+            query = db.session.query(Memo.id,Memo.user_id,Memo.number,Memo.version,Memo.memo_state).filter(
+                Memo.user_id.in_(usernames[i:i+500]))
+            for memo_id,user_id,number,version,memo_state in query:
+                existing[(user_id,number,version)] = (memo_id,memo_state)
+        return existing
+
+    def copy_files(self, pool, app, files):
+        """Copy the (key, path, filename) files into the blobstore... {key: (sha256, size, mimetype)}.
+        The blobs are content addressed, so a batch that fails only leaves blobs the next try reuses"""
+        MemoFile.hold_blobs()
+        def store(path, filename):
+            with app.app_context():
+                return blobstore.store_file(path,filename)
+        copies = [(key,path,pool.submit(store,path,filename)) for key,path,filename in files]
+        blobs = {}
+        for key,path,copy in copies:
+            try:
+                blobs[key] = copy.result()
+            except OSError as e:
+                self.log(f"Failed to copy {path}: {e}")
+        return blobs
+
+    def insert_memos(self, memo_rows):
+        """Insert the memos (dicts of Memo columns)... {(username,number,version): memo id}"""
+        db.session.execute(insert(Memo),memo_rows)
+        keys = {(row['user_id'],row['number'],row['version']) for row in memo_rows}
+        query = db.session.query(Memo.id,Memo.user_id,Memo.number,Memo.version).filter(
+            Memo.user_id.in_(sorted({key[0] for key in keys})),Memo.number.in_(sorted({key[1] for key in keys})))
+        return {(user_id,number,version):memo_id for memo_id,user_id,number,version in query if (user_id,number,version) in keys}
+
+    def insert_rows(self, model, rows):
+        if rows:
+            db.session.execute(insert(model),rows)
+
+    def file_row(self, memo_id, filename, blob):
+        sha256,size,mimetype = blob
+        self.stats.files = self.stats.files + 1
+        self.stats.bytes = self.stats.bytes + size
+        return dict(memo_id=memo_id,_fname=filename,_uuid=str(uuid.uuid4()),sha256=sha256,size=size,mimetype=mimetype)
+
+    def finish(self, memo_ids, pool):
+        """Write the meta data files of the memos and add them to the search index when the batch commits"""
+        memos = Memo.query.filter(Memo.id.in_(memo_ids)).options(*Memo.loader_options(detail=True)).all()
+        writes = [pool.submit(Memo.write_meta,memo.meta_path(),memo.meta()) for memo in memos]
+        search_index.changed(*memo_ids)
+        for write in writes:
+            write.result()
+        self.stats.rows = self.stats.rows + len(memos)
+
+
+class CsvImport(BulkImport):
+    def __init__(self, datacsv, user_filter=None, batch_size=500, workers=8, checkpoint=None, log=print):
+        super().__init__(batch_size,workers,log)
+        self.datacsv = datacsv
+        self.user_filter = user_filter
+        self.checkpoint = checkpoint or f"{datacsv}.checkpoint"
+
+    def resume_line(self):
+        """The last line of the CSV that the checkpoint says was committed"""
+        try:
+            with open(self.checkpoint) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return 0
+        if checkpoint.get('csv') != os.path.abspath(self.datacsv) or checkpoint.get('user_filter') != self.user_filter:
+            raise InvalidImport(f"{self.checkpoint} is for another import")
+        return checkpoint['line']
+
+    def save_checkpoint(self, line):
+        tmp = f"{self.checkpoint}.tmp"
+        with open(tmp,"w") as f:
+            json.dump({'csv':os.path.abspath(self.datacsv),'user_filter':self.user_filter,'line':line},f)
+        os.replace(tmp,self.checkpoint)
+
+    def run(self, resume=False):
+        """Import the CSV... returns the Stats"""
+        rows = read_csv(self.datacsv,self.user_filter,self.resume_line() if resume else 0)
+        self.stats = Stats()
+        with transaction():
+            self.found = resolve_users(rows,self.log)
+            self.detach(self.found)
+        self.memos = self.existing({row.username for row in rows})
+
+        app = current_app._get_current_object()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for i in range(0,len(rows),self.batch_size):
+                batch = rows[i:i+self.batch_size]
+                self._import_batch(batch,pool,app)
+                self.save_checkpoint(batch[-1].line)
+                self.log(f"Line {batch[-1].line}: {self.stats}")
+
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        return self.stats
+
+    def _import_batch(self, rows, pool, app):
+        batch = []
+        for row in rows:
+            if row.key in self.memos and not row.replace:
+                self.log(f"Memo {row.username}-{row.number}{row.version} {row.doc} already exists... skipping")
+                self.stats.skipped = self.stats.skipped + 1
+            else:
+                batch.append(row)
+        if len(batch) == 0:
+            return
+
+        blobs = self.copy_files(pool,app,[((row.line,name),os.path.join(row.files_dir,name),name) for row in batch for name in row.files])
+
+        with transaction():
+            replaced = [self.memos[row.key][0] for row in batch if row.key in self.memos]
+            for memo in Memo.query.filter(Memo.id.in_(replaced)).all() if replaced else []:
+                self.log(f"Replacing {memo}")
+                memo.cancel(None,validate_user=False)
+
+            distributions = {}
+            memo_rows = []
+            for row in batch:
+                users = User.resolve(re.split(r"[\s:;,]+",row.confidential),self.found)
+                distributions[row.key] = users
+                memo_rows.append(dict(number=row.number,version=row.version,confidential=row.confidential != '',
+                                      distribution=' '.join(users['valid_usernames']),keywords=str(row.doc),title=row.title,
+                                      user_id=row.username,memo_state=MemoState.Active,action_date=row.date,
+                                      create_date=row.date,_signers='',_references=''))
+            ids = self.insert_memos(memo_rows)
+
+            file_rows = []
+            distribution_rows = []
+            for row in batch:
+                memo_id = ids[row.key]
+                for name in row.files:
+                    if (row.line,name) in blobs:
+                        file_rows.append(self.file_row(memo_id,name,blobs[(row.line,name)]))
+                if row.confidential:
+                    distribution_rows.extend(MemoDistribution.rows(memo_id,distributions[row.key]))
+            self.insert_rows(MemoFile,file_rows)
+            self.insert_rows(MemoDistribution,distribution_rows)
+            self.finish(list(ids.values()),pool)
+
+        for row in batch:
+            self.memos[row.key] = (ids[row.key],MemoState.Active)
+
+
+################################################################################
+# The meta-<user>-<number>-<version>.json files written by Memo.saveJson
+################################################################################
+
+def _walk(directory):
+    """The json files under directory"""
+    found = []
+    for root,dirs,files in os.walk(directory):
+        found.extend(os.path.join(root,name) for name in files if name.endswith('.json'))
+    return found
+
+
+def find_jsons(search_path, pool=None):
+    """The json files under search_path... each directory at the top is walked by the pool"""
+    top = sorted(os.path.join(search_path,name) for name in os.listdir(search_path))
+    found = [path for path in top if path.endswith('.json') and os.path.isfile(path)]
+    directories = [path for path in top if os.path.isdir(path)]
+    for jsons in (pool.map(_walk,directories) if pool else map(_walk,directories)):
+        found.extend(jsons)
+    return sorted(found)
+
+
+def _date(record, errors, name):
+    try:
+        return datetime.strptime(record[name],"%m/%d/%Y") if record.get(name) else None
+    except (TypeError, ValueError):
+        errors.append(f"'{name}' {record[name]!r} must be MM/DD/YYYY")
+
+
+def parse_json(json_file):
+    """The memo in json_file and the problems with it that can be found without the database.
+    It runs in a worker process, so it only reads the file"""
+    errors = []
+    try:
+        with open(json_file) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        return {'json_file':json_file}, [f"JSON Invalid {e}"]
+    if not isinstance(data,dict):
+        return {'json_file':json_file}, ["JSON Invalid... it is not an object"]
+
+    directory = os.path.dirname(json_file)
+    memo = {'json_file':json_file,'userid':data.get('userid'),'number':data.get('number'),'version':data.get('version','A'),
+            'title':data.get('title',''),'confidential':data.get('confidential',False),'distribution':data.get('distribution',''),
+            'keywords':data.get('keywords',''),'references':data.get('references',''),'signers':[],'files':[]}
+
+    for name,kind in (('userid',str),('title',str),('confidential',bool),('distribution',str),('keywords',str),('references',str)):
+        if not isinstance(memo[name],kind):
+            errors.append(f"'{name}' invalid type {type(memo[name]).__name__} must be type {kind.__name__}")
+    if memo['number'] is not None and (isinstance(memo['number'],bool) or not isinstance(memo['number'],int)):
+        errors.append(f"'number' invalid type {type(memo['number']).__name__} must be type int")
+    if memo['number'] is None:
+        memo['version'] = 'A'
+    if not valid_rev(memo['version']):
+        errors.append(f"Version {memo['version']} invalid format must be [a-zA-Z]+")
+    else:
+        memo['version'] = memo['version'].upper()
+
+    memo['memo_state'] = MemoState.get_state(data.get('memo_state','MemoState.Active'))
+    if memo['memo_state'] is None:
+        errors.append(f"Memostate={data['memo_state']} illegal string")
+    memo['active_date'] = _date(data,errors,'active_date')
+    memo['obsolete_date'] = _date(data,errors,'obsolete_date')
+
+    signers = data.get('signers',[])
+    if not isinstance(signers,list):
+        errors.append(f"signers must be of type list [['user','MM/DD/YYYY'],...] not {type(signers).__name__}")
+        signers = []
+    for signer in signers:
+        if not isinstance(signer,list) or len(signer) != 2 or not isinstance(signer[0],str):
+            errors.append(f"Illegal signer {signer}")
+            continue
+        memo['signers'].append((signer[0],_date({'signed':signer[1]},errors,'signed')))
+
+    files = data.get('files',[])
+    if not isinstance(files,list):
+        errors.append(f"files key must be of type list not type {type(files).__name__}")
+        files = []
+    for file in files:
+        # [name] is the name in the directory, [name,uuid] is a file before the blobstore and
+        # [name,uuid,sha256] is a blob
+        if not isinstance(file,list) or len(file) not in (1,2,3) or not all(isinstance(part,str) for part in file):
+            errors.append(f"Illegal file {file}")
+        elif len(file) == 3:
+            memo['files'].append((file[0],None,file[2]))
+        else:
+            memo['files'].append((file[0],os.path.join(directory,file[-1]),None))
+    return memo, errors
+
+
+class JsonImport(BulkImport):
+    """Import the memos in a tree of meta data files.  The files are found and read by a pool
+    of processes, then every user and memo they name is checked against what was read from the
+    database once... and against the other memos being imported, so a memo can refer to one
+    that is imported with it.  The memos are inserted in an order where a memo comes after the
+    memos it refers to"""
+    def __init__(self, search_path, batch_size=500, workers=None, log=print):
+        super().__init__(batch_size,workers or os.cpu_count(),log)
+        self.search_path = search_path
+        self.problems = {}
+
+    def read(self):
+        """The memos in the tree... the ones with a problem are in self.problems"""
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            jsons = find_jsons(self.search_path,pool)
+            memos = []
+            for memo,errors in pool.map(parse_json,jsons,chunksize=64):
+                if errors:
+                    self.problems[memo['json_file']] = errors
+                else:
+                    memos.append(memo)
+        return memos
+
+    def check(self, memos):
+        """The memos that can be imported in the order to import them"""
+        tokens = set()
+        for memo in memos:
+            tokens.update([memo['userid']] + re.split(r"[\s:;,]+",memo['distribution']) + [name for name,date in memo['signers']])
+            tokens.update(parts[0] for parts in map(Memo.split_reference,re.split(r"[\s:;,]+",memo['references'])) if parts)
+        self.found = User.lookup(tokens)
+        usernames = {user.username for user in self.found}
+        self.memos = self.existing(usernames)
+
+        # The memos without a number get the next one of their owner
+        numbers = {}
+        for key in list(self.memos) + [(memo['userid'],memo['number'],memo['version']) for memo in memos]:
+            numbers[key[0]] = max(numbers.get(key[0],0),key[1] or 0)
+        for memo in memos:
+            if memo['number'] is None and memo['userid'] in usernames:
+                numbers[memo['userid']] = numbers[memo['userid']] + 1
+                memo['number'] = numbers[memo['userid']]
+            memo['key'] = (memo['userid'],memo['number'],memo['version'])
+
+        # A memo with a problem is not imported... which can be a problem for the memos that refer to it
+        candidates = memos
+        while True:
+            self.importing = {}
+            for memo in candidates:
+                self.importing.setdefault(memo['key'],memo)
+            self.versions = {}
+            for key,(memo_id,state) in self.memos.items():
+                self.versions.setdefault(key[0:2],[]).append((key,state))
+            for key,memo in self.importing.items():
+                self.versions.setdefault(key[0:2],[]).append((key,memo['memo_state']))
+            valid = []
+            for memo in candidates:
+                errors = self._errors(memo,usernames)
+                if errors:
+                    self.problems[memo['json_file']] = errors
+                else:
+                    valid.append(memo)
+            if len(valid) == len(candidates):
+                break
+            candidates = valid
+        return self._order(valid)
+
+    def _errors(self, memo, usernames):
+        errors = []
+        if memo['userid'] not in usernames:
+            errors.append(f"userid {memo['userid']} not in database")
+        if memo['key'] in self.memos:
+            errors.append(f"{memo['userid']}-{memo['number']}{memo['version']} already exists")
+        if self.importing[memo['key']] is not memo:
+            errors.append(f"{memo['userid']}-{memo['number']}{memo['version']} is also in {self.importing[memo['key']]['json_file']}")
+
+        invalid = User.resolve(re.split(r"[\s:;,]+",memo['distribution']),self.found)['invalid_usernames']
+        if invalid:
+            errors.append(f"Invalid User Names in distribution = {invalid}")
+        invalid = [name for name,date in memo['signers'] if name not in usernames]
+        if invalid:
+            errors.append(f"Invalid signers = {invalid}")
+        invalid = [ref for ref in re.split(r"[\s:;,]+",memo['references']) if ref != '' and self._target(ref) is None]
+        if invalid:
+            errors.append(f"Invalid references = {invalid}")
+
+        for filename,path,sha256 in memo['files']:
+            path = blobstore.path(sha256) if sha256 else path
+            if not os.path.exists(path):
+                errors.append(f"File does not exist {path}")
+        return errors
+
+    def _target(self, reference):
+        """The key of the Active or Obsolete memo that reference is to... in the database or being imported"""
+        parts = Memo.split_reference(reference)
+        if parts is None:
+            return None
+        username,number,version = parts
+        for key,state in self.versions.get((username,number),[]):
+            if (version is None or key[2] == version.upper()) and state in (MemoState.Active,MemoState.Obsolete):
+                return key
+        return None
+
+    def _depends(self, memo):
+        """The memos being imported that memo refers to"""
+        targets = [self._target(ref) for ref in re.split(r"[\s:;,]+",memo['references']) if ref != '']
+        return [self.importing[target] for target in targets if target in self.importing]
+
+    def _order(self, memos):
+        """The memos with each one after the memos it refers to (a cycle is left in the order it was found)"""
+        ordered = []
+        placed = set()
+        for memo in memos:
+            if memo['key'] in placed:
+                continue
+            visiting = {memo['key']}
+            stack = [(memo,iter(self._depends(memo)))]
+            while stack:
+                current,targets = stack[-1]
+                target = next(targets,None)
+                if target is None:
+                    stack.pop()
+                    placed.add(current['key'])
+                    ordered.append(current)
+                elif target['key'] not in placed and target['key'] not in visiting:
+                    visiting.add(target['key'])
+                    stack.append((target,iter(self._depends(target))))
+        return ordered
+
+    def report(self, memos):
+        for json_file in sorted(self.problems):
+            self.log(f"{json_file}:")
+            for error in self.problems[json_file]:
+                self.log(f"    {error}")
+        self.log(f"{len(memos)} memos can be imported, {len(self.problems)} files have problems")
+
+    def run(self, dry_run=False):
+        """Check the tree (and import what is valid unless it is a dry run)... returns the Stats"""
+        memos = self.check(self.read())
+        self.report(memos)
+        self.stats = Stats()
+        self.stats.skipped = len(self.problems)
+        if dry_run:
+            return self.stats
+        self.detach(self.found)
+
+        app = current_app._get_current_object()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for i in range(0,len(memos),self.batch_size):
+                self._import_batch(memos[i:i+self.batch_size],pool,app)
+                self.log(f"{self.stats}")
+        return self.stats
+
+    def _import_batch(self, batch, pool, app):
+        blobs = self.copy_files(pool,app,[((memo['key'],i),blobstore.path(sha256) if sha256 else path,filename)
+                                          for memo in batch for i,(filename,path,sha256) in enumerate(memo['files'])])
+        with transaction():
+            memo_rows = []
+            for memo in batch:
+                action_date = memo['obsolete_date'] or memo['active_date'] or datetime.utcnow()
+                memo_rows.append(dict(user_id=memo['userid'],number=memo['number'],version=memo['version'],title=memo['title'],
+                                      keywords=memo['keywords'],confidential=memo['confidential'],distribution=memo['distribution'],
+                                      memo_state=memo['memo_state'],create_date=memo['active_date'],active_date=memo['active_date'],
+                                      obsolete_date=memo['obsolete_date'],action_date=action_date,
+                                      _signers=' '.join(name for name,date in memo['signers']),_references=memo['references']))
+            ids = self.insert_memos(memo_rows)
+
+            file_rows = []
+            signature_rows = []
+            reference_rows = []
+            distribution_rows = []
+            for memo in batch:
+                memo_id = ids[memo['key']]
+                for i,(filename,path,sha256) in enumerate(memo['files']):
+                    if (memo['key'],i) in blobs:
+                        file_rows.append(self.file_row(memo_id,filename,blobs[(memo['key'],i)]))
+                for name,date in memo['signers']:
+                    signature_rows.append(dict(memo_id=memo_id,signer_id=name,delegate_id=name,signed=True,date_signed=date))
+                for ref in re.split(r"[\s:;,]+",memo['references']):
+                    if ref != '':
+                        username,number,version = Memo.split_reference(ref)
+                        reference_rows.append(dict(source_id=memo_id,ref_user_id=username,ref_memo_number=number,
+                                                   ref_memo_version=version))
+                distribution_rows.extend(MemoDistribution.rows(memo_id,User.resolve(re.split(r"[\s:;,]+",memo['distribution']),self.found)))
+            self.insert_rows(MemoFile,file_rows)
+            self.insert_rows(MemoSignature,signature_rows)
+            self.insert_rows(MemoReference,reference_rows)
+            self.insert_rows(MemoDistribution,distribution_rows)
+            self.finish(list(ids.values()),pool)
@@ -0,0 +1,58 @@
+"""
+How long a worker spends importing before it can serve a request
+
+The app is created in a fresh interpreter with python -X importtime and the
+report lists the top level packages by their cumulative import time.  configure
+--importtime prints it and fails if the total is over the budget.
+"""
+import subprocess
+import sys
+
+# What a uwsgi worker does when it loads app.py
+STARTUP = """
+try:
+    import settings_local
+except ImportError:
+    pass
+from memos import create_app
+create_app()
+"""
+
+
+def parse(stderr):
+    """The (module, self us, cumulative us, depth) of every import in the -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue        # the header
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return rows
+
+
+def profile(code=STARTUP, cwd=None):
+    result = subprocess.run([sys.executable,"-X","importtime","-c",code],cwd=cwd,
+                            capture_output=True,text=True,check=True)
+    return parse(result.stderr)
+
+
+def packages(rows):
+    """The cumulative time of each top level package, slowest first.  A package includes
+    the packages it imported first (e.g. flask_sqlalchemy includes sqlalchemy)"""
+    totals = [(name,cumulative_us) for name,self_us,cumulative_us,depth in rows if "." not in name]
+    return sorted(totals,key=lambda item: item[1],reverse=True)
+
+
+def total(rows):
+    """The time spent importing in microseconds"""
+    return sum(cumulative_us for name,self_us,cumulative_us,depth in rows if depth == 0)
+
+
+def report(rows, top=20):
+    lines = [f"{us/1000:8.1f} ms  {package}" for package,us in packages(rows)[:top]]
+    lines.append(f"{total(rows)/1000:8.1f} ms  total")
+    return "\n".join(lines)
@@ -0,0 +1,114 @@
+"""
+Keyset (seek) pagination
+
+A page is found from the key of the last row on the page before it rather than by
+counting rows with OFFSET, so page 500 costs the same as page 1.  The keys are the
+columns the list is ordered by, newest first, ending with a unique column e.g.
+(Memo.action_date, Memo.id).  The next and previous pages are passed around as
+signed tokens so the client can not make up its own.
+"""
+from datetime import datetime
+
+from flask import current_app
+from itsdangerous import BadData, URLSafeSerializer
+from sqlalchemy import and_, or_
+
+from memos import db
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'],salt='memos-page')
+
+
+def encode(direction, values):
+    values = [value.isoformat() if isinstance(value,datetime) else value for value in values]
+    return _serializer().dumps([direction,values])
+
+
+def decode(token, keys):
+    """The direction ('next' or 'prev') and the key values of a token... None for the first
+    page or a token that was not made by encode"""
+    if not token:
+        return None
+    try:
+        direction,values = _serializer().loads(token)
+        if direction not in ('next','prev') or len(values) != len(keys):
+            return None
+        return direction,[datetime.fromisoformat(value) if isinstance(key.type,db.DateTime) else value
+                          for key,value in zip(keys,values)]
+    except (BadData, TypeError, ValueError):
+        return None
+
+
+def _beyond(keys, values, prev):
+    """The rows after values in the order of keys (descending)... or before them"""
+    key,value = keys[0],values[0]
+    beyond = key > value if prev else key < value
+    if len(keys) == 1:
+        return beyond
+    return or_(beyond,and_(key == value,_beyond(keys[1:],values[1:],prev)))
+
+
+class KeysetPage:
+    def __init__(self, items, per_page, next_token=None, prev_token=None, total=None, total_exact=True):
+        self.items = items
+        self.per_page = per_page
+        self.next_token = next_token
+        self.prev_token = prev_token
+        self.total = total              # None unless it was asked for
+        self.total_exact = total_exact  # False when the count stopped at the limit
+
+    @property
+    def has_next(self):
+        return self.next_token is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_token is not None
+
+
+def paginate(query, keys, token=None, per_page=None, count_limit=None):
+    """The page of query at token, ordered by keys newest first.  With count_limit the
+    rows are counted up to that many, which is the total when there are fewer"""
+    if per_page is None:
+        per_page = 20
+
+    position = decode(token,keys)
+    prev = position is not None and position[0] == 'prev'
+
+    total = None
+    total_exact = True
+    if count_limit:
+        total = query.order_by(None).limit(count_limit+1).count()
+        if total > count_limit:
+            total,total_exact = count_limit,False
+
+    page = query
+    if position is not None:
+        page = page.filter(_beyond(keys,position[1],prev))
+    page = page.order_by(*[key.asc() if prev else key.desc() for key in keys])
+    rows = page.limit(per_page+1).all()
+
+    def key_of(row):
+        return [getattr(row,key.key) for key in keys]
+
+    return page_of(rows,per_page,position,key_of,total,total_exact)
+
+
+def page_of(rows, per_page, position, key_of, total=None, total_exact=True):
+    """The KeysetPage of up to per_page+1 rows read from position (from decode)... in
+    ascending order for a 'prev' position.  key_of(row) is the list of its key values"""
+    prev = position is not None and position[0] == 'prev'
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if prev:
+        rows.reverse()
+
+    next_token = prev_token = None
+    if len(rows) > 0:
+        if (more and not prev) or (prev and position is not None):
+            next_token = encode('next',key_of(rows[-1]))
+        if (more and prev) or (not prev and position is not None):
+            prev_token = encode('prev',key_of(rows[0]))
+
+    return KeysetPage(rows,per_page,next_token,prev_token,total,total_exact)
@@ -0,0 +1,101 @@
+"""
+The outbound mail queue
+
+Memo notifications are written to the MailOutbox table in the same transaction as
+the change that caused them.  When that commits a background worker sends every
+message that is due over one SMTP connection.  A message that fails is retried
+with an exponential backoff and given up on after MAX_ATTEMPTS.  The worker is
+started by the first request of each process and then looks for due messages every
+minute, so the messages left from before a restart and the retries are sent
+without anything new being queued.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from memos import db, mail
+from memos.background import Worker
+from memos.models.MailOutbox import MailOutbox
+
+MAX_ATTEMPTS = 8
+LEASE = timedelta(minutes=10)       # how long a claimed message is hidden from the other workers
+
+
+def backoff(attempts):
+    """30 seconds, 1 minute, 2 minutes... up to an hour"""
+    return timedelta(seconds=min(30*2**(attempts-1),3600))
+
+
+def _failed(entry,error,now):
+    entry.attempts = entry.attempts + 1
+    entry.error = str(error)[:4000]
+    if entry.attempts >= MAX_ATTEMPTS:
+        entry.next_attempt = None
+        current_app.logger.error(f"Giving up on mail {entry.id} to {entry.recipients}: {error}")
+    else:
+        entry.next_attempt = now + backoff(entry.attempts)
+        current_app.logger.warning(f"Mail {entry.id} failed attempt {entry.attempts}: {error}")
+
+
+def send_pending(limit=100):
+    """Send the messages that are due... returns the number that were sent"""
+    now = datetime.utcnow()
+    claimed = [entry for entry in MailOutbox.pending(now,limit) if entry.claim(now,now+LEASE)]
+    db.session.commit()
+    if len(claimed) == 0:
+        return 0
+
+    sent = 0
+    failed = set()
+    try:
+        with mail.connect() as conn:
+            for entry in claimed:
+                try:
+                    conn.send(entry.message())
+                    entry.sent = datetime.utcnow()
+                    entry.error = None
+                    sent = sent + 1
+                except Exception as e:
+                    _failed(entry,e,datetime.utcnow())
+                    failed.add(entry.id)
+    except Exception as e:  # the connection to the server failed
+        for entry in claimed:
+            if entry.sent is None and entry.id not in failed:
+                _failed(entry,e,datetime.utcnow())
+
+    db.session.commit()
+    return sent
+
+
+def queue(subject,recipients,body,reply_to=None):
+    """Send a message once the current transaction commits"""
+    MailOutbox.queue(subject,current_app.config['MAIL_USERNAME'],recipients,body,reply_to=reply_to,
+                     batch=current_app.config['MAIL_BATCH'])
+
+
+def _drain():
+    while send_pending() > 0:
+        pass
+
+worker = Worker('memos-mailer',_drain)
+
+
+def init_app(app):
+    @app.before_request
+    def _start_worker():
+        # The tests call send_pending themselves
+        if not app.testing:
+            worker.start(app)
+
+
+@event.listens_for(Session,'after_commit')
+def _wake_after_commit(session):
+    # The tests call send_pending themselves
+    if session.info.pop('mail_queued',False) and not current_app.testing:
+        worker.wake(current_app._get_current_object())
+
+@event.listens_for(Session,'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('mail_queued',None)
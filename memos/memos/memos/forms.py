@@ -50,6 +50,7 @@ class MemoForm(FlaskForm):
 class MemoSearch(FlaskForm):
     title = StringField('Title')
     keywords = StringField('Keywords')
+    text = StringField('Text (title, keywords and documents)')
     memo_ref = StringField('Memo')
     username = StringField('User')
     inbox = StringField('Inbox')
@@ -3,8 +3,12 @@ Memo Routes
 """
 import os
 import re
+import mimetypes
+import unicodedata
+from urllib.parse import quote
 from flask import (render_template, url_for, flash,current_app,
-                   redirect, request, abort, Blueprint, send_from_directory)
+                   redirect, request, abort, Blueprint, send_file, make_response, jsonify)
+from werkzeug.http import parse_content_range_header
 from flask_login import current_user, login_required
 from wtforms import SubmitField
 from memos.flask_sqlalchemy_txns import transaction
@@ -15,6 +19,10 @@ from memos.memos.forms import MemoForm, MemoSearch
 from memos.models.Memo import Memo
 from memos.models.MemoFile import MemoFile
 from memos.models.MemoActivity import MemoActivity
+from memos import search as search_index
+from memos import blobstore
+from memos import uploads
+from memos import conditional
 
 memos = Blueprint('memos', __name__)
 
@@ -26,8 +34,12 @@ memos = Blueprint('memos', __name__)
 def main(username=None,memo_number=None,memo_version=None):
     """ This route is used to display the list of memos """
     with transaction():
+        etag = conditional.page_etag()
+        response = conditional.not_modified(etag)
+        if response is not None:
+            return response
+
         pagesize = User.get_pagesize(current_user)
-        page = request.args.get('page', 1, type=int)
         detail = request.args.get('detail')
         showAll = request.args.get('showAll')
 
@@ -57,8 +69,10 @@ def main(username=None,memo_number=None,memo_version=None):
         else:
             user = current_user
 
-        memo_list = Memo.get_memo_list(username=username,memo_number=memo_number,
-                                    memo_version=memo_version,page=page,pagesize=pagesize,showAll=showAll)
+        memo_list = Memo.get_memo_list(username=username,memo_number=memo_number,memo_version=memo_version,
+                                    cursor=request.args.get('cursor'),pagesize=pagesize,showAll=showAll,detail=detail,
+                                    count_limit=current_app.config['PAGE_COUNT_LIMIT'])
+        Memo.preload(memo_list.items,user,user,detail)
 
         if len(memo_list.items) == 0:
             flash('No memos match that criteria','danger')
@@ -69,10 +83,20 @@ def main(username=None,memo_number=None,memo_version=None):
 
         next_page = "memos.main"
 
-        return render_template('memo.html', config=current_app.config,memos=memo_list, title="memo",user=user,delegate=user,
-                            signer=None, detail=detail,next_page=next_page,page=page,
-                            url_params=url_params,showAll=showAll)
+        return conditional.validated(render_template('memo.html', config=current_app.config,memos=memo_list, title="memo",user=user,delegate=user,
+                            signer=None, detail=detail,next_page=next_page,
+                            url_params=url_params,showAll=showAll),etag)
+
 
+def set_inline_filename(response,filename):
+    """The Content-Disposition header the same way send_file makes it"""
+    try:
+        filename.encode("ascii")
+        names = {"filename": filename}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+        names = {"filename": simple, "filename*": f"UTF-8''{quote(filename, safe='')}"}
+    response.headers.set("Content-Disposition", "inline", **names)
 
 @memos.route("/file/memo/<string:username>/<int:memo_number>/<string:memo_version>/<string:uuid>")
 def getfile(username,memo_number,memo_version,uuid):
@@ -92,15 +116,46 @@ def getfile(username,memo_number,memo_version,uuid):
             MemoHistory.activity(memo=memo,memo_activity=MemoActivity.IllegalFile,user=user)
             abort(403)
 
-        current_app.logger.info(f"memo_file = {memo.files}")
-        for file in memo.files:
-            if file.uuid == uuid:
-                directory = os.path.join('static','memos',str(memo.user_id),str(memo_number),
-                    memo_version)
-                return send_from_directory(directory,file.uuid,download_name=file.filename,
-                    as_attachment=False)
+        file = MemoFile.find(memo.id,uuid)
+        if file is None:
+            return abort(404)
 
-        return abort(404)
+        # nginx sends the file from an internal location once the access check has passed
+        accel = current_app.config['FILE_ACCEL_REDIRECT']
+        if accel:
+            response = make_response('')
+            response.headers['X-Accel-Redirect'] = f"{accel.rstrip('/')}/{file.get_relative_path(memo)}"
+            response.headers['Content-Type'] = file.mimetype or mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
+            set_inline_filename(response,file.filename)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        # send_file answers Range, If-Range and If-None-Match requests from the ETag... which is the
+        # hash of the content for the files in the blobstore
+        path = file.get_path(memo)
+        if not os.path.exists(path):
+            return abort(404)
+        response = send_file(path,download_name=file.filename,mimetype=file.mimetype,
+            as_attachment=False,conditional=True,etag=file.sha256 or True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+def upload_limit(memo):
+    """The largest file that can be attached to memo... None if there is no limit"""
+    limits = []
+    if current_app.config['MAX_FILE_SIZE'] is not None:
+        limits.append(current_app.config['MAX_FILE_SIZE'])
+    if current_app.config['USER_QUOTA'] is not None:
+        limits.append(max(current_app.config['USER_QUOTA'] - Memo.get_file_bytes(memo.user_id),0))
+    return min(limits) if limits else None
+
+def attach_file(memo,filename,blob):
+    mfile = MemoFile(memo_id=memo.id,filename=filename)
+    mfile.set_blob(blob)
+    mfile.save()
+    memo.forget_rows()
+    search_index.file_attached(memo,mfile)
+    return mfile
 
 def process_file(new_memo,formfield):
     """This function will take the formfield, save the file
@@ -108,12 +163,102 @@ def process_file(new_memo,formfield):
     with transaction():
         if formfield.data:
             f = formfield.data
-            # make a directory
-            path = new_memo.get_fullpath()
-            os.makedirs(path,exist_ok=True)
-            mfile = MemoFile(memo_id=new_memo.id,filename=f.filename)
-            mfile.save()
-            f.save(os.path.join(path, mfile.uuid))
+            MemoFile.hold_blobs()
+            try:
+                blob = blobstore.store_upload(f,limit=upload_limit(new_memo))
+            except blobstore.UploadError as e:
+                flash(f'{e}', 'danger')
+                return
+            attach_file(new_memo,f.filename,blob)
+
+# A large file is sent in pieces so that it does not have to fit in one request:
+#   POST /upload/<user>/<number>/<version>  {"filename":..., "size":...}  -> {"upload":id, "offset":0}
+#   PUT  /upload/<id>  with Content-Range: bytes <first>-<last>/<size>    -> {"offset":...}
+#   GET  /upload/<id>                                                      -> {"offset":...}
+# The PUT that completes the file answers 201 with the uuid of the new memo file
+@memos.route("/upload/<string:username>/<int:memo_number>/<string:memo_version>",methods=['POST'])
+@login_required
+def upload_start(username,memo_number,memo_version):
+    with transaction():
+        memo = Memo.find(username=username,memo_number=memo_number,memo_version=memo_version)
+        if memo is None:
+            abort(404)
+        if not memo.can_cancel(current_user):   # only the drafts of the owner & delegates
+            abort(403)
+
+        args = request.get_json(silent=True) or request.form
+        filename = args.get('filename')
+        try:
+            total = int(args.get('size'))
+        except (TypeError, ValueError):
+            total = None
+        if not filename or total is None:
+            abort(400)
+
+        try:
+            upload_id = uploads.start(memo.id,current_user.username,filename,total,upload_limit(memo))
+        except blobstore.UploadError as e:
+            return jsonify(error=f'{e}'), 413
+
+    response = jsonify(upload=upload_id,offset=0)
+    response.headers['Location'] = url_for('memos.upload_piece',upload_id=upload_id)
+    return response, 201
+
+def _find_upload(upload_id):
+    upload = uploads.find(upload_id)
+    if upload is None:
+        abort(404)
+    if upload['user'] != current_user.username:
+        abort(403)
+    return upload
+
+@memos.route("/upload/<string:upload_id>",methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    upload = _find_upload(upload_id)
+    return jsonify(offset=upload['offset'],size=upload['total'])
+
+@memos.route("/upload/<string:upload_id>",methods=['PUT'])
+@login_required
+def upload_piece(upload_id):
+    upload = _find_upload(upload_id)
+
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if content_range is None:
+        first = upload['offset'] if request.content_length == 0 else None
+    elif content_range.length != upload['total']:
+        first = None
+    else:
+        first = content_range.start
+    if first is None:
+        abort(400)
+
+    try:
+        offset = uploads.append(upload,first,request.stream)
+    except blobstore.UploadError as e:
+        return jsonify(error=f'{e}'), 413
+
+    if offset is None:
+        # the piece is not where the upload is... the client carries on from the offset
+        upload = _find_upload(upload_id)
+        return jsonify(offset=upload['offset'],size=upload['total']), 409
+
+    if offset < upload['total']:
+        return jsonify(offset=offset,size=upload['total'])
+
+    with transaction():
+        MemoFile.hold_blobs()
+        blob = uploads.finish(upload)
+        if blob is None:
+            abort(404)
+
+        memo = Memo.query.get(upload['memo_id'])
+        if memo is None or not memo.can_cancel(current_user):
+            MemoFile.release(blob[0])
+            abort(403)
+        mfile = attach_file(memo,upload['filename'],blob)
+        memo.save()
+        return jsonify(offset=offset,size=upload['total'],uuid=mfile.uuid,filename=mfile.filename), 201
 
 @memos.route("/cu/memo",methods=['GET', 'POST'])
 @memos.route("/cu/memo/<string:username>",methods=['GET'])
@@ -229,7 +374,6 @@ def inbox(username=None):
     """ this function will return all of the memos in the users inbox"""
     with transaction():
         pagesize = User.get_pagesize(current_user)
-        page = request.args.get('page', 1, type=int)
         next_page = 'memos.inbox'
 
         if username is None:
@@ -243,7 +387,8 @@ def inbox(username=None):
         if not user.is_delegate(current_user):
             return abort(403)
 
-        memo_list = Memo.get_inbox(user,page,pagesize)
+        memo_list = Memo.get_inbox(user,request.args.get('cursor'),pagesize,current_app.config['PAGE_COUNT_LIMIT'])
+        Memo.preload(memo_list.items,user,delegate)
         if len(memo_list.items) == 0:
             flash('No memos match that criteria','danger')
         inbox_list = [user] + [current_user] + current_user.delegate_for['users']
@@ -266,7 +411,6 @@ def drafts(username=None):
     user (or specified user)"""
     with transaction():
         pagesize = User.get_pagesize(current_user)
-        page = request.args.get('page', 1, type=int)
         next_page = 'memos.drafts'
 
         if username is None:
@@ -280,7 +424,8 @@ def drafts(username=None):
         if not user.is_delegate(current_user):    
             return abort(403)
 
-        memo_list = Memo.get_drafts(user,page,pagesize)
+        memo_list = Memo.get_drafts(user,request.args.get('cursor'),pagesize,current_app.config['PAGE_COUNT_LIMIT'])
+        Memo.preload(memo_list.items,user,delegate)
         if len(memo_list.items) == 0:
             flash('No memos match that criteria','danger')
 
@@ -293,6 +438,29 @@ def drafts(username=None):
         return render_template('memo.html', config=current_app.config,memos=memo_list, title=f"Inbox {username}", user=user, delegate=delegate,next_page=next_page, url_params=url_params)
 
 
+@memos.route("/distributed")
+@login_required
+def distributed():
+    """this function will return all of the active memos that have the current
+    user on the distribution"""
+    with transaction():
+        pagesize = User.get_pagesize(current_user)
+
+        user = current_user
+        delegate = current_user
+
+        memo_list = Memo.get_distributed(user,request.args.get('cursor'),pagesize,current_app.config['PAGE_COUNT_LIMIT'])
+        Memo.preload(memo_list.items,user,delegate)
+        if len(memo_list.items) == 0:
+            flash('No memos match that criteria','danger')
+
+        url_params = {}
+        next_page = "memos.distributed"
+
+        return render_template('memo.html', config=current_app.config,memos=memo_list, title=f"Distributed {user.username}", legend=f'Distributed To: {user.username}',
+                            user=user, delegate=delegate,next_page=next_page, url_params=url_params)
+
+
 ###########################################################################
 # State Machine Functions
 ###########################################################################
@@ -331,7 +499,7 @@ def unsign(username,memo_number,memo_version):
     """this function will attempt to unsign a memo"""
     with transaction():
         next_page = request.args.get('next_page', type=str)
-        page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor', type=str)
 
         if next_page is None:
             next_page = "memos.main"
@@ -351,13 +519,13 @@ def unsign(username,memo_number,memo_version):
         if memo:
             if memo.unsign(signer,delegate):
                 flash(f'Unsign {memo} success', 'success')
-                return redirect(url_for('memos.main'))
+                return redirect(url_for(next_page,cursor=cursor,next_page=next_page))
             else:
                 flash(f'Unsign {memo} Failed', 'danger')
         else:
             flash(f'Unsign {username}-{memo_number}-{memo_version} Failed', 'danger')
 
-        return redirect(url_for(next_page,page=page,next_page=next_page))
+        return redirect(url_for(next_page,cursor=cursor,next_page=next_page))
 
 
 @memos.route("/obsolete/memo/<string:username>/<int:memo_number>/<string:memo_version>")
@@ -366,12 +534,12 @@ def obsolete(username,memo_number,memo_version):
     """Attempt to obsolete a memo"""
     with transaction():
         next_page = request.args.get('next_page', type=str)
-        page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor', type=str)
 
         if next_page is None:
             next_page = "memos.main"
 
-        current_app.logger.info(f"Next Page = {next_page} page={page}")
+        current_app.logger.info(f"Next Page = {next_page} cursor={cursor}")
 
         delegate = current_user
 
@@ -385,7 +553,7 @@ def obsolete(username,memo_number,memo_version):
         else:
             flash(f'Obsolete {username}-{memo_number}-{memo_version } Failed', 'danger')
 
-        return redirect(url_for(next_page,page=page,next_page=next_page))
+        return redirect(url_for(next_page,cursor=cursor,next_page=next_page))
 
 
 @memos.route("/cancel/memo/<string:username>/<int:memo_number>/<string:memo_version>",methods=['GET'])
@@ -394,7 +562,7 @@ def cancel(username=None,memo_number=0,memo_version=0):
     """Attempt to cancel a memo - only memos in the draft state"""
     with transaction():
         next_page = request.args.get('next_page', type=str)
-        page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor', type=str)
 
         if next_page is None:
             next_page = "memos.main"
@@ -412,7 +580,7 @@ def cancel(username=None,memo_number=0,memo_version=0):
         else:
             flash(f'Cannot cancel memo {username}-{memo_number}-{memo_version}', 'danger')
 
-        return redirect(url_for(next_page,page=page,next_page=next_page))
+        return redirect(url_for(next_page,cursor=cursor,next_page=next_page))
 
 @memos.route("/reject/memo/<string:username>/<int:memo_number>/<string:memo_version>")
 @login_required
@@ -420,7 +588,7 @@ def reject(username,memo_number,memo_version):
     """Attempt to reject a memo in the signoff state"""
     with transaction():
         next_page = request.args.get('next_page', type=str)
-        page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor', type=str)
 
         if next_page is None:
             next_page = "memos.main"
@@ -445,14 +613,13 @@ def reject(username,memo_number,memo_version):
         else:
             flash(f'Cannot unsign memo {username}-{memo_number}-{memo_version}', 'danger')
 
-        return redirect(url_for(next_page,page=page,next_page=next_page))
+        return redirect(url_for(next_page,cursor=cursor,next_page=next_page))
 
 @memos.route("/search",methods=['GET', 'POST'])
 def search():
     """The route to handle searching"""
     with transaction():
         pagesize = User.get_pagesize(current_user)
-        page = request.args.get('page', 1, type=int)
         detail = request.args.get('detail')
         search_param = request.args.get('search')
         next_page = 'memos.search'
@@ -472,30 +639,29 @@ def search():
 
         if form.validate_on_submit():
 
-            if form.title.data and form.title.data != '':
-                memos_found = Memo.search(title=form.title.data,page=page,pagesize=pagesize)
-                if len(memos_found.items) == 0:
-                    flash('No memos match that criteria','danger')
-                search_param = f"title:{form.title.data}"
-                url_params['search'] = search_param
-                return render_template('memo.html', config=current_app.config,memos=memos_found, title="memo",user=user,delegate=user,detail=detail,next_page=next_page,url_params =url_params)
+            fields = {}
+            for field in ('title','keywords','text'):
+                value = getattr(form,field).data
+                if value and value != '':
+                    fields[field] = value
 
-            if form.keywords.data and form.keywords.data != '':
-                memos_found = Memo.search(keywords=form.keywords.data,page=page,pagesize=pagesize)
+            if len(fields) > 0:
+                memos_found = Memo.search(cursor=request.args.get('cursor'),pagesize=pagesize,detail=detail,user=user,
+                                          count_limit=current_app.config['PAGE_COUNT_LIMIT'],**fields)
+                Memo.preload(memos_found.items,user,user,detail)
                 if len(memos_found.items) == 0:
                     flash('No memos match that criteria','danger')
-                search_param = f"keywords:{form.keywords.data}"
-                url_params['search'] = search_param
+                url_params.update(fields)
                 return render_template('memo.html', config=current_app.config,memos=memos_found, title="memo",user=user,delegate=user,detail=detail,next_page=next_page,url_params =url_params)
 
             if form.memo_ref.data and form.memo_ref.data != '':
-                return redirect(url_for("memos.main",username=form.memo_ref.data,page=page))
+                return redirect(url_for("memos.main",username=form.memo_ref.data))
 
             if form.username.data and form.username.data != '':
-                return redirect(url_for("memos.main",username=form.username.data,page=page))
+                return redirect(url_for("memos.main",username=form.username.data))
 
             if form.inbox.data and form.inbox.data != '':
-                return redirect(url_for("memos.inbox",username=form.inbox.data,page=page))
+                return redirect(url_for("memos.inbox",username=form.inbox.data))
 
             return render_template('memo_search.html', config=current_app.config,title='Memo Search ',legend='Search',form=form)
 
@@ -503,22 +669,32 @@ def search():
     # Everything below here is GET
         url_params = {}
 
+        fields = {}
+        for field in ('title','keywords','text'):
+            if request.args.get(field):
+                fields[field] = request.args.get(field)
+
+        # search=title:xxx is the original single field form of the query
         if search_param is not None:
-            title = re.split('^title:',search_param,maxsplit=1)
-            keywords = re.split('^keywords:',search_param,maxsplit=1)
-            if len(title) == 2:
-                memos_found = Memo.search(title=title[1],page=page,pagesize=pagesize)
-                if len(memos_found.items) == 0:
-                    flash('No memos match that criteria','danger')
-                url_params['search']= f'title:{title[1]}'
-            if len(keywords) == 2:
-                memos_found = Memo.search(keywords=keywords[1],page=page,pagesize=pagesize)
-                if len(memos_found.items) == 0:
-                    flash('No memos match that criteria','danger')
-                url_params['search']= f'keywords:{keywords[1]}'
+            parts = re.split('^(title|keywords|text):',search_param,maxsplit=1)
+            if len(parts) == 3:
+                fields[parts[1]] = parts[2]
+
+        if len(fields) > 0:
+            etag = conditional.page_etag(search_index.version())
+            response = conditional.not_modified(etag)
+            if response is not None:
+                return response
+
+            memos_found = Memo.search(cursor=request.args.get('cursor'),pagesize=pagesize,detail=detail,user=user,
+                                      count_limit=current_app.config['PAGE_COUNT_LIMIT'],**fields)
+            Memo.preload(memos_found.items,user,user,detail)
+            if len(memos_found.items) == 0:
+                flash('No memos match that criteria','danger')
+            url_params.update(fields)
 
             next_page = "memos.search"
-            return render_template('memo.html', config=current_app.config,memos=memos_found, title="memo",user=user,delegate=user,detail=detail,next_page=next_page,url_params=url_params)
+            return conditional.validated(render_template('memo.html', config=current_app.config,memos=memos_found, title="memo",user=user,delegate=user,detail=detail,next_page=next_page,url_params=url_params),etag)
 
         return render_template('memo_search.html', config=current_app.config,title='Memo Search ',legend='Search',form=form)
 
@@ -529,9 +705,9 @@ def history():
     """Look at the history table"""
     with transaction():
         pagesize = User.get_pagesize(current_user)
-        page = request.args.get('page', 1, type=int)
 
-        history_list = MemoHistory.get_history(page=page,pagesize=pagesize)
+        history_list = MemoHistory.get_history(cursor=request.args.get('cursor'),pagesize=pagesize,
+                                               count_limit=current_app.config['PAGE_COUNT_LIMIT'])
         url_params = {
                 }
 
@@ -545,17 +721,23 @@ def template(memoref=None):
     set_template = request.args.get('set', None)
     unset_template = request.args.get('unset',None)
     pagesize = User.get_pagesize(current_user)
-    page = request.args.get('page', 1, type=int)
     detail = request.args.get('detail')
     showAll = request.args.get('showAll')
     url_params = {}
     next_page = "memos.template"
 
     if memoref is None:
-        memo_list = Memo.get_templates(page=page,pagesize=pagesize)
-        return render_template('memo.html', config=current_app.config,memos=memo_list, title="memo",user=current_user,delegate=current_user,
-                            signer=None, detail=detail,next_page=next_page,page=page,
-                            url_params=url_params,showAll=showAll)
+        etag = conditional.page_etag()
+        response = conditional.not_modified(etag)
+        if response is not None:
+            return response
+
+        memo_list = Memo.get_templates(cursor=request.args.get('cursor'),pagesize=pagesize,
+                                       count_limit=current_app.config['PAGE_COUNT_LIMIT'])
+        Memo.preload(memo_list.items,current_user,current_user)
+        return conditional.validated(render_template('memo.html', config=current_app.config,memos=memo_list, title="memo",user=current_user,delegate=current_user,
+                            signer=None, detail=detail,next_page=next_page,
+                            url_params=url_params,showAll=showAll),etag)
 
     memo_parse = Memo.parse_reference(memoref)
     
@@ -565,11 +747,12 @@ def template(memoref=None):
     if current_user.is_anonymous or memo_parse['memo'].can_template(current_user) is False:
         abort(403)
 
-    if set_template is not None:
-        memo_parse['memo'].config_template(True)
+    with transaction():
+        if set_template is not None:
+            memo_parse['memo'].config_template(True)
 
-    if unset_template is not None:
-        memo_parse['memo'].config_template(False)
+        if unset_template is not None:
+            memo_parse['memo'].config_template(False)
 
 
     return redirect(url_for('memos.main'))
@@ -0,0 +1,87 @@
+"""
+The meta-<user>-<number>-<version>.json files
+
+Memo.save only notes that the meta data of a memo changed.  When the transaction
+commits, the memos it saved are handed to a background worker, which reads each of
+them once (however many times it was saved) and writes its file to a temporary
+name and renames it over the old one, so a reader never sees half a file and a
+request never waits for the filesystem.  Outside of a request (configure, the
+import scripts) and in the tests the files are written before the commit, as they
+always were.
+
+The memos waiting for the worker are only kept in memory.  If the process dies
+between the commit and the write their files keep the old meta data (the database
+is right) until configure --meta writes every file again.
+"""
+import threading
+
+from flask import current_app, has_request_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from memos import db
+from memos.background import Worker
+
+_pending = set()        # the ids of the memos waiting for the worker in this process
+_lock = threading.Lock()
+
+
+def changed(*memos):
+    """Write the files of the memos (or the memo ids of a bulk UPDATE) once the current transaction commits"""
+    db.session.info.setdefault('meta_changed',set()).update(memos)
+
+
+def write(memo_ids):
+    """Write the files of the memos... a memo that is gone by now is skipped"""
+    from memos.models.Memo import Memo
+    memo_ids = sorted(memo_ids)
+    for i in range(0,len(memo_ids),500):
+        for memo in Memo.query.filter(Memo.id.in_(memo_ids[i:i+500])).options(*Memo.loader_options(detail=True)):
+            memo.saveJson()
+
+
+def write_pending():
+    """Write the files of the memos the worker has been given... returns how many"""
+    with _lock:
+        memo_ids = set(_pending)
+        _pending.clear()
+    write(memo_ids)
+    return len(memo_ids)
+
+
+def write_all():
+    """Write the file of every memo... returns how many"""
+    from memos.models.Memo import Memo
+    memo_ids = [memo_id for (memo_id,) in db.session.query(Memo.id)]
+    write(memo_ids)
+    return len(memo_ids)
+
+
+worker = Worker('memos-metadata',write_pending)
+
+
+@event.listens_for(Session,'before_commit')
+def _changed_before_commit(session):
+    memos = session.info.pop('meta_changed',None)
+    if not memos:
+        return
+    session.flush()
+    identities = [(memo,) if isinstance(memo,int) else inspect(memo).identity for memo in memos]
+    memo_ids = {identity[0] for identity in identities if identity is not None}
+    if has_request_context() and not current_app.testing:
+        session.info['meta_ids'] = memo_ids
+    else:
+        write(memo_ids)
+
+@event.listens_for(Session,'after_commit')
+def _wake_after_commit(session):
+    memo_ids = session.info.pop('meta_ids',None)
+    if memo_ids:
+        with _lock:
+            _pending.update(memo_ids)
+        worker.wake(current_app._get_current_object())
+
+@event.listens_for(Session,'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('meta_changed',None)
+    session.info.pop('meta_ids',None)
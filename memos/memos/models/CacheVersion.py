@@ -0,0 +1,85 @@
+from itertools import chain
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+from memos import db
+
+# The tables the memo pages are made from... a commit that writes one of them bumps its
+# 'pages:<table>' version, and the ETag of a page is made from all of them.  The version is
+# bumped in a short transaction of its own right after the commit, so a writer never holds
+# the row of a table while it works and the writers of one table do not queue on it
+PAGE_TABLES = {'user','delegate','memo','memo_file','memo_signature','memo_reference','memo_distribution'}
+PAGE_VERSIONS = sorted(f"pages:{table}" for table in PAGE_TABLES)
+
+class CacheVersion(db.Model):
+    """The version of something the worker processes keep in memory.  It is bumped in the
+    transaction that changes it, so every process sees the change when it commits... except
+    the page versions, which are bumped right after the commit (see bump_committed)"""
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def get(name):
+        version = db.session.query(CacheVersion.version).filter(CacheVersion.name==name).scalar()
+        return version or 0
+
+    @staticmethod
+    def get_pages():
+        """The versions of the tables the memo pages are made from, in one query"""
+        versions = dict(db.session.query(CacheVersion.name,CacheVersion.version).filter(CacheVersion.name.in_(PAGE_VERSIONS)))
+        return tuple(versions.get(name,0) for name in PAGE_VERSIONS)
+
+    @staticmethod
+    def bump(name,session=None):
+        session = db.session if session is None else session
+        if session.query(CacheVersion).filter_by(name=name).update({'version':CacheVersion.version+1}) == 0:
+            session.add(CacheVersion(name=name,version=1))
+
+    @staticmethod
+    def bump_committed(names,bind):
+        """Bump the versions, each in a transaction of its own on bind... not in the
+        transaction of the session"""
+        table = CacheVersion.__table__
+        bump = table.update().values(version=table.c.version+1)
+        for name in sorted(names):     # always in the same order... no deadlocks
+            try:
+                with bind.begin() as conn:
+                    if conn.execute(bump.where(table.c.name==name)).rowcount == 0:
+                        conn.execute(table.insert().values(name=name,version=1))
+            except IntegrityError:     # another worker made the row first
+                with bind.begin() as conn:
+                    conn.execute(bump.where(table.c.name==name))
+
+
+@event.listens_for(Session,'before_flush')
+def _pages_flushed(session, flush_context, instances):
+    changed = chain(session.new,session.deleted,[obj for obj in session.dirty if session.is_modified(obj)])
+    tables = {getattr(obj,'__tablename__',None) for obj in changed} & PAGE_TABLES
+    if tables:
+        session.info.setdefault('pages_changed',set()).update(tables)
+
+@event.listens_for(Session,'do_orm_execute')
+def _pages_bulk(orm_execute_state):
+    # query.update(), query.delete() and the bulk inserts of the importer do not go through the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.local_table.name in PAGE_TABLES:
+            orm_execute_state.session.info.setdefault('pages_changed',set()).add(mapper.local_table.name)
+
+@event.listens_for(Session,'after_commit')
+def _pages_after_commit(session):
+    # The flush of the commit has been through _pages_flushed... a page read between the commit
+    # and the bump is tagged with the old versions and is made again the next time
+    tables = session.info.pop('pages_changed',None)
+    if not tables:
+        return
+    try:
+        CacheVersion.bump_committed([f"pages:{table}" for table in tables],session.get_bind())
+    except SQLAlchemyError as e:     # the change is committed... the pages are tagged anew at the next one
+        if has_app_context():
+            current_app.logger.warning(f"Unable to bump the page versions {sorted(tables)} {e}")
+
+@event.listens_for(Session,'after_rollback')
+def _pages_after_rollback(session):
+    session.info.pop('pages_changed',None)
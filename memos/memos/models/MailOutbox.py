@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from flask_mail import Message
+
+from memos import db
+
+class MailOutbox(db.Model):
+    """Mail waiting to be sent by memos.mailer... one row per batch of recipients"""
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(4000), nullable=False, default='')
+    sender = db.Column(db.String(120))
+    reply_to = db.Column(db.String(120))
+    recipients = db.Column(db.Text, nullable=False, default='')                   # comma separated email addresses
+    body = db.Column(db.Text, nullable=False, default='')
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)  # None once it has been given up on
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    sent = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.String(4000))
+
+    __table_args__ = (
+        db.Index('ix_mail_outbox_sent_next_attempt','sent','next_attempt'),
+    )
+
+    @staticmethod
+    def queue(subject,sender,recipients,body,reply_to=None,batch=50):
+        """Add a message to the outbox as part of the current transaction"""
+        addresses = []
+        for recipient in recipients:
+            if recipient and recipient not in addresses:
+                addresses.append(str(recipient))
+
+        for start in range(0,len(addresses),batch):
+            db.session.add(MailOutbox(subject=subject,sender=sender,reply_to=reply_to,
+                                      recipients=','.join(addresses[start:start+batch]),body=body))
+        # memos.mailer wakes the worker when this is committed
+        db.session.info['mail_queued'] = True
+
+    @staticmethod
+    def pending(now,limit=100):
+        return MailOutbox.query.filter(MailOutbox.sent==None,MailOutbox.next_attempt<=now)\
+            .order_by(MailOutbox.id).limit(limit).all()
+
+    def claim(self,now,until):
+        """Take the message for this process... only one worker can move next_attempt"""
+        count = MailOutbox.query.filter(MailOutbox.id==self.id,MailOutbox.sent==None,MailOutbox.next_attempt<=now)\
+            .update({'next_attempt':until},synchronize_session=False)
+        return count == 1
+
+    def message(self):
+        return Message(self.subject,sender=self.sender,recipients=self.recipients.split(','),
+                       reply_to=self.reply_to,body=self.body)
@@ -6,22 +6,31 @@ import re
 import os
 import shutil
 import json
+import threading
 from datetime import datetime
 
 from flask import current_app, url_for
-from flask_mail import Message
-
-from memos import db, mail
-from memos.models.User import User
+from flask_sqlalchemy import Pagination
+from sqlalchemy import event, or_, and_, exists, inspect
+from sqlalchemy.orm import Session, validates, joinedload, selectinload
+
+from memos import db, file_root, keyset, mailer, metadata
+from memos.cache import VersionedCache
+from memos.models.CacheVersion import CacheVersion
+from memos.models.User import User, Delegate
 from memos.models.MemoState import MemoState
 from memos.models.MemoFile import MemoFile
 from memos.models.MemoSignature import MemoSignature
+from memos.models.MemoDistribution import MemoDistribution
 from memos.models.MemoReference import MemoReference
 from memos.models.MemoHistory import MemoHistory
 from memos.models.MemoActivity import MemoActivity
 from memos.revletter import b10_to_rev, rev_to_b10
+from memos import search as search_index
+
 
-from memos.flask_sqlalchemy_txns import transaction
+# The ids of the pinned memos and of the templates in this worker... see Memo.flagged
+_flagged = VersionedCache(CacheVersion.get)
 
 class Memo(db.Model):
     """This class is the single interface to a "memo" and all of the "memos"
@@ -48,6 +57,22 @@ class Memo(db.Model):
     _references = db.Column(db.String(4000),default='')                             # The hidden list of references
     memo_state = db.Column(db.Enum(MemoState))                                      # Draft, Signoff, Active, Obsolete
 
+    # The rows of the memo... read with Memo.loader_options.  They are only written through the
+    # MemoFile, MemoSignature and MemoReference functions, so whatever changes them calls forget_rows
+    _file_rows = db.relationship(MemoFile, viewonly=True, order_by=MemoFile.id)
+    _signature_rows = db.relationship(MemoSignature, viewonly=True, order_by=MemoSignature.id)
+    _reference_rows = db.relationship(MemoReference, viewonly=True, order_by=MemoReference.id)
+    _backref_rows = db.relationship(MemoReference, viewonly=True, order_by=MemoReference.id,
+        primaryjoin="and_(Memo.user_id==foreign(MemoReference.ref_user_id),Memo.number==foreign(MemoReference.ref_memo_number))")
+
+    __table_args__ = (
+        db.Index('ix_memo_user_id_number_version','user_id','number','version',unique=True),   # Memo.find
+        db.Index('ix_memo_memo_state_action_date','memo_state','action_date'),                # the active memo list
+        db.Index('ix_memo_action_date','action_date'),                                        # the showAll memo list
+        db.Index('ix_memo_pinned','pinned'),                                                  # every page shows the pinned memos
+        db.Index('ix_memo_template','template'),
+    )
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # do custom initialization here
@@ -58,6 +83,19 @@ class Memo(db.Model):
     def __str__(self):
         return f"{self.user.username}-{self.number}{self.version}"
 
+    @validates('distribution')
+    def validate_distribution(self, key, distribution):
+        # The MemoDistribution rows are rebuilt by the next save
+        self._distribution_changed = True
+        return distribution
+
+    @validates('pinned','template')
+    def validate_flag(self, key, value):
+        # The pinned memos and the templates are cached... save tells the other workers
+        if bool(value) != bool(getattr(self,key)):
+            self._flags_changed = getattr(self,'_flags_changed',set()) | {key}
+        return value
+
 ########################################
 # Permission Functions
 ########################################
@@ -80,7 +118,7 @@ class Memo(db.Model):
         if delegate is None:
             return False
         
-        if not self.user.is_delegate(delegate):
+        if not Delegate.is_delegate(self.user,delegate):
             return False
 
         if self.memo_state == MemoState.Active or self.memo_state == MemoState.Obsolete:
@@ -97,11 +135,11 @@ class Memo(db.Model):
         if self.memo_state != MemoState.Signoff:
             return False
 
-        if not signer.is_delegate(delegate=delegate):
+        if not Delegate.is_delegate(signer,delegate):
             return False
 
         # The list of signers and if they have signed are kept in the MemoSignature table
-        status = MemoSignature.is_signer(self.id,signer)
+        status = self._is_signer(signer)
         return status['is_signer'] and not status['status']
 
     def can_unsign(self, signer, delegate):
@@ -112,10 +150,10 @@ class Memo(db.Model):
         if self.memo_state != MemoState.Signoff:
             return False
 
-        if not signer.is_delegate(delegate=delegate):
+        if not Delegate.is_delegate(signer,delegate):
             return False
 
-        status = MemoSignature.is_signer(self.id,signer)
+        status = self._is_signer(signer)
         return status['is_signer'] and status['status']
 
     def can_obsolete(self, delegate):
@@ -123,7 +161,7 @@ class Memo(db.Model):
         if delegate is None:
             return False
 
-        if not self.user.is_delegate(delegate):
+        if not Delegate.is_delegate(self.user,delegate):
             return False
 
         if self.memo_state == MemoState.Active:
@@ -139,7 +177,7 @@ class Memo(db.Model):
         if self.memo_state != MemoState.Draft:
             return False
 
-        if not self.user.is_delegate(delegate=delegate):
+        if not Delegate.is_delegate(self.user,delegate):
             return False
 
         return True
@@ -156,10 +194,10 @@ class Memo(db.Model):
         if self.user.username == delegate.username:
             return True
 
-        if not signer.is_delegate(delegate):
+        if not Delegate.is_delegate(signer,delegate):
             return False
 
-        status = MemoSignature.is_signer(memo_id=self.id,signer=signer)
+        status = self._is_signer(signer)
 
         # if you are a signer you can reject.. even if you have already signed
         return status['is_signer']
@@ -199,13 +237,83 @@ class Memo(db.Model):
             return True
 
         # if the username is in the distribution list then provide access or the delegate can sign for the user
-        current_app.logger.info(f"self.distribution = {self.distribution} self.signers={self.signers}   ")
-#        if delegate.username in re.split(r"[\s:;,]+",self.distribution) or self.can_sign(user,delegate):
-        if delegate in User.valid_usernames(self.distribution)['valid_users'] or self.can_sign(user,delegate):
+        if self._is_distributed(delegate) or self.can_sign(user,delegate):
             return True
 
         return False
 
+########################################
+# Page Preload Functions
+########################################
+
+    @staticmethod
+    def loader_options(detail=False):
+        """The query options that read the owner, files and signatures (and with detail the
+        references and back references) of a page of memos with the memos.  RELATIONSHIP_LOADING
+        picks selectin (one more query for each) or joined (the rows come back in the same query)"""
+        load = joinedload if current_app.config['RELATIONSHIP_LOADING'] == 'joined' else selectinload
+        options = [joinedload(Memo.user),load(Memo._file_rows),load(Memo._signature_rows)]
+        if detail:
+            options.append(load(Memo._reference_rows))
+            options.append(load(Memo._backref_rows).joinedload(MemoReference.source))
+        return options
+
+    @staticmethod
+    def preload(memos, user=None, delegate=None, detail=False):
+        """Fetch the files, owners, signatures and the distribution for a whole
+        page of memos in a fixed number of queries.  The answers are kept on each memo
+        until the session expires it (the next commit or rollback)"""
+        memos = [memo for memo in memos if memo.id is not None]
+        if len(memos) == 0:
+            return memos
+
+        viewers = set()
+        for viewer in (user, delegate):
+            if getattr(viewer,'username',None) is not None:
+                viewers.add(viewer.username)
+
+        # The delegations come from the cached delegation graph
+        Delegate.graph()
+
+        # The memos that were not read with the loader options get their rows now
+        needed = {'user','_file_rows','_signature_rows'}
+        if detail:
+            needed = needed | {'_reference_rows','_backref_rows'}
+        unloaded = [memo.id for memo in memos if needed & inspect(memo).unloaded]
+        if len(unloaded) > 0:
+            Memo.query.filter(Memo.id.in_(unloaded)).options(*Memo.loader_options(detail)).all()
+
+        # Only the confidential memos need the distribution to decide if the viewers can see them
+        distribution = MemoDistribution.get_access([memo.id for memo in memos if memo.confidential],viewers)
+
+        for memo in memos:
+            memo._page = {'viewers':viewers, 'distribution':distribution}
+
+        return memos
+
+    def forget_rows(self):
+        """Read the files, signatures and references again the next time they are used... after
+        they were changed with a query rather than through the memo"""
+        if inspect(self).persistent:
+            db.session.expire(self,['_file_rows','_signature_rows','_reference_rows','_backref_rows'])
+
+    def _is_distributed(self, user):
+        """Is user on the distribution... answered from the page preload when it is available"""
+        page = getattr(self,'_page',None)
+        if page is None or getattr(user,'username',None) not in page['viewers']:
+            return MemoDistribution.is_distributed(self.id,user)
+
+        return (self.id,user.username) in page['distribution']
+
+    def _is_signer(self, signer):
+        """MemoSignature.is_signer answered from the signatures when they are already loaded"""
+        if signer is None or '_signature_rows' not in self.__dict__:
+            return MemoSignature.is_signer(self.id,signer)
+
+        for msig in self._signature_rows:
+            if msig.signer_id == signer.username:
+                return {'is_signer':True,'status':msig.signed,'signature':msig}
+        return {'is_signer':False,'status':False,'signature':None}
 
 ########################################
 # ??? Functions
@@ -213,17 +321,16 @@ class Memo(db.Model):
 
     def get_fullpath(self):
         """ This function gives the os path to a file """    
-        path = os.path.join(current_app.root_path,"static","memos",f"{self.user_id}",f"{self.number}",f"{self.version}")
+        path = os.path.join(file_root(),"memos",f"{self.user_id}",f"{self.number}",f"{self.version}")
         return path
 
     @property
     def files(self):
         """ Return a list of the files attached to this memo"""
-        memo_files = MemoFile.query.filter_by(memo_id=self.id).all()
-        return memo_files
+        return list(self._file_rows)
 
-    def saveJson(self):
-        """ Create the JSON file which is a copy of all of the meta data """
+    def meta(self):
+        """ The meta data of the memo as it is written to the JSON file """
         js = {}
         js['userid']=self.user_id
         js['number']=self.number
@@ -239,9 +346,8 @@ class Memo(db.Model):
         js['memo_state']=f"{self.memo_state}"
         js['keywords']= self.keywords
         # need to write the date of the signer
-        signlist = MemoSignature.get_signers(self)
         signers = []
-        for sig in signlist:
+        for sig in self.signers['siglist']:
             if sig.date_signed is not None:
                 signers.append((sig.signer_id,f"{datetime.strftime(sig.date_signed,'%m/%d/%Y')}"))
             
@@ -249,28 +355,39 @@ class Memo(db.Model):
         js['references']= self.references['ref_string']
         js['files']=[]
         for file in self.files:
-            js['files'].append((file.filename,file.uuid))
+            if file.sha256:
+                js['files'].append((file.filename,file.uuid,file.sha256))   # the file is in the blobstore
+            else:
+                js['files'].append((file.filename,file.uuid))
+        return js
+
+    def meta_path(self):
+        return os.path.join(self.get_fullpath(),f"meta-{self.user_id}-{self.number}-{self.version}.json")
 
-        path = os.path.join(self.get_fullpath())
-        #current_app.logger.info(f"Making Directory {path}")
-        os.makedirs(path,exist_ok=True)
-        #current_app.logger.info(f"Making Succeeded {path}")
+    @staticmethod
+    def write_meta(path,js):
+        """ Write the meta data js to path... this touches nothing but the file, which is replaced
+        in one step so that a reader never sees half of it """
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp,"w") as f:
+            json.dump(js,f)
+        os.replace(tmp,path)
 
-        path = os.path.join(path,f"meta-{self.user_id}-{self.number}-{self.version}.json")
-        f = open(path,"w")
-        json.dump(js,f)
-        f.close()
+    def saveJson(self):
+        """ Create the JSON file which is a copy of all of the meta data """
+        Memo.write_meta(self.meta_path(),self.meta())
 
     @property
     def signers(self):
         # get the signers from the signing table and turn it back to a string and a list
-        siglist = MemoSignature.get_signers(self)
-        return {'signers':self._signers,'siglist':siglist}
+        return {'signers':self._signers,'siglist':list(self._signature_rows)}
 
     @signers.setter
     def signers(self,signer_names):
         self._signers = signer_names
         MemoSignature.delete_signers(self)
+        self.forget_rows()
 
         users = User.valid_usernames(signer_names)
 
@@ -286,6 +403,30 @@ class Memo(db.Model):
     # input "username-number-version" output {username:user, number:int, version: revletter string)}
     # input "username-numberversion" output {username:user, number:int, version: revletter string)}
     # return keymap memo username number revletter or None
+    @staticmethod
+    def split_reference(reference):
+        """(username, memo_number, memo_version) of a reference... None if it is not one.  Nothing
+        is looked up, memo_version is None for user-number"""
+        memo_version = None
+        combo = re.split("-",reference)
+        if len(combo) == 2:
+            username,memo_number = combo
+            if re.match("^[0-9]+[a-zA-Z]+",memo_number):
+                split = re.split("[a-zA-Z]",memo_number)
+                memo_version = memo_number[len(split[0]):].upper()
+                memo_number = split[0]
+        elif len(combo) == 3:
+            username,memo_number,memo_version = combo
+        else:
+            return None
+
+        # the memo_number has to be a number and the memo_version (if there is one) letters
+        if re.fullmatch("^[1-9][0-9]*$",memo_number) is None:
+            return None
+        if memo_version is not None and re.fullmatch("[a-zA-Z]+",memo_version) is None:
+            return None
+        return username,int(memo_number),memo_version
+
     @staticmethod
     def parse_reference(reference):
 #        parts = re.split(r'-',reference)
@@ -302,24 +443,11 @@ class Memo(db.Model):
         rval = { "valid": False, "user":None, "username":None, "memo":None, "memo_number":None, "memo_version": None}
 
     
-        memo_number = None
-        memo_version = None
-
-        combo = re.split("-",reference)
-        if len(combo) == 2:
-            username = combo[0]
-            memo_number = combo[1]
-            if re.match("^[0-9]+[a-zA-Z]+",memo_number):
-                split = re.split("[a-zA-Z]",memo_number)
-                memo_version = memo_number[len(split[0]):].upper()
-                memo_number = split[0]
-        elif len(combo) == 3:
-            username = combo[0]
-            memo_number = combo[1]
-            memo_version = combo[2]
-        else:
+        parts = Memo.split_reference(reference)
+        if parts is None:
             return rval
-        
+        username,memo_number,memo_version = parts
+
         # check to make sure that the user is legal
         user = User.find(username=username)
         if user is None:
@@ -327,21 +455,6 @@ class Memo(db.Model):
         
         rval["username"] = username
         rval["user"] = user
-        
-        # check to make sure that the memo_number is actually a number
-        if re.fullmatch("^[1-9][0-9]*$",memo_number) is None:
-            memo_number = None
-            rval["valid"] = False
-            return rval
-        else:
-            memo_number = int(memo_number)
-        
-        
-        # check to make sure that the memo_version is legal (if it isnt none)
-        if memo_version is not None and re.fullmatch("[a-zA-Z]+",memo_version) is None:
-            memo_version = None
-            rval["valid"] = False
-            return rval
 
         memo = None
         if username is not None and memo_number is not None:
@@ -382,14 +495,7 @@ class Memo(db.Model):
     @property
     def references(self):
         # this function will return a list of reference objects + a string of the references
-        refs = []
-        ref_list = MemoReference.query.filter_by(source_id=self.id).all()
-        for ref in ref_list:
-            if ref.ref_memo_version == None:
-                refstring=f"{ref.ref_user_id}-{ref.ref_memo_number}"
-            else:
-                refstring=f"{ref.ref_user_id}-{ref.ref_memo_number}-{ref.ref_memo_version}"
-            refs.append(refstring)
+        refs = [ref.target for ref in self._reference_rows]
         return {'reflist':refs,'ref_string':r' '.join(refs)}
     
     @references.setter
@@ -397,6 +503,7 @@ class Memo(db.Model):
         self._references = references
 
         MemoReference.query.filter_by(source_id=self.id).delete()
+        self.forget_rows()
         refs = Memo.valid_references(references)
         for i in range(len(refs['valid_refs'])):
             parsed_ref = Memo.parse_reference(refs['valid_refs'][i])
@@ -409,19 +516,19 @@ class Memo(db.Model):
     @property
     def backrefs(self):
         # this function will return a list of reference objects + a string of the references
+        # The rows come from the (ref_user_id, ref_memo_number) index with their source memos in one query
         refs=[]
-        ref_list = MemoReference.query.filter_by(ref_user_id=self.user_id,ref_memo_number=self.number).all()
-        for ref in ref_list:
+        for ref in self._backref_rows:
             if ref.ref_memo_version and ref.ref_memo_version != self.version:
                 continue
 
-            memo = Memo.query.get(ref.source_id)
+            memo = ref.source
             if not memo:
                 continue # pragma nocover  - This only happens if a memo was deleted without cascading to the Memoreference.
             refstring=f"{memo.user_id}-{memo.number}-{memo.version}"
 
-            refs.append(refstring)
-            refs = list(set(refs))
+            if refstring not in refs:
+                refs.append(refstring)
         return {'reflist':refs,'ref_string':' '.join(refs)}
         
         
@@ -434,7 +541,14 @@ class Memo(db.Model):
 
     def save(self):
         db.session.add(self)
-        self.saveJson()
+        metadata.changed(self)
+        if getattr(self,'_distribution_changed',False):
+            MemoDistribution.update(self)
+            self._distribution_changed = False
+        if getattr(self,'_flags_changed',None):
+            Memo.flags_changed(*self._flags_changed)
+            self._flags_changed = set()
+        search_index.changed(self)
 
 
 ################################################################################       
@@ -442,13 +556,22 @@ class Memo(db.Model):
 # these function would classiavally be called private
 ################################################################################       
 
+    def versions(self):
+        """The query of every version of this memo"""
+        return Memo.query.filter(Memo.user_id == self.user_id, Memo.number == self.number)
+
     def obsolete_previous(self,acting=None):
-        prev_list = Memo.query.filter(Memo.user_id == self.user_id, Memo.number == self.number,Memo.version != self.version).all()
-        for memo in prev_list:
-            if memo.memo_state == MemoState.Active:
-                memo.memo_state = MemoState.Obsolete
-                MemoHistory.activity(memo=memo,memo_activity=MemoActivity.Obsolete,user=acting)
-                memo.save()
+        """The other Active versions become Obsolete... with one UPDATE and one INSERT of
+        their history however many versions the memo has"""
+        previous = self.versions().filter(Memo.version != self.version, Memo.memo_state == MemoState.Active)
+        rows = previous.with_entities(Memo.id,Memo.version).all()
+        if len(rows) == 0:
+            return
+        memo_ids = [memo_id for memo_id,version in rows]
+        MemoHistory.activities([(memo_id,f"{self.user_id}-{self.number}{version}") for memo_id,version in rows],
+                               MemoActivity.Obsolete,acting)
+        Memo.query.filter(Memo.id.in_(memo_ids)).update({'memo_state':MemoState.Obsolete},synchronize_session='evaluate')
+        metadata.changed(*memo_ids)
 
     # This function is called when:
     # 1- a valid draft is created
@@ -456,6 +579,7 @@ class Memo(db.Model):
     # 3- an unsign happens
     def process_state(self,acting=None):
         self.action_date = datetime.utcnow()
+        search_index.changed(self)      # the signers that can open a confidential memo
         if self.memo_state == MemoState.Draft:
             if MemoSignature.status(self.id) == False:
                 self.memo_state = MemoState.Signoff
@@ -493,21 +617,16 @@ class Memo(db.Model):
     def notify_distribution(self,message):
         try:
             replyTo = User.find(self.user_id)
-            users = User.valid_usernames(self.distribution)
             recipients=[replyTo.email]
-            for email in users['email_addrs']:
+            for email in MemoDistribution.get_emails(self):
                 recipients.append(email)
             
-            msg = Message(message,
-                        sender=os.environ['MEMOS_EMAIL_USER'],
-                        recipients=recipients,
-                        reply_to=replyTo.email)
-            msg.body = f'''{message}
+            body = f'''{message}
         Use the following link:
         {url_for('memos.main', username=self.user_id, memo_number=self.number, memo_version=self.version, _external=True)}?detail
         '''
             if 'MEMOS_EMAIL_SERVER' in os.environ:
-                mail.send(msg)
+                mailer.queue(message,recipients,body,reply_to=replyTo.email)
             else: # pragma nocover
                 current_app.logger.info(F"Notify Distribution {self.distribution} {message}")
                 
@@ -524,16 +643,12 @@ class Memo(db.Model):
                 signer = User.find(recipient.signer_id)
                 if len(signer.email) > 2:
                     recipients.append(signer.email)
-            msg = Message(message,
-                        sender=os.environ['MEMOS_EMAIL_USER'],
-                        recipients=recipients,
-                        reply_to=replyTo.email)
-            msg.body = f'''{message}
+            body = f'''{message}
         Use the following link:
         {url_for('memos.main', username=self.user_id, memo_number=self.number, memo_version=self.version, _external=True)}?detail
         '''
             if 'MEMOS_EMAIL_SERVER' in os.environ:
-                mail.send(msg)
+                mailer.queue(message,recipients,body,reply_to=replyTo.email)
             else: # pragma nocover
                 current_app.logger.info(F"Notify Signers {self.distribution} {message}")
 
@@ -652,9 +767,12 @@ class Memo(db.Model):
         
         MemoReference.delete(self)
         MemoSignature.delete_signers(self)
+        MemoDistribution.delete(self)
         MemoHistory.activity(memo=self,user=delegate,memo_activity=MemoActivity.Cancel)
+        Memo.flags_changed(*[flag for flag in ('pinned','template') if getattr(self,flag)])
 
         Memo.query.filter_by(id=self.id).delete()
+        search_index.removed(self.id)
 
         # delete all of the files in that directory & the directory  
         # Do this after all the database statements have executed (although still not committed)      
@@ -663,31 +781,32 @@ class Memo(db.Model):
         return True
     
     def config_template(self,state):
-        with transaction():
-            
-            if state is None:
-                for memo in Memo.query.filter_by(user_id=self.user.username,number=self.number):
-                    if memo.template is True:
-                        state = True
-            
-            if state:
-                for memo in Memo.query.filter_by(user_id=self.user.username,number=self.number):
-                    if memo.memo_state == MemoState.Active:
-                        memo.template = True
-                    else:
-                        memo.template = False
-                    memo.save()
-                return
-            else:
-                for memo in Memo.query.filter_by(user_id=self.user.username,number=self.number):
-                    memo.template = False
-                    memo.save()            
-    
+        """Make the Active version of the memo the template (state True) or none of them (False)...
+        with None it stays a template if any version is one.  The meta data files do not have the
+        template so they are not written again"""
+        if state is None:
+            state = db.session.query(self.versions().filter(Memo.template == True).exists()).scalar()
+
+        not_template = or_(Memo.template == False, Memo.template == None)
+        if state:
+            changed = self.versions().filter(Memo.memo_state == MemoState.Active, not_template)\
+                .update({'template':True},synchronize_session='evaluate')
+            changed += self.versions().filter(Memo.memo_state != MemoState.Active, Memo.template == True)\
+                .update({'template':False},synchronize_session='evaluate')
+        else:
+            changed = self.versions().filter(Memo.template == True).update({'template':False},synchronize_session='evaluate')
+        if changed > 0:
+            Memo.flags_changed('template')
+
     def config_confidential(self):
-        with transaction():
-            for memo in Memo.query.filter_by(user_id=self.user.username,number=self.number):
-                memo.confidential = True
-                memo.save()
+        """Every version of the memo becomes confidential"""
+        public = self.versions().filter(or_(Memo.confidential == False, Memo.confidential == None))
+        memo_ids = [memo_id for memo_id, in public.with_entities(Memo.id)]
+        if len(memo_ids) == 0:
+            return
+        Memo.query.filter(Memo.id.in_(memo_ids)).update({'confidential':True},synchronize_session='evaluate')
+        metadata.changed(*memo_ids)
+        search_index.changed(*memo_ids)
                 
 # general function
 
@@ -730,13 +849,16 @@ class Memo(db.Model):
         new_memo.signers = old_memo._signers                     # cannot be done until there is an id assigned by the save
         new_memo.save()
 
-        new_memo.saveJson()
+        MemoReference.move(old_memo,new_memo)
 #       Copy the files
         files = old_memo.files
+        os.makedirs(new_memo.get_fullpath(),exist_ok=True)
+        # The files in the blobstore just move to the new memo
         for file in files:
-            srcfile = os.path.join(old_memo.get_fullpath(),file._uuid)
-            dstfile = os.path.join(new_memo.get_fullpath(),file._uuid)
-            shutil.copyfile(srcfile,dstfile)
+            if file.sha256 is None:
+                srcfile = os.path.join(old_memo.get_fullpath(),file._uuid)
+                dstfile = os.path.join(new_memo.get_fullpath(),file._uuid)
+                shutil.copyfile(srcfile,dstfile)
             file.memo_id = new_memo.id
             file.save()
         
@@ -783,9 +905,10 @@ class Memo(db.Model):
         return memo
 
     @staticmethod
-    def get_memo_list(username=None,memo_number=None,memo_version=None,page=1,pagesize=None, showAll=False):
+    def get_memo_list(username=None,memo_number=None,memo_version=None,cursor=None,pagesize=None, showAll=False, detail=False,
+                      count_limit=None):
 
-        memo_list = Memo.query
+        memo_list = Memo.query.options(*Memo.loader_options(detail))
         if memo_version:
             memo_list = memo_list.filter(Memo.user_id==username,\
                                                 Memo.number==memo_number,\
@@ -798,24 +921,73 @@ class Memo(db.Model):
             if not showAll:
                 memo_list = memo_list.filter(Memo.memo_state == MemoState.Active)
 
-        memo_list = memo_list.order_by(Memo.action_date.desc(), Memo.user_id, Memo.number.desc(), Memo.version.desc())\
-            .paginate(page = page,per_page=pagesize)    
-        return memo_list
+        return keyset.paginate(memo_list,Memo.page_keys(),cursor,pagesize,count_limit)
     
     @staticmethod 
-    def search(title=None,keywords=None,page=1,pagesize=None):
-        memo_list = None
-        current_app.logger.info(f"Search title={title}")
-        if title != None:
-            memo_list = Memo.query.filter(Memo.title.like(f"%{title}%"))
-        
-        if keywords != None:
-            memo_list = Memo.query.filter(Memo.keywords.like(f"%{keywords}%"))            
+    def search(title=None,keywords=None,text=None,cursor=None,pagesize=None,detail=False,user=None,count_limit=None):
+        """Ranked search of the title, keywords and the text of the files, paged like the
+        memo lists (see keyset).  All of the fields that are specified must match.  The
+        confidential memos that user can not access are left out."""
+        current_app.logger.info(f"Search title={title} keywords={keywords} text={text} user={user}")
+        if title is None and keywords is None and text is None:
+            return None
 
-        if memo_list:
-            memo_list = memo_list.order_by(Memo.action_date.desc(), Memo.user_id, Memo.number.desc(), Memo.version.desc())\
-                .paginate(page = page,per_page=pagesize)
-        return memo_list
+        if pagesize is None:
+            pagesize = 20
+
+        if current_app.config.get('ENABLE_ALL_CONFIDENTIAL') is True and user is None:
+            return keyset.KeysetPage([],pagesize,total=0)
+
+        if not search_index.available(): # pragma nocover - without an index the best we can do is a scan of the memo table
+            memo_list = Memo.query.options(*Memo.loader_options(detail))
+            if title != None:
+                memo_list = memo_list.filter(Memo.title.like(f"%{title}%"))
+            if keywords != None:
+                memo_list = memo_list.filter(Memo.keywords.like(f"%{keywords}%"))
+            if text != None:
+                memo_list = memo_list.filter(or_(Memo.title.like(f"%{text}%"),Memo.keywords.like(f"%{text}%")))
+            hidden = Memo.hidden_from(user)
+            if hidden is not None:
+                memo_list = memo_list.filter(~Memo.id.in_(hidden.subquery()))
+            return keyset.paginate(memo_list,Memo.page_keys(),cursor,pagesize,count_limit)
+
+        position = keyset.decode(cursor,search_index.KEYS)
+        rows,total = search_index.search(title=title,keywords=keywords,text=text,position=position,limit=pagesize+1,
+                                         count_limit=count_limit,
+                                         confidential=user is not None and (user.admin or user.readAll),
+                                         reader=getattr(user,'username',None))
+        total_exact = True
+        if count_limit and total > count_limit:
+            total,total_exact = count_limit,False
+        page = keyset.page_of(rows,pagesize,position,lambda row: [row[1],row[0]],total,total_exact)    # (score, id)
+
+        memo_ids = [memo_id for memo_id,score in page.items]
+        page.items = []
+        if len(memo_ids) > 0:
+            found = {memo.id:memo for memo in Memo.query.filter(Memo.id.in_(memo_ids)).options(*Memo.loader_options(detail)).all()}
+            page.items = [found[memo_id] for memo_id in memo_ids if memo_id in found]
+        return page
+
+    @staticmethod
+    def hidden_from(user):
+        """The query of the ids of the confidential memos that can_access(user,user) refuses...
+        None if user can access all of them"""
+        hidden = db.session.query(Memo.id).filter(Memo.confidential == True)
+        if user is None:
+            return hidden
+        if user.admin or user.readAll:
+            return None
+
+        distributed = exists().where(MemoDistribution.memo_id == Memo.id,MemoDistribution.user_id == user.username)
+        signer = exists().where(MemoSignature.memo_id == Memo.id,MemoSignature.signer_id == user.username,
+                                or_(MemoSignature.signed == False,MemoSignature.signed == None))
+        return hidden.filter(Memo.user_id != user.username,~distributed,
+                             ~and_(Memo.memo_state == MemoState.Signoff,signer))
+
+    @staticmethod
+    def page_keys():
+        """The order of the memo lists for keyset.paginate... the most recent action first"""
+        return (Memo.action_date,Memo.id)
 
     @staticmethod   
     def get_next_number(user):
@@ -829,36 +1001,109 @@ class Memo(db.Model):
         
 
     @staticmethod
-    def get_inbox(user,page=1,pagesize=None):
+    def _inbox(user):
+        """The memos in signoff that are waiting for the signature of user"""
+        return Memo.query.join(MemoSignature,MemoSignature.memo_id==Memo.id)\
+            .filter(MemoSignature.signer_id==user.username,MemoSignature.signed==False,Memo.memo_state==MemoState.Signoff)
+
+    @staticmethod
+    def get_inbox(user,cursor=None,pagesize=None,count_limit=None):
         if user == None:
             return None
-        
-        msigs = MemoSignature.get_signatures(user,signed=False)
-        
-        memo_list = Memo.query.filter(Memo.memo_state==MemoState.Signoff,Memo.id.in_(msigs))
 
-        memo_list = memo_list.order_by(Memo.action_date.desc(), Memo.user_id, Memo.number.desc(), Memo.version.desc())\
-            .paginate(page = page,per_page=pagesize)
-        current_app.logger.debug(f"Inbox for {user.username} = Items={len(memo_list.items)} {memo_list}")
+        memo_list = Memo._inbox(user).options(*Memo.loader_options())
+        memo_list = keyset.paginate(memo_list,Memo.page_keys(),cursor,pagesize,count_limit)
+        current_app.logger.debug(f"Inbox for {user.username} = Items={len(memo_list.items)}")
         return memo_list
-    
+
     @staticmethod
-    def get_drafts(user,page=1,pagesize=None):
+    def get_inbox_count(user):
+        """The number of memos in the inbox of user... for the nav bar"""
+        if getattr(user,'username',None) is None:
+            return 0
+        return Memo._inbox(user).with_entities(db.func.count(Memo.id)).scalar()
+
+    @staticmethod
+    def get_drafts(user,cursor=None,pagesize=None,count_limit=None):
         if user == None:
             return None
         
-        memo_list = Memo.query.filter(Memo.memo_state==MemoState.Draft,Memo.user_id==user.username).order_by(Memo.action_date.desc()).paginate(page = page,per_page=pagesize)      
-        return memo_list
+        memo_list = Memo.query.filter(Memo.memo_state==MemoState.Draft,Memo.user_id==user.username).options(*Memo.loader_options())
+        return keyset.paginate(memo_list,Memo.page_keys(),cursor,pagesize,count_limit)
     
     @staticmethod
-    def get_templates(page=1,pagesize=None):     
-        memo_list = Memo.query.filter(Memo.template==True).order_by(Memo.action_date.desc()).paginate(page = page,per_page=pagesize)      
-        return memo_list
-    
+    def get_distributed(user,cursor=None,pagesize=None,count_limit=None):
+        """The active memos that have user on the distribution"""
+        if user == None:
+            return None
+
+        memo_list = Memo.query.join(MemoDistribution,MemoDistribution.memo_id==Memo.id)\
+            .filter(MemoDistribution.user_id==user.username,Memo.memo_state==MemoState.Active)\
+            .options(*Memo.loader_options())
+        return keyset.paginate(memo_list,Memo.page_keys(),cursor,pagesize,count_limit)
+
     @staticmethod
-    def get_pinned(page=1,pagesize=None):     
-        memo_list = Memo.query.filter(Memo.pinned==True).order_by(Memo.action_date.desc()).paginate(page = page,per_page=pagesize)      
-        return memo_list
-    
+    def get_file_bytes(username):
+        """The number of bytes of files attached to the memos of username... for the upload quota"""
+        used = db.session.query(db.func.sum(MemoFile.size)).join(Memo,Memo.id==MemoFile.memo_id)\
+            .filter(Memo.user_id==username).scalar()
+        return used or 0
+
+    @staticmethod
+    def flagged(flag):
+        """The ids of the memos that are pinned or templates (flag).  Each worker keeps them
+        until the CacheVersion of the flag changes, which it checks every LIST_CACHE_INTERVAL seconds"""
+        column = getattr(Memo,flag)
+        def load():
+            return frozenset(memo_id for memo_id, in db.session.query(Memo.id).filter(column==True))
+        return _flagged.get_or_load(flag,load,current_app.config['LIST_CACHE_INTERVAL'])
+
+    @staticmethod
+    def flags_changed(*flags):
+        """The pinned memos or templates changed... the other workers see it when this commits"""
+        for flag in flags:
+            CacheVersion.bump(flag)
+            _flagged.delete(flag)
+        if len(flags) > 0:
+            db.session.info.setdefault('flags_changed',set()).update(flags)
+
+    @staticmethod
+    def get_templates(cursor=None,pagesize=None,count_limit=None):
+        ids = Memo.flagged('template')
+        if len(ids) == 0:
+            return keyset.KeysetPage([],pagesize or 20,total=0 if count_limit else None)
+        memo_list = Memo.query.filter(Memo.id.in_(ids)).options(*Memo.loader_options())
+        return keyset.paginate(memo_list,Memo.page_keys(),cursor,pagesize,count_limit)
     
-    
\ No newline at end of file
+    @staticmethod
+    def get_pinned(page=1,pagesize=None,user=None,delegate=None):
+        """The pinned memos... which every memo list shows, so when there are none it
+        does not go to the database at all"""
+        if pagesize is None:
+            pagesize = 20
+        ids = Memo.flagged('pinned')
+        memos = []
+        if len(ids) > 0:
+            memos = Memo.query.filter(Memo.id.in_(ids)).options(*Memo.loader_options()).all()
+            memos.sort(key=lambda memo: (memo.action_date,memo.id),reverse=True)
+        items = memos[(page-1)*pagesize:page*pagesize]
+        Memo.preload(items,user,delegate)
+        return Pagination(None,page,pagesize,len(memos),items)
+
+
+@event.listens_for(Memo, 'expire')
+def _expire_preload(memo, attrs):
+    """The page preload is only good until the session expires the memo"""
+    if memo is not None:    # the memo can be garbage collected before its state is expired
+        memo.__dict__.pop('_page', None)
+
+@event.listens_for(Session,'after_commit')
+def _flags_after_commit(session):
+    # A request that read the flags between the change and the commit may have cached the old ones
+    for flag in session.info.pop('flags_changed',()):
+        _flagged.delete(flag)
+
+@event.listens_for(Session,'after_rollback')
+def _flags_after_rollback(session):
+    for flag in session.info.pop('flags_changed',()):
+        _flagged.delete(flag)
@@ -0,0 +1,61 @@
+from memos import db
+from memos.models.User import User
+
+class MemoDistribution(db.Model):
+    """The distribution string of a memo broken into one row per recipient.  It is rebuilt
+    by Memo.save when the distribution changes so that access checks do not have to parse it"""
+    id = db.Column(db.Integer, primary_key=True)
+    memo_id = db.Column(db.Integer, db.ForeignKey('memo.id'),nullable=False)
+    user_id = db.Column(db.String(120), db.ForeignKey('user.username'),nullable=True)  # None for an email address without a user
+    email = db.Column(db.String(120),nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_memo_distribution_memo_id','memo_id'),
+        db.Index('ix_memo_distribution_user_id_memo_id','user_id','memo_id'),
+    )
+
+    @staticmethod
+    def update(memo):
+        """Replace the rows for memo with the users & emails in memo.distribution"""
+        MemoDistribution.delete(memo)
+        for row in MemoDistribution.rows(memo.id,User.valid_usernames(memo.distribution or '')):
+            db.session.add(MemoDistribution(**row))
+
+    @staticmethod
+    def rows(memo_id,users):
+        """The rows for the users (from User.resolve) on the distribution of memo_id"""
+        rows = []
+        user_emails = set()
+        for user in users['valid_users']:
+            user_emails.add(user.email)
+            rows.append(dict(memo_id=memo_id,user_id=user.username,email=user.email))
+
+        for email in users['email_addrs']:
+            if email not in user_emails:
+                rows.append(dict(memo_id=memo_id,user_id=None,email=str(email)))
+        return rows
+
+    @staticmethod
+    def delete(memo):
+        MemoDistribution.query.filter_by(memo_id=memo.id).delete()
+
+    @staticmethod
+    def get_emails(memo):
+        """The email addresses of everyone on the distribution of memo"""
+        rows = MemoDistribution.query.filter_by(memo_id=memo.id).order_by(MemoDistribution.id).all()
+        return [row.email for row in rows if row.email]
+
+    @staticmethod
+    def is_distributed(memo_id,user):
+        if user is None:
+            return False
+        return MemoDistribution.query.filter_by(memo_id=memo_id,user_id=user.username).first() is not None
+
+    @staticmethod
+    def get_access(memo_ids,usernames):
+        """The set of (memo_id,username) pairs for the users on the distribution of the memos"""
+        if len(memo_ids) == 0 or len(usernames) == 0:
+            return set()
+        rows = MemoDistribution.query.filter(MemoDistribution.memo_id.in_(memo_ids),
+                                             MemoDistribution.user_id.in_(usernames)).all()
+        return {(row.memo_id,row.user_id) for row in rows}
@@ -1,13 +1,32 @@
 
 from memos import db
+from memos import blobstore
+from memos import search as search_index
+from memos.background import Worker
+from flask import current_app, has_request_context
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+import threading
 import uuid
 import os
 
+_released = set()       # the blobs waiting for the collector in this process
+_lock = threading.Lock()
+
 class MemoFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     _fname = db.Column(db.String(4000))
     _uuid = db.Column(db.String(48)) 
     memo_id = db.Column(db.Integer, db.ForeignKey('memo.id'),nullable=False)
+    sha256 = db.Column(db.String(64))       # The blob in the blobstore... None for a file in the memo directory
+    size = db.Column(db.BigInteger)
+    mimetype = db.Column(db.String(128))    # Sniffed from the content when it was uploaded
+
+    __table_args__ = (
+        db.Index('ix_memo_file_memo_id','memo_id'),
+        db.Index('ix_memo_file_uuid','_uuid'),
+        db.Index('ix_memo_file_sha256','sha256'),
+    )
 
     @property
     def filename(self):
@@ -26,19 +45,96 @@ class MemoFile(db.Model):
     def save(self):
         db.session.add(self)
 
+    def set_blob(self,blob):
+        """Attach the (sha256, size, mimetype) returned by the blobstore"""
+        self.sha256,self.size,self.mimetype = blob
+
+    def get_path(self,memo):
+        """The os path of the file"""
+        if self.sha256:
+            return blobstore.path(self.sha256)
+        return os.path.join(memo.get_fullpath(),self.uuid)
+
+    def get_relative_path(self,memo):
+        """The path of the file relative to the file root"""
+        if self.sha256:
+            return blobstore.relative_path(self.sha256)
+        return '/'.join(["memos",str(memo.user_id),str(memo.number),memo.version,self.uuid])
+
     def __repr__(self):
         return f"File('Document Filename = {self.filename}')"
    
+    @staticmethod
+    def find(memo_id,uuid):
+        return MemoFile.query.filter_by(_uuid=uuid,memo_id=memo_id).first()
+
     @staticmethod
     def delete(memo):
+        blobs = {mfile.sha256 for mfile in MemoFile.query.filter_by(memo_id=memo.id).all() if mfile.sha256}
         MemoFile.query.filter_by(memo_id=memo.id).delete()
+        memo.forget_rows()
+        for sha256 in blobs:
+            MemoFile.release(sha256)
+
+    @staticmethod
+    def hold_blobs():
+        """Keep the blobs stored from now on until this transaction ends... call it before storing them"""
+        if 'blob_hold' not in db.session.info:
+            db.session.connection()     # begin the transaction, so it ends with a commit or a rollback
+            db.session.info['blob_hold'] = blobstore.hold()
+
+    @staticmethod
+    def release(sha256):
+        """Remove the blob after this transaction ends, if no file refers to it anymore"""
+        db.session.info.setdefault('blobs_released',set()).add(sha256)
+
+    @staticmethod
+    def in_use(sha256):
+        """Is the blob used by a committed file... it is asked after the transaction ended"""
+        with db.engine.connect() as conn:
+            return conn.execute(select(func.count()).where(MemoFile.sha256 == sha256)).scalar() > 0
+
+    @staticmethod
+    def collect_released():
+        """Remove the blobs released by the transactions of this process... returns how many"""
+        with _lock:
+            sha256s = set(_released)
+            _released.clear()
+        return blobstore.collect(sorted(sha256s),MemoFile.in_use)
     
     def remove_file(self,memo):
         
+        search_index.file_removed(memo,self)
+        db.session.delete(self)
+        memo.forget_rows()
+
+        if self.sha256:
+            MemoFile.release(self.sha256)
+            return
+
         path = memo.get_fullpath()
         try:
             os.remove(os.path.join(path, self.uuid))
         except: # pragma nocover
             pass # ARH... well this can only happen if the file is already gone... which is what we want
-        
-        db.session.delete(self)
+
+
+collector = Worker('memos-blobs',MemoFile.collect_released)
+
+
+@event.listens_for(Session,'after_commit')
+@event.listens_for(Session,'after_rollback')
+def _collect_after_end(session):
+    # The rows of a transaction that rolled back are still there, so their blobs are kept
+    hold = session.info.pop('blob_hold',None)
+    if hold is not None:
+        hold.close()
+    sha256s = session.info.pop('blobs_released',None)
+    if not sha256s:
+        return
+    with _lock:
+        _released.update(sha256s)
+    if has_request_context() and not current_app.testing:
+        collector.wake(current_app._get_current_object())
+    else:
+        MemoFile.collect_released()
@@ -1,6 +1,7 @@
 from datetime import datetime
+from sqlalchemy import insert
 
-from memos import db
+from memos import db, keyset
 from memos.models.User import User
 from memos.models.MemoActivity import MemoActivity
 from flask import current_app
@@ -14,6 +15,10 @@ class MemoHistory(db.Model):
     memo_activity = db.Column(db.Enum(MemoActivity))      # For some reason the attribute names "activity" and "action" are illegal
     ref_user_id = db.Column(db.String(120), db.ForeignKey('user.username'),nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_memo_history_memo_id','memo_id'),
+    )
+
     @staticmethod
     def activity(memo=None,memo_activity=None,user=None):
         if user==None:
@@ -32,8 +37,16 @@ class MemoHistory(db.Model):
         
         db.session.add(mh)
 
-            
     @staticmethod
-    def get_history(memo_ref=None,memo=None,page=1,pagesize=None):
-        return MemoHistory.query.order_by(MemoHistory.id.desc()).paginate(page = page,per_page=pagesize)
+    def activities(memo_refs,memo_activity,user=None):
+        """The same activity for many memos with one INSERT... memo_refs is [(memo id, memo ref)]"""
+        userid = '0' if user is None else user.username
+        current_app.logger.info(f"activity={memo_activity} memos={[ref for memo_id,ref in memo_refs]} user={user}")
+        date = datetime.utcnow()
+        db.session.execute(insert(MemoHistory),[dict(memo_id=memo_id,memo_ref=ref,date=date,memo_activity=memo_activity,ref_user_id=userid)
+                                                for memo_id,ref in memo_refs])
+
+    @staticmethod
+    def get_history(memo_ref=None,memo=None,cursor=None,pagesize=None,count_limit=None):
+        return keyset.paginate(MemoHistory.query,(MemoHistory.id,),cursor,pagesize,count_limit)
 
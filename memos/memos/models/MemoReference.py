@@ -8,7 +8,22 @@ class MemoReference(db.Model):
     ref_user_id = db.Column(db.String(120), db.ForeignKey('user.username'),nullable=False)
     ref_memo_number = db.Column(db.Integer,nullable=False)
     ref_memo_version = db.Column(db.String(2))
-        
+
+    source = db.relationship('Memo', viewonly=True, lazy='joined')     # the memo that makes the reference
+
+    __table_args__ = (
+        db.Index('ix_memo_reference_source_id','source_id'),
+        db.Index('ix_memo_reference_ref_user_id_ref_memo_number','ref_user_id','ref_memo_number'),   # backrefs
+    )
+
+    @property
+    def target(self):
+        """The reference the way it was written... user-number or user-number-version"""
+        if self.ref_memo_version is None:
+            return f"{self.ref_user_id}-{self.ref_memo_number}"
+        return f"{self.ref_user_id}-{self.ref_memo_number}-{self.ref_memo_version}"
+
+
     @staticmethod
     def add_ref(memo_src_id,ref_user_id=None,ref_memo_number=None,ref_memo_version=None):
         new_ref = MemoReference(source_id=memo_src_id,ref_user_id=ref_user_id,ref_memo_number=ref_memo_number,ref_memo_version=ref_memo_version)
@@ -17,5 +32,32 @@ class MemoReference(db.Model):
 
     @staticmethod
     def delete(memo):
-        MemoReference.query.filter_by(id=memo.id).delete()
-        
\ No newline at end of file
+        """Remove the references that memo makes"""
+        MemoReference.query.filter_by(source_id=memo.id).delete()
+
+    @staticmethod
+    def move(src, dst):
+        """The references to the src version now point at dst... when a memo is renamed"""
+        MemoReference.query.filter_by(ref_user_id=src.user_id,ref_memo_number=src.number,ref_memo_version=src.version)\
+            .update({'ref_user_id':dst.user_id,'ref_memo_number':dst.number,'ref_memo_version':dst.version},
+                    synchronize_session='fetch')
+
+    @staticmethod
+    def citation_graph(ref_user_id=None, ref_memo_number=None):
+        """Every reference (or the ones to the memos of ref_user_id / ref_memo_number) in one
+        query... {target: [the memos that cite it]} with the target as it was written"""
+        refs = MemoReference.query
+        if ref_user_id is not None:
+            refs = refs.filter(MemoReference.ref_user_id==ref_user_id)
+        if ref_memo_number is not None:
+            refs = refs.filter(MemoReference.ref_memo_number==ref_memo_number)
+
+        graph = {}
+        for ref in refs.order_by(MemoReference.id):
+            if ref.source is None:
+                continue # pragma nocover - left behind by a cancel before the references were deleted with the memo
+            citing = f"{ref.source.user_id}-{ref.source.number}-{ref.source.version}"
+            graph.setdefault(ref.target,[])
+            if citing not in graph[ref.target]:
+                graph[ref.target].append(citing)
+        return graph
@@ -10,6 +10,11 @@ class MemoSignature(db.Model):
     delegate_id = db.Column(db.String(120), db.ForeignKey('user.username'),nullable=True)  # who actually performed the signature
     signed = db.Column(db.Boolean,default=False)
     date_signed = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_memo_signature_memo_id_signer_id','memo_id','signer_id'),     # is_signer
+        db.Index('ix_memo_signature_signer_id_signed','signer_id','signed'),       # the inbox
+    )
     
 
     @staticmethod
@@ -6,6 +6,10 @@ class MemoSubscription(db.Model):
     subscriber_id = db.Column(db.String(120), db.ForeignKey('user.username'),nullable=False)   # who is watching
     subscription_id = db.Column(db.String(120), db.ForeignKey('user.username'),nullable=True)  # who is being watched
 
+    __table_args__ = (
+        db.Index('ix_memo_subscription_subscriber_id','subscriber_id'),
+    )
+
 
     @staticmethod
     def delete(user):
@@ -1,12 +1,14 @@
 import datetime
 import email
 import jwt
-import numpy
 import os
 import re
-from flask import current_app
+from flask import current_app, g, has_app_context
 from flask_login import UserMixin
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import Session
 from memos import bcrypt, db, login_manager
+from memos.cache import TTLCache
 from memos.extensions import ldap
 from memos.flask_sqlalchemy_txns import transaction
 
@@ -17,16 +19,71 @@ from memos.models.MemoSubscription import MemoSubscription
 def load_user(user_id):
     return User.query.get(user_id)
 
-        
+_email = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+
+# The whole delegate table as {'delegates':{owner:{delegate...}}, 'owners':{delegate:{owner...}}}
+_graph_cache = TTLCache(ttl=60,maxsize=1)
+
+# With LDAP: the name that was looked up -> the username LDAP has for it, or None if LDAP
+# does not know it... so a typo in a distribution list is not looked up again and again
+_directory = TTLCache(ttl=600,maxsize=10000)
+
+
+def _roles(member_of):
+    """(admin, readAll) from the memberOf groups of an LDAP user"""
+    admin = False
+    readAll = False
+    admin_groups = os.environ["LDAP_ADMIN_GRP"].split(";")
+    readAll_groups = os.environ["LDAP_READ_GRP"].split(";")
+    for grp in member_of:
+        grp = str(grp, 'utf-8')
+        for aGrp in admin_groups:
+            if grp.startswith(aGrp) : admin = True
+        for rGrp in readAll_groups:
+            if grp.startswith(rGrp) : readAll = True
+    return admin,readAll
+
+
 class Delegate(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     owner_id = db.Column(db.String(120), db.ForeignKey('user.username'),nullable=False)   # who is suppsoed to sign
     delegate_id = db.Column(db.String(120), db.ForeignKey('user.username'),nullable=False)  # who is alloed to perform the signature
 
+    __table_args__ = (
+        db.Index('ix_delegate_owner_id_delegate_id','owner_id','delegate_id',unique=True),   # is_delegate
+        db.Index('ix_delegate_delegate_id','delegate_id'),                                   # delegate_for
+    )
+
+
+    @staticmethod
+    def graph():
+        """The delegation graph... read once per request from the process wide cache,
+        which is reloaded from the table when it expires or the table changes"""
+        if has_app_context() and 'delegate_graph' in g:
+            return g.delegate_graph
+
+        def load():
+            graph = {'delegates':{}, 'owners':{}}
+            for owner_id,delegate_id in db.session.query(Delegate.owner_id,Delegate.delegate_id).all():
+                graph['delegates'].setdefault(owner_id,set()).add(delegate_id)
+                graph['owners'].setdefault(delegate_id,set()).add(owner_id)
+            return graph
+
+        graph = _graph_cache.get_or_load('graph',load,ttl=current_app.config['DELEGATE_CACHE_TTL'])
+        if has_app_context():
+            g.delegate_graph = graph
+        return graph
+
+    @staticmethod
+    def invalidate():
+        """Forget the graph... called when the table changes and again when that commits"""
+        _graph_cache.clear()
+        if has_app_context():
+            g.pop('delegate_graph',None)
+            db.session.info['delegates_changed'] = True
 
     @staticmethod
     def is_delegate(owner,delegate):
-    #current_app.logger.info(f"Owner={owner} delegate={delegate}")
         if owner is None or delegate is None:
             return False
         if owner.username == delegate.username:
@@ -35,38 +92,30 @@ class Delegate(db.Model, UserMixin):
         if delegate.admin == True:
             return True
         
-        d = Delegate.query.filter_by(owner_id=owner.username,delegate_id=delegate.username).first()
-        if d:
-            return True
-        else:
-            return False
+        return delegate.username in Delegate.graph()['delegates'].get(owner.username,())
+
+    @staticmethod
+    def _users(usernames):
+        if len(usernames) == 0:
+            return []
+        return User.query.filter(User.username.in_(usernames)).order_by(User.username).all()
     
     @staticmethod    
     def get_delegates(owner):
         """Lookup delegates owner has defined."""
-        delegate_list = Delegate.query.filter_by(owner_id=owner.username).all()
-        rval = []
-        for delegate_entry in delegate_list:
-            user = User.find(username=delegate_entry.delegate_id)
-            rval.append(user)
-        return rval
+        return Delegate._users(Delegate.graph()['delegates'].get(owner.username,set()))
     
     @staticmethod    
     def get_delegated_users(delegate):
         """Lookup owners that have added this delegate."""
-        delegate_list = Delegate.query.filter_by(delegate_id=delegate.username).all()
-        rval = []
-        for delegate_entry in delegate_list:
-            user = User.find(username=delegate_entry.owner_id)
-            rval.append(user)
-        return rval
+        return Delegate._users(Delegate.graph()['owners'].get(delegate.username,set()))
     
     @staticmethod    
     def add(owner, delegate):
         new_delegate = Delegate(owner_id=owner.username,delegate_id=delegate.username)
         
         db.session.add(new_delegate)
-        pass
+        Delegate.invalidate()
     
     
     @staticmethod
@@ -75,6 +124,21 @@ class Delegate(db.Model, UserMixin):
             Delegate.query.filter_by(owner_id=owner.username).delete()
         else:
             Delegate.query.filter_by(owner_id=owner.username,delegate_id=delegate.username).delete()
+        Delegate.invalidate()
+
+
+@event.listens_for(Session,'after_commit')
+def _invalidate_after_commit(session):
+    # A request that read the graph between the change and the commit may have cached the old one
+    if session.info.pop('delegates_changed',False):
+        _graph_cache.clear()
+
+@event.listens_for(Session,'after_rollback')
+def _invalidate_after_rollback(session):
+    if session.info.pop('delegates_changed',False):
+        _graph_cache.clear()
+        if has_app_context():
+            g.pop('delegate_graph',None)
     
 
 class User(db.Model, UserMixin):
@@ -85,6 +149,10 @@ class User(db.Model, UserMixin):
     admin = db.Column(db.Boolean,default=False)
     readAll = db.Column(db.Boolean,default=False)
     pagesize = db.Column(db.Integer, nullable=False, default = 10)
+
+    __table_args__ = (
+        db.Index('ix_user_email','email'),       # email addresses in distribution lists
+    )
         
     memos = db.relationship('Memo',backref=db.backref('user', lazy=True))
     history = db.relationship('MemoHistory',backref=db.backref('user', lazy=True))
@@ -113,15 +181,8 @@ class User(db.Model, UserMixin):
 
             self.admin = False
             self.readAll = False
-            admin_groups = os.environ["LDAP_ADMIN_GRP"].split(";")
-            readAll_groups = os.environ["LDAP_READ_GRP"].split(";")
             if 'memberOf' in ldap_user and isinstance(ldap_user['memberOf'], list):
-                for grp in ldap_user['memberOf']:
-                    grp = str(grp, 'utf-8')
-                    for aGrp in admin_groups:
-                        if grp.startswith(aGrp) : self.admin = True
-                    for rGrp in readAll_groups:
-                        if grp.startswith(rGrp) : self.readAll = True   
+                self.admin,self.readAll = _roles(ldap_user['memberOf'])
             return ldap.bind_user(self.username, check_pw)
 
         try:
@@ -134,7 +195,6 @@ class User(db.Model, UserMixin):
     def delegate_for(self):
         """owners user is a delegate for"""
         delegate_list = Delegate.get_delegated_users(delegate=self)
-        current_app.logger.info(f"Delegate List = {delegate_list}")
         rval = ''
         for delegate in delegate_list:
             rval = rval + delegate.username + ' '
@@ -144,7 +204,6 @@ class User(db.Model, UserMixin):
     def delegates(self):
         """delegates defined for this user"""
         delegate_list = Delegate.get_delegates(owner=self)
-        current_app.logger.info(f"Delegate List = {delegate_list}")
         rval = ''
         for delegate in delegate_list:
             rval = rval + delegate.username + ' '
@@ -154,10 +213,9 @@ class User(db.Model, UserMixin):
     def delegates(self,delegates):
 
         Delegate.delete(owner=self)
-        for delegate_name in re.split(r"[\s:;,]+",delegates):
-            delegate = User.find(username=delegate_name)
-            if delegate != None:
-                Delegate.add(self,delegate)
+        names = [name for name in re.split(r"[\s:;,]+",delegates) if not _email.fullmatch(name)]
+        for delegate in User.resolve(names)['valid_users']:      # (owner,delegate) is unique
+            Delegate.add(self,delegate)
     
     # is the userid a valid delgate for "self"
     def is_delegate(self,delegate=None):
@@ -210,78 +268,132 @@ class User(db.Model, UserMixin):
         """
         if username is None:
             return None
-        user = User.query.filter_by(username=username).first()
-        if user is None and ldap: #pragma nocover  -- testing ldap is very environment centric.
+
+        if ldap:
+            return User._find_ldap(username)
+
+        # The identity map answers a user that was already loaded without a query
+        return db.session.get(User,username)
+
+    @staticmethod
+    def _find_ldap(username):
+        """Lookup a user in the database and then LDAP, remembering the answers from LDAP
+        (both positive and negative) for a while"""
+        config = current_app.config
+        canonical = _directory.get(username,username)
+        if canonical is None:
+            return None
+
+        user = db.session.get(User,canonical)
+        if user is None:
             try:
                 ldap_user = ldap.get_object_details(username)
-                if ldap_user is None:
-                    return None
-                user = User(username=ldap_user[os.environ["LDAP_USER_NAME"]][0].decode('ASCII'), 
-                email=ldap_user[os.environ["LDAP_EMAIL"]][0].decode('ASCII'), password='xx')
-                db.session.add(user)
-                
-            except:
+                if ldap_user is not None:
+                    canonical = ldap_user[os.environ["LDAP_USER_NAME"]][0].decode('ASCII')
+                    email = ldap_user[os.environ["LDAP_EMAIL"]][0].decode('ASCII')
+            except Exception as e:
+                current_app.logger.warning(f"LDAP lookup of {username} failed: {e}")
+                return None     # not remembered... the server may be back on the next lookup
+
+            if ldap_user is None:
+                _directory.set(username,None,ttl=config['USER_NEGATIVE_TTL'])
                 return None
-                
-
-
-            # If we validated a user with ldap, Update their permissions from LDAP groups.
-            if ldap_user: #pragma nocover  -- testing ldap is very environment centric.
-                user.admin = False
-                user.readAll = False
-                admin_groups = os.environ["LDAP_ADMIN_GRP"].split(";")
-                readAll_groups = os.environ["LDAP_READ_GRP"].split(";")
-                if 'memberOf' in ldap_user and isinstance(ldap_user['memberOf'], list):
-                    for grp in ldap_user['memberOf']:
-                        grp = str(grp, 'utf-8')
-                        for aGrp in admin_groups:
-                            if grp.startswith(aGrp) : user.admin = True
-                        for rGrp in readAll_groups:
-                            if grp.startswith(rGrp) : user.readAll = True
-                        
+
+            user = db.session.get(User,canonical)
+            if user is None:
+                # A new user gets the roles of its LDAP groups... after that they are set at login
+                user = User(username=canonical,email=email,password='xx')
+                if isinstance(ldap_user.get('memberOf'),list):
+                    user.admin,user.readAll = _roles(ldap_user['memberOf'])
+                db.session.add(user)
+            _directory.set(username,canonical,ttl=config['USER_CACHE_TTL'])
+
         return user
 
+    @staticmethod
+    def forget(username=None):
+        """Drop the cached LDAP answers for username... or all of them"""
+        if username is None:
+            _directory.clear()
+        else:
+            _directory.delete(username)
+
     # this function takes a string of "users" where they are seperated by , or space and checks if they are valid
     @staticmethod
     def valid_usernames(userlist):
+        return User.resolve(re.split(r"[\s:;,]+",userlist))
+
+    @staticmethod
+    def lookup(tokens, chunk=500):
+        """The users for a long list of usernames and email addresses... chunk of them per query"""
+        tokens = sorted({token for token in tokens if token != ''})
+        found = []
+        for i in range(0,len(tokens),chunk):
+            part = tokens[i:i+chunk]
+            emails = [token for token in part if _email.fullmatch(token)]
+            found.extend(User.query.filter(User._matching(part,emails)).all())
+        return found
+
+    @staticmethod
+    def _matching(names, emails):
+        # Whatever the collation of the database... a username or email matches in any case
+        return or_(func.lower(User.username).in_({name.lower() for name in names}),
+                   func.lower(User.email).in_({email.lower() for email in emails}))
+
+    @staticmethod
+    def resolve(tokens, found=None):
+        """Look up a list of usernames and email addresses in one query... or in found, the
+        users that User.lookup already read for them
+
+        Returns:
+            {'valid_usernames','valid_users','email_addrs'} sorted and without duplicates,
+            {'invalid_usernames'} the usernames that are not users and {'non_users'} True if
+            any of the tokens is not a user
+        """
+        tokens = [token for token in tokens if token != '']
+        emails = {token for token in tokens if _email.fullmatch(token)}
+        names = {token for token in tokens if token not in emails}
+
+        if found is None:
+            found = []
+            if len(tokens) > 0:
+                found = User.query.filter(User._matching(names,emails)).all()
+        by_name = {user.username.lower():user for user in found}
+        by_email = {}
+        for user in sorted(found,key=lambda user: user.username):
+            if user.email:
+                by_email.setdefault(user.email.lower(),user)
+
         invalid_usernames = []
-        valid_usernames = []
-        email_addrs = []
+        valid_users = {}
+        email_addrs = set()
         has_non_users = False
-        users = re.split(r"[\s:;,]+",userlist)
-        while '' in users: users.remove('')
-
-        for username in users:            
-            # See if an email is listed.
-#            email_match = re.fullmatch('^([a-zA-Z0-9_\-\.]+)@([a-zA-Z0-9_\-\.]+)\.([a-zA-Z]{2,5})$', username)
-            email_match = re.fullmatch(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", username)
-            if email_match:
-                email_addrs.append(str(email_match[0]))
-                user = User.query.filter_by(email=email_match[0]).first()
+        for token in tokens:
+            if token in emails:
+                email_addrs.add(token)
+                user = by_email.get(token.lower())
                 if user == None:
                     has_non_users = True
                 else:
-                    valid_usernames.append(user.username)
+                    valid_users[user.username] = user
             else:
-                user = User.find(username=username)
+                user = by_name.get(token.lower())
+                if user == None and ldap: #pragma nocover  -- testing ldap is very environment centric.
+                    user = User.find(username=token)
                 if user == None:
-                    invalid_usernames.append(username)
+                    invalid_usernames.append(token)
                     has_non_users = True
                 else:
-                    valid_usernames.append(user.username)
-                    email_addrs.append(str(user.email))
-
-        email_addrs = numpy.unique(email_addrs)
-        valid_usernames = numpy.unique(valid_usernames)
-        valid_users = []
-        for username in valid_usernames:
-            valid_users.append(User.find(username=username))
+                    valid_users[user.username] = user
+                    if user.email:
+                        email_addrs.add(str(user.email))
 
+        valid_usernames = sorted(valid_users)
         return {
             'valid_usernames':valid_usernames,
             'invalid_usernames':invalid_usernames,
-            'valid_users':valid_users,
-            'email_addrs':email_addrs,
+            'valid_users':[valid_users[username] for username in valid_usernames],
+            'email_addrs':sorted(email_addrs),
             'non_users':has_non_users
             }
 
@@ -311,4 +423,5 @@ class User(db.Model, UserMixin):
     def save(self):
         with transaction():
             db.session.add(self)
-            db.session.commit()
\ No newline at end of file
+            db.session.commit()
+        User.forget(self.username)
\ No newline at end of file
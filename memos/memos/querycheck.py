@@ -0,0 +1,53 @@
+"""
+Flag queries that read a whole table
+
+Every SELECT is run through EXPLAIN QUERY PLAN (SQLite only) and the tables that
+SQLite reads without an index are reported.  It doubles the cost of every query,
+so it is only installed when MEMOS_QUERY_SCAN_CHECK is set, and by the tests.
+"""
+import re
+
+from sqlalchemy import event
+
+# "SCAN memo" or "SCAN TABLE memo" (older SQLite)... but not "SCAN memo USING INDEX ix_memo_action_date"
+_scan = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+
+
+def full_scans(connection, statement, parameters=()):
+    """The tables that statement reads without using an index"""
+    if connection.dialect.name != 'sqlite' or not statement.lstrip().upper().startswith('SELECT'):
+        return []
+
+    cursor = connection.connection.cursor()
+    try:
+        plan = cursor.execute(f"EXPLAIN QUERY PLAN {statement}",parameters or ()).fetchall()
+    finally:
+        cursor.close()
+
+    # Reading the result of a subquery is reported as a scan of it too... that is not a table
+    subqueries = {row[-1].split()[-1] for row in plan if row[-1].startswith(('CO-ROUTINE ','MATERIALIZE '))}
+
+    tables = []
+    for row in plan:
+        match = _scan.match(row[-1])
+        if match and match[1] not in subqueries and match[1] not in tables:
+            tables.append(match[1])
+    return tables
+
+
+def install(engine, report, ignore=()):
+    """Call report(table,statement) for every full scan of a table not in ignore"""
+
+    @event.listens_for(engine,'before_cursor_execute')
+    def check_plan(conn, cursor, statement, parameters, context, executemany):
+        if executemany:
+            return
+        for table in full_scans(conn,statement,parameters):
+            if table not in ignore:
+                report(table,statement)
+
+    return check_plan
+
+
+def uninstall(engine, check_plan):
+    event.remove(engine,'before_cursor_execute',check_plan)
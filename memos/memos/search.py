@@ -0,0 +1,472 @@
+"""
+The full text search index for memos
+
+The index is an SQLite FTS5 database that lives beside the memo files.  It is
+kept separate from the main database so that it works the same way on SQLite,
+MySQL and SQL Server.  The rowid of the index is the Memo.id.
+
+Memo.save, Memo.cancel and the attaching and removing of files only note what
+changed.  When the transaction commits, the changes are handed to a background
+worker, which reads the committed rows and extracts the text of the files, so a
+request never waits for the index.  Nothing is written if it rolls back.  Outside
+of a request and in the tests the index is written as the transaction commits.
+
+The memos of the changes handed to the worker are also noted in the memo_pending
+table of the index, and taken off it once they are written.  If the process dies in
+between, the worker of any process indexes those memos again from the database
+once the note is STALE seconds old (see recover).
+
+The index also has the confidential memos and the users that can open each of
+them (its owner, the users on its distribution and the signers that have not
+signed it yet), so the matches of a search leave out the memos that
+Memo.can_access would refuse, in the same query.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+
+from flask import current_app, has_request_context
+from sqlalchemy import Float, Integer, column, event, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from memos import db, file_root
+from memos.background import Worker
+
+MAX_TEXT = 1024*1024            # The most characters of text that are indexed for one file
+STALE = 10*60                   # a change noted in memo_pending this long ago was lost by its process
+
+_local = threading.local()      # sqlite connections can not be shared between threads
+_pending = []                   # the changes waiting for the worker in this process
+_journaled = []                 # ... and the ids of their rows in memo_pending
+_lock = threading.Lock()
+
+_schema = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS memo_fts USING fts5(title, keywords, content)",
+    "CREATE TABLE IF NOT EXISTS memo_file_text (uuid TEXT PRIMARY KEY, memo_id INTEGER NOT NULL, text TEXT)",
+    "CREATE INDEX IF NOT EXISTS memo_file_text_memo_id ON memo_file_text (memo_id)",
+    "CREATE TABLE IF NOT EXISTS memo_confidential (memo_id INTEGER PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS memo_reader (username TEXT NOT NULL, memo_id INTEGER NOT NULL, PRIMARY KEY (username, memo_id)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS memo_reader_memo_id ON memo_reader (memo_id)",
+    "CREATE TABLE IF NOT EXISTS memo_pending (id INTEGER PRIMARY KEY, memo_ids TEXT NOT NULL, queued REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS index_version (version INTEGER NOT NULL)",
+    "INSERT INTO index_version(version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM index_version)",
+]
+
+# Titles are worth more than keywords which are worth more than the text of the files...
+# the best match has the highest score
+_score = "-bm25(memo_fts, 10.0, 5.0, 1.0)"
+
+# The keys the matches are paged by (see keyset)
+KEYS = (column('score',Float),column('rowid',Integer))
+
+
+def index_path():
+    path = current_app.config.get('SEARCH_INDEX')
+    if path is None:
+        path = os.path.join(file_root(),"sqlite","search.db")
+    return path
+
+
+def _connect():
+    path = index_path()
+    connections = getattr(_local,'connections',None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    if path not in connections:
+        os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        conn = sqlite3.connect(path,timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in _schema:
+            conn.execute(statement)
+        conn.commit()
+        connections[path] = conn
+    return connections[path]
+
+
+def available():
+    """Is SQLite built with FTS5... if not Memo.search falls back to LIKE"""
+    try:
+        _connect()
+        return True
+    except sqlite3.Error: # pragma nocover - all of the current python builds have fts5
+        current_app.logger.warning("Full text search index is not available")
+        return False
+
+
+def version():
+    """Bumped by every write of the index... it is in the ETag of the search results"""
+    try:
+        return _connect().execute("SELECT version FROM index_version").fetchone()[0]
+    except sqlite3.Error: # pragma nocover - without fts5 there is no index
+        return 0
+
+
+def _bump(conn):
+    conn.execute("UPDATE index_version SET version=version+1")
+
+
+def _update_content(conn, memo_id):
+    texts = conn.execute("SELECT text FROM memo_file_text WHERE memo_id=? ORDER BY rowid",(memo_id,)).fetchall()
+    content = ' '.join(text[0] for text in texts if text[0])
+    conn.execute("UPDATE memo_fts SET content=? WHERE rowid=?",(content,memo_id))
+
+
+def _index_rows(conn, memo_ids):
+    """Index the title, keywords and readers of the memos as they are in the database... a memo that is gone is removed"""
+    from memos.models.Memo import Memo
+    from memos.models.MemoDistribution import MemoDistribution
+    from memos.models.MemoSignature import MemoSignature
+    from memos.models.MemoState import MemoState
+    memo_ids = sorted(memo_ids)
+    for i in range(0,len(memo_ids),500):
+        chunk = memo_ids[i:i+500]
+        with db.engine.connect() as dbconn:
+            rows = dbconn.execute(select(Memo.id,Memo.title,Memo.keywords,Memo.confidential,Memo.user_id,Memo.memo_state)
+                                  .where(Memo.id.in_(chunk))).all()
+            confidential = [row.id for row in rows if row.confidential]
+            readers = {(row.user_id,row.id) for row in rows if row.confidential}
+            if confidential:
+                readers.update(dbconn.execute(select(MemoDistribution.user_id,MemoDistribution.memo_id)
+                                              .where(MemoDistribution.memo_id.in_(confidential),MemoDistribution.user_id != None)))
+                signoff = [row.id for row in rows if row.confidential and row.memo_state == MemoState.Signoff]
+                if signoff:
+                    readers.update(dbconn.execute(select(MemoSignature.signer_id,MemoSignature.memo_id)
+                                                  .where(MemoSignature.memo_id.in_(signoff),
+                                                         or_(MemoSignature.signed == False,MemoSignature.signed == None))))
+
+        conn.executemany("DELETE FROM memo_confidential WHERE memo_id=?",[(memo_id,) for memo_id in chunk])
+        conn.executemany("DELETE FROM memo_reader WHERE memo_id=?",[(memo_id,) for memo_id in chunk])
+        conn.executemany("INSERT INTO memo_confidential(memo_id) VALUES (?)",[(memo_id,) for memo_id in confidential])
+        conn.executemany("INSERT INTO memo_reader(username,memo_id) VALUES (?,?)",sorted(tuple(reader) for reader in readers))
+        for row in rows:
+            _index(conn,row.id,row.title,row.keywords)
+        for memo_id in set(chunk) - {row.id for row in rows}:
+            _remove(conn,memo_id)
+
+
+def _index(conn, memo_id, title, keywords):
+    row = conn.execute("SELECT rowid FROM memo_fts WHERE rowid=?",(memo_id,)).fetchone()
+    if row is None:
+        conn.execute("INSERT INTO memo_fts(rowid,title,keywords,content) VALUES (?,?,?,'')",
+                     (memo_id,title or '',keywords or ''))
+        _update_content(conn,memo_id)
+    else:
+        conn.execute("UPDATE memo_fts SET title=?, keywords=? WHERE rowid=?",(title or '',keywords or '',memo_id))
+
+
+def _remove(conn, memo_id):
+    conn.execute("DELETE FROM memo_fts WHERE rowid=?",(memo_id,))
+    conn.execute("DELETE FROM memo_file_text WHERE memo_id=?",(memo_id,))
+    conn.execute("DELETE FROM memo_confidential WHERE memo_id=?",(memo_id,))
+    conn.execute("DELETE FROM memo_reader WHERE memo_id=?",(memo_id,))
+
+
+def index_memos(memo_ids):
+    """Add or update the memos from the database... all of them in one transaction"""
+    conn = _connect()
+    with conn:
+        _index_rows(conn,memo_ids)
+        _bump(conn)
+
+
+################################################################################
+# The changes of a transaction... written to the index when it commits
+################################################################################
+
+def _queue(*op):
+    db.session.info.setdefault('search_changed',[]).append(op)
+
+
+def changed(*memos):
+    """Index the title and keywords of the memos (or the memo ids of a bulk INSERT) once the current transaction commits"""
+    _queue('memos',memos)
+
+
+def removed(memo_id):
+    """Remove the memo and the text of its files once the current transaction commits"""
+    _queue('removed',memo_id)
+
+
+def file_attached(memo, mfile):
+    """Index the text of the file once the current transaction commits"""
+    _queue('file',memo.id,mfile.uuid,mfile.filename,mfile.get_path(memo))
+
+
+def file_removed(memo, mfile):
+    _queue('file_removed',memo.id,mfile.uuid)
+
+
+def write(changes):
+    """Apply the changes of committed transactions to the index"""
+    texts = {i:extract_text(change[4],change[3]) for i,change in enumerate(changes) if change[0] == 'file'}
+    conn = _connect()
+    with conn:
+        _bump(conn)
+        for i,change in enumerate(changes):
+            if change[0] == 'memos':
+                _index_rows(conn,change[1])
+            elif change[0] == 'removed':
+                _remove(conn,change[1])
+            elif change[0] == 'file':
+                conn.execute("INSERT OR REPLACE INTO memo_file_text(uuid,memo_id,text) VALUES (?,?,?)",(change[2],change[1],texts[i]))
+                if conn.execute("SELECT rowid FROM memo_fts WHERE rowid=?",(change[1],)).fetchone() is None:
+                    _index_rows(conn,[change[1]])       # a new memo... which adds the text of its files
+                else:
+                    _update_content(conn,change[1])
+            else:
+                conn.execute("DELETE FROM memo_file_text WHERE uuid=?",(change[2],))
+                _update_content(conn,change[1])
+
+
+@event.listens_for(Session,'before_commit')
+def _changed_before_commit(session):
+    changes = session.info.pop('search_changed',None)
+    if not changes:
+        return
+    session.flush()
+    for i,change in enumerate(changes):
+        if change[0] == 'memos':
+            identities = [(memo,) if isinstance(memo,int) else inspect(memo).identity for memo in change[1]]
+            changes[i] = ('memos',{identity[0] for identity in identities if identity is not None})
+    session.info['search_committing'] = changes
+
+def write_pending():
+    """Apply the changes the worker has been given... returns how many"""
+    with _lock:
+        changes = list(_pending)
+        _pending.clear()
+        journaled = list(_journaled)
+        _journaled.clear()
+    if changes:
+        write(changes)
+    if journaled:
+        conn = _connect()
+        with conn:
+            conn.executemany("DELETE FROM memo_pending WHERE id=?",[(journal_id,) for journal_id in journaled])
+    recover()
+    return len(changes)
+
+
+worker = Worker('memos-search',write_pending)
+
+
+def init_app(app):
+    @app.before_request
+    def _start_worker():
+        # Started with the first request... so it recovers the changes a dead process lost.
+        # The tests write the index as they commit
+        if not app.testing:
+            worker.start(app)
+
+
+def _memo_ids(changes):
+    memo_ids = set()
+    for change in changes:
+        if change[0] == 'memos':
+            memo_ids.update(change[1])
+        else:
+            memo_ids.add(change[1])
+    return memo_ids
+
+
+def _journal(changes):
+    """Note the memos of committed changes in memo_pending... the id of the row, None if it could not be written"""
+    try:
+        conn = _connect()
+        with conn:
+            return conn.execute("INSERT INTO memo_pending(memo_ids,queued) VALUES (?,?)",
+                                (json.dumps(sorted(_memo_ids(changes))),time.time())).lastrowid
+    except sqlite3.Error as e: # pragma nocover - the worker still has the changes
+        current_app.logger.warning(f"Unable to note the pending search changes {e}")
+        return None
+
+
+def recover(age=STALE):
+    """Index the memos of the changes noted in memo_pending more than age seconds ago
+    again... their process died before it wrote them.  Returns how many memos"""
+    conn = _connect()
+    rows = conn.execute("SELECT id, memo_ids FROM memo_pending WHERE queued <= ?",(time.time()-age,)).fetchall()
+    if len(rows) == 0:
+        return 0
+    memo_ids = set()
+    for row in rows:
+        memo_ids.update(json.loads(row[1]))
+    reindex(memo_ids)
+    with conn:
+        conn.executemany("DELETE FROM memo_pending WHERE id=?",[(row[0],) for row in rows])
+    return len(memo_ids)
+
+
+def reindex(memo_ids):
+    """Index the memos, and the text of their files on disk, again from the database"""
+    from memos.models.Memo import Memo
+    memo_ids = sorted(memo_ids)
+    conn = _connect()
+    for i in range(0,len(memo_ids),500):
+        chunk = memo_ids[i:i+500]
+        texts = []
+        for memo in Memo.query.filter(Memo.id.in_(chunk)).options(*Memo.loader_options()):
+            texts.extend((mfile.uuid,memo.id,extract_text(mfile.get_path(memo),mfile.filename))
+                         for mfile in memo.files if os.path.exists(mfile.get_path(memo)))
+        with conn:
+            conn.executemany("DELETE FROM memo_file_text WHERE memo_id=?",[(memo_id,) for memo_id in chunk])
+            conn.executemany("INSERT OR REPLACE INTO memo_file_text(uuid,memo_id,text) VALUES (?,?,?)",texts)
+            _index_rows(conn,chunk)
+            for memo_id in chunk:
+                _update_content(conn,memo_id)
+            _bump(conn)
+
+
+@event.listens_for(Session,'after_commit')
+def _write_after_commit(session):
+    changes = session.info.pop('search_committing',None)
+    if not changes:
+        return
+    if has_request_context() and not current_app.testing:
+        with _lock:
+            journal_id = _journal(changes)
+            _pending.extend(changes)
+            if journal_id is not None:
+                _journaled.append(journal_id)
+        worker.wake(current_app._get_current_object())
+    else:
+        write(changes)
+
+@event.listens_for(Session,'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('search_changed',None)
+    session.info.pop('search_committing',None)
+
+
+def clear():
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM memo_fts")
+        conn.execute("DELETE FROM memo_file_text")
+        conn.execute("DELETE FROM memo_confidential")
+        conn.execute("DELETE FROM memo_reader")
+        conn.execute("DELETE FROM memo_pending")
+        _bump(conn)
+
+
+def rebuild(memos):
+    """Throw away the index and build it again from the memos (and their files on disk)"""
+    clear()
+    conn = _connect()
+    memo_ids = []
+    for memo in memos:
+        texts = [(mfile.uuid,memo.id,extract_text(mfile.get_path(memo),mfile.filename))
+                 for mfile in memo.files if os.path.exists(mfile.get_path(memo))]
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO memo_file_text(uuid,memo_id,text) VALUES (?,?,?)",texts)
+        memo_ids.append(memo.id)
+    index_memos(memo_ids)
+    return len(memo_ids)
+
+
+def _terms(text):
+    """Turn user text into an fts5 expression... every word must be present (as a prefix)"""
+    words = re.findall(r"\w+",text or '')
+    if len(words) == 0:
+        return None
+    return ' AND '.join(f'"{word}"*' for word in words)
+
+
+def match_expression(title=None, keywords=None, text=None):
+    parts = []
+    for name,value in (('title',title),('keywords',keywords)):
+        terms = _terms(value)
+        if terms is not None:
+            parts.append(f"{name} : ({terms})")
+    terms = _terms(text)
+    if terms is not None:
+        parts.append(f"({terms})")
+    if len(parts) == 0:
+        return None
+    return ' AND '.join(parts)
+
+
+def search(title=None, keywords=None, text=None, position=None, limit=20, count_limit=None, confidential=True, reader=None):
+    """Returns a tuple of up to limit (memo id, score) of the matches from position (from
+    keyset.decode with KEYS), best first or in reverse for a 'prev' position, and the number
+    of matches... counted up to count_limit+1 if there is a count_limit.  With confidential
+    False the confidential memos only match for their readers (reader is the username of
+    the viewer, None if they are anonymous)"""
+    expression = match_expression(title=title,keywords=keywords,text=text)
+    if expression is None:
+        return [],0
+
+    where = "memo_fts MATCH ?"
+    params = (expression,)
+    if not confidential:
+        where = where + " AND (rowid NOT IN (SELECT memo_id FROM memo_confidential)" \
+                        " OR rowid IN (SELECT memo_id FROM memo_reader WHERE username=?))"
+        params = (expression,reader)
+
+    conn = _connect()
+    if count_limit:
+        total = conn.execute(f"SELECT count(*) FROM (SELECT rowid FROM memo_fts WHERE {where} LIMIT ?)",
+                             params+(count_limit+1,)).fetchone()[0]
+    else:
+        total = conn.execute(f"SELECT count(*) FROM memo_fts WHERE {where}",params).fetchone()[0]
+
+    order = "DESC"
+    if position is not None:
+        (direction,(score,memo_id)) = position
+        beyond,order = ("<","DESC") if direction == 'next' else (">","ASC")
+        where = where + f" AND ({_score} {beyond} ? OR ({_score} = ? AND rowid {beyond} ?))"
+        params = params + (score,score,memo_id)
+    rows = conn.execute(f"SELECT rowid, {_score} FROM memo_fts WHERE {where} ORDER BY {_score} {order}, rowid {order} LIMIT ?",
+                        params+(limit,)).fetchall()
+    return [tuple(row) for row in rows],total
+
+
+################################################################################
+# Text extraction
+################################################################################
+
+_text_extensions = ['.txt','.md','.csv','.htm','.html','.xml','.json','.c','.h','.py','.log']
+_office_parts = {
+    '.docx': re.compile(r"^word/(document|header\d*|footer\d*|footnotes)\.xml$"),
+    '.pptx': re.compile(r"^ppt/slides/slide\d+\.xml$"),
+    '.xlsx': re.compile(r"^xl/sharedStrings\.xml$"),
+}
+
+def _strip_xml(xml):
+    xml = re.sub(r"</w:p>|</a:p>|<w:tab/>|<w:br/>",' ',xml)
+    return re.sub(r"<[^>]+>",'',xml)
+
+def extract_text(path, filename=None):
+    """Returns the searchable text of a document or '' if the type is not understood"""
+    if filename is None:
+        filename = path
+    extension = os.path.splitext(filename)[1].lower()
+    text = ''
+    try:
+        if extension in _text_extensions:
+            with open(path,"rb") as f:
+                text = f.read(MAX_TEXT).decode('utf-8',errors='ignore')
+        elif extension in _office_parts:
+            with zipfile.ZipFile(path) as zf:
+                parts = []
+                for name in sorted(zf.namelist()):
+                    if _office_parts[extension].match(name):
+                        parts.append(_strip_xml(zf.read(name).decode('utf-8',errors='ignore')))
+                text = ' '.join(parts)
+        elif extension == '.pdf':
+            from pypdf import PdfReader     # it imports PIL... only load it for a pdf
+            parts = []
+            for page in PdfReader(path).pages:
+                parts.append(page.extract_text() or '')
+                if sum(len(part) for part in parts) > MAX_TEXT:
+                    break
+            text = ' '.join(parts)
+    except Exception as e: # pragma nocover - a broken document is still attached... it just cant be searched
+        current_app.logger.warning(f"Unable to extract text from {filename} {e}")
+        text = ''
+    return text[:MAX_TEXT]
@@ -0,0 +1,116 @@
+"""
+Resumable uploads of large memo files
+
+A client starts an upload with the name and size of the file and then sends it in
+pieces, each one at the offset the server has reached.  If the connection drops it
+asks for the offset and carries on from there.  The pieces are appended to a file
+in static/blobs/uploads, next to a small json file with the state of the upload,
+so any worker process can take the next piece.  When the last byte arrives the file
+is hashed and moved into the blobstore.
+"""
+import json
+import os
+import re
+import time
+import uuid
+
+from memos import blobstore, filelock
+
+MAX_AGE = 24*60*60          # an upload that has not moved for a day is removed
+
+_upload_id = re.compile(r"^[0-9a-f]{32}$")
+
+
+def root():
+    return os.path.join(blobstore.root(),"uploads")
+
+
+def _paths(upload_id):
+    return os.path.join(root(),upload_id),os.path.join(root(),f"{upload_id}.json")
+
+
+def cleanup(now=None):
+    """Remove the uploads that were abandoned"""
+    now = time.time() if now is None else now
+    if not os.path.isdir(root()):
+        return
+    for name in os.listdir(root()):
+        path = os.path.join(root(),name)
+        try:
+            if now - os.path.getmtime(path) > MAX_AGE:
+                os.remove(path)
+        except FileNotFoundError: # pragma nocover - another worker got there first
+            pass
+
+
+def start(memo_id, username, filename, total, limit=None):
+    """Start an upload of total bytes... returns the id of the upload"""
+    if total < 0:
+        raise blobstore.UploadError(f"{filename} has a negative size")
+    if limit is not None and total > limit:
+        raise blobstore.UploadError(f"{filename} is larger than the {limit} byte limit")
+
+    cleanup()
+    os.makedirs(root(),exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    data,state = _paths(upload_id)
+    open(data,"wb").close()
+    with open(state,"w") as f:
+        json.dump({'memo_id':memo_id,'user':username,'filename':filename,'total':total},f)
+    return upload_id
+
+
+def find(upload_id):
+    """The state of the upload (with the offset it has reached) or None"""
+    if upload_id is None or not _upload_id.match(upload_id):
+        return None
+    data,state = _paths(upload_id)
+    try:
+        with open(state) as f:
+            upload = json.load(f)
+        upload['offset'] = os.path.getsize(data)
+    except FileNotFoundError:
+        return None
+    upload['id'] = upload_id
+    return upload
+
+
+def append(upload, offset, stream):
+    """Append the stream at offset... returns the new offset, or None if the upload is not
+    at offset (the client asks for the offset and carries on from there)"""
+    data,state = _paths(upload['id'])
+    with open(data,"ab") as f:
+        filelock.lock(f)    # one piece at a time
+        size = os.fstat(f.fileno()).st_size
+        if offset != size:
+            return None
+        for chunk in iter(lambda: stream.read(blobstore.CHUNK), b''):
+            size = size + len(chunk)
+            if size > upload['total']:
+                f.truncate(offset)
+                raise blobstore.UploadError(f"{upload['filename']} is longer than {upload['total']} bytes")
+            f.write(chunk)
+    os.utime(state)
+    return size
+
+
+def finish(upload):
+    """Move the finished upload into the blobstore... returns the sha256, size and mimetype,
+    or None if another request finished it first"""
+    data,state = _paths(upload['id'])
+    claimed = f"{state}.finish"
+    try:
+        os.rename(state,claimed)
+    except FileNotFoundError:
+        return None
+    blob = blobstore.store(data,upload['filename'])
+    os.remove(claimed)
+    return blob
+
+
+def abort(upload):
+    for path in _paths(upload['id']):
+        try:
+            os.remove(path)
+        except FileNotFoundError: # pragma nocover
+            pass
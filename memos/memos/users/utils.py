@@ -1,12 +1,12 @@
 
 import os
 import secrets
-from PIL import Image
 from flask import url_for, current_app
 from flask_mail import Message
 from memos import mail
 
 def save_picture(form_picture):
+    from PIL import Image
     random_hex = secrets.token_hex(8)
     _, f_ext = os.path.splitext(form_picture.filename)
     picture_fn = random_hex + f_ext
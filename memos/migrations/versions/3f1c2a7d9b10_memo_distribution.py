@@ -0,0 +1,68 @@
+"""memo distribution table
+
+Revision ID: 3f1c2a7d9b10
+Revises: 
+Create Date: 2026-10-18 09:12:41.518114
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    memo_distribution = op.create_table('memo_distribution',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('memo_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.String(length=120), nullable=True),
+        sa.Column('email', sa.String(length=120), nullable=True),
+        sa.ForeignKeyConstraint(['memo_id'], ['memo.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.username'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    # Backfill from the distribution strings using the same rules as User.valid_usernames
+    conn = op.get_bind()
+    user = sa.table('user', sa.column('username'), sa.column('email'))
+    memo = sa.table('memo', sa.column('id'), sa.column('distribution'))
+    users = {}
+    emails = {}
+    for username, email in conn.execute(sa.select(user.c.username, user.c.email)):
+        users[username] = email
+        if email:
+            emails.setdefault(email, username)
+
+    rows = []
+    for memo_id, distribution in conn.execute(sa.select(memo.c.id, memo.c.distribution)):
+        usernames = set()
+        addrs = set()
+        for name in re.split(r"[\s:;,]+", distribution or ''):
+            if name == '':
+                continue
+            if re.fullmatch(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$", name):
+                addrs.add(name)
+                if name in emails:
+                    usernames.add(emails[name])
+            elif name in users:
+                usernames.add(name)
+
+        for username in sorted(usernames):
+            rows.append({'memo_id': memo_id, 'user_id': username, 'email': users[username]})
+            addrs.discard(users[username])
+        for addr in sorted(addrs):
+            rows.append({'memo_id': memo_id, 'user_id': None, 'email': addr})
+
+    if len(rows) > 0:
+        op.bulk_insert(memo_distribution, rows)
+
+
+def downgrade():
+    op.drop_table('memo_distribution')
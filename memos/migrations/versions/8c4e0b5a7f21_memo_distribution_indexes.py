@@ -0,0 +1,26 @@
+"""memo distribution indexes
+
+Revision ID: 8c4e0b5a7f21
+Revises: 3f1c2a7d9b10
+Create Date: 2026-10-18 11:40:02.905317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e0b5a7f21'
+down_revision = '3f1c2a7d9b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_memo_distribution_memo_id', 'memo_distribution', ['memo_id'], unique=False)
+    op.create_index('ix_memo_distribution_user_id_memo_id', 'memo_distribution', ['user_id', 'memo_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_memo_distribution_user_id_memo_id', table_name='memo_distribution')
+    op.drop_index('ix_memo_distribution_memo_id', table_name='memo_distribution')
@@ -0,0 +1,26 @@
+"""memo file size and mimetype
+
+Revision ID: a4d7e2b91c38
+Revises: f3c5a9d21b76
+Create Date: 2026-10-18 21:12:05.318407
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d7e2b91c38'
+down_revision = 'f3c5a9d21b76'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('memo_file', sa.Column('size', sa.BigInteger(), nullable=True))
+    op.add_column('memo_file', sa.Column('mimetype', sa.String(length=128), nullable=True))
+
+
+def downgrade():
+    op.drop_column('memo_file', 'mimetype')
+    op.drop_column('memo_file', 'size')
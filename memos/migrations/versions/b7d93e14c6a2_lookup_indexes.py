@@ -0,0 +1,58 @@
+"""indexes for the hot lookup paths
+
+Revision ID: b7d93e14c6a2
+Revises: 8c4e0b5a7f21
+Create Date: 2026-10-18 14:05:27.663480
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d93e14c6a2'
+down_revision = '8c4e0b5a7f21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The delegates setter used to be able to add the same delegate twice... keep the first one
+    delegate = sa.table('delegate', sa.column('id'), sa.column('owner_id'), sa.column('delegate_id'))
+    keep = sa.select(sa.func.min(delegate.c.id).label('id')).group_by(delegate.c.owner_id, delegate.c.delegate_id).subquery()
+    # MySQL will not delete from a table that is selected in the same statement... unless it goes through a derived table
+    op.get_bind().execute(delegate.delete().where(delegate.c.id.not_in(sa.select(keep.c.id))))
+
+    op.create_index('ix_memo_user_id_number_version', 'memo', ['user_id', 'number', 'version'], unique=True)
+    op.create_index('ix_memo_memo_state_action_date', 'memo', ['memo_state', 'action_date'], unique=False)
+    op.create_index('ix_memo_action_date', 'memo', ['action_date'], unique=False)
+    op.create_index('ix_memo_pinned', 'memo', ['pinned'], unique=False)
+    op.create_index('ix_memo_template', 'memo', ['template'], unique=False)
+    op.create_index('ix_memo_signature_memo_id_signer_id', 'memo_signature', ['memo_id', 'signer_id'], unique=False)
+    op.create_index('ix_memo_signature_signer_id_signed', 'memo_signature', ['signer_id', 'signed'], unique=False)
+    op.create_index('ix_memo_reference_source_id', 'memo_reference', ['source_id'], unique=False)
+    op.create_index('ix_memo_reference_ref_user_id_ref_memo_number', 'memo_reference', ['ref_user_id', 'ref_memo_number'], unique=False)
+    op.create_index('ix_memo_file_memo_id', 'memo_file', ['memo_id'], unique=False)
+    op.create_index('ix_memo_history_memo_id', 'memo_history', ['memo_id'], unique=False)
+    op.create_index('ix_memo_subscription_subscriber_id', 'memo_subscription', ['subscriber_id'], unique=False)
+    op.create_index('ix_delegate_owner_id_delegate_id', 'delegate', ['owner_id', 'delegate_id'], unique=True)
+    op.create_index('ix_delegate_delegate_id', 'delegate', ['delegate_id'], unique=False)
+    op.create_index('ix_user_email', 'user', ['email'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_email', table_name='user')
+    op.drop_index('ix_delegate_delegate_id', table_name='delegate')
+    op.drop_index('ix_delegate_owner_id_delegate_id', table_name='delegate')
+    op.drop_index('ix_memo_subscription_subscriber_id', table_name='memo_subscription')
+    op.drop_index('ix_memo_history_memo_id', table_name='memo_history')
+    op.drop_index('ix_memo_file_memo_id', table_name='memo_file')
+    op.drop_index('ix_memo_reference_ref_user_id_ref_memo_number', table_name='memo_reference')
+    op.drop_index('ix_memo_reference_source_id', table_name='memo_reference')
+    op.drop_index('ix_memo_signature_signer_id_signed', table_name='memo_signature')
+    op.drop_index('ix_memo_signature_memo_id_signer_id', table_name='memo_signature')
+    op.drop_index('ix_memo_template', table_name='memo')
+    op.drop_index('ix_memo_pinned', table_name='memo')
+    op.drop_index('ix_memo_action_date', table_name='memo')
+    op.drop_index('ix_memo_memo_state_action_date', table_name='memo')
+    op.drop_index('ix_memo_user_id_number_version', table_name='memo')
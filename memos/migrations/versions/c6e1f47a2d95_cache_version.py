@@ -0,0 +1,28 @@
+"""cache version
+
+Revision ID: c6e1f47a2d95
+Revises: a4d7e2b91c38
+Create Date: 2026-10-18 23:40:11.204516
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e1f47a2d95'
+down_revision = 'a4d7e2b91c38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_version',
+        sa.Column('name', sa.String(length=64), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('cache_version')
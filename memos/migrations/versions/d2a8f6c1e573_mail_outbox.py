@@ -0,0 +1,39 @@
+"""mail outbox
+
+Revision ID: d2a8f6c1e573
+Revises: b7d93e14c6a2
+Create Date: 2026-10-18 16:22:53.104872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a8f6c1e573'
+down_revision = 'b7d93e14c6a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('mail_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('subject', sa.String(length=4000), nullable=False),
+        sa.Column('sender', sa.String(length=120), nullable=True),
+        sa.Column('reply_to', sa.String(length=120), nullable=True),
+        sa.Column('recipients', sa.Text(), nullable=False),
+        sa.Column('body', sa.Text(), nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('next_attempt', sa.DateTime(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('sent', sa.DateTime(), nullable=True),
+        sa.Column('error', sa.String(length=4000), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_mail_outbox_sent_next_attempt', 'mail_outbox', ['sent', 'next_attempt'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_mail_outbox_sent_next_attempt', table_name='mail_outbox')
+    op.drop_table('mail_outbox')
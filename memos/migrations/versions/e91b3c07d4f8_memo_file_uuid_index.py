@@ -0,0 +1,24 @@
+"""memo file uuid index
+
+Revision ID: e91b3c07d4f8
+Revises: d2a8f6c1e573
+Create Date: 2026-10-18 18:47:10.221936
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e91b3c07d4f8'
+down_revision = 'd2a8f6c1e573'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_memo_file_uuid', 'memo_file', ['_uuid'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_memo_file_uuid', table_name='memo_file')
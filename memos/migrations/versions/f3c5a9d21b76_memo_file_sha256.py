@@ -0,0 +1,26 @@
+"""memo file sha256 for the blobstore
+
+Revision ID: f3c5a9d21b76
+Revises: e91b3c07d4f8
+Create Date: 2026-10-18 20:31:44.870153
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c5a9d21b76'
+down_revision = 'e91b3c07d4f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('memo_file', sa.Column('sha256', sa.String(length=64), nullable=True))
+    op.create_index('ix_memo_file_sha256', 'memo_file', ['sha256'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_memo_file_sha256', table_name='memo_file')
+    op.drop_column('memo_file', 'sha256')
@@ -13,21 +13,26 @@ from memos import db as _db
 from flask import current_app
 from memos.models.Memo import Memo
 from memos.models.MemoFile import MemoFile
+from memos.models.MemoDistribution import MemoDistribution
+from memos.models.MailOutbox import MailOutbox
 from memos.models.MemoReference import MemoReference
 from memos.models.MemoSignature import MemoSignature
 from memos.models.MemoState import MemoState
 from memos.models.User import User
+from memos import search as search_index
 
 
 
 
 @pytest.fixture(scope='session')
-def app(request):
+def app(request, tmp_path_factory):
     """Session-wide test `Flask` application."""
     app = create_app(__name__)
+    # The memo files, the blobstore and the search index... not in the static directory
+    app.config['FILE_ROOT'] = str(tmp_path_factory.mktemp("files"))
     @app.context_processor
     def inject_pinned():
-        return dict(get_pinned=Memo.get_pinned)
+        return dict(get_pinned=Memo.get_pinned,get_inbox_count=Memo.get_inbox_count)
 
     # Establish an application context before running the tests.
     ctx = app.app_context()
@@ -42,7 +47,7 @@ def app(request):
     # This will make the static member function "get_pinned" available in the template
     @app.context_processor
     def inject_pinned():
-        return dict(get_pinned=Memo.get_pinned)
+        return dict(get_pinned=Memo.get_pinned,get_inbox_count=Memo.get_inbox_count)
 
     return app
 
@@ -70,6 +75,8 @@ def db(app, request):
 
 @pytest.fixture(scope='function')
 def session(db, request):
+    MailOutbox.query.delete()
+    MemoDistribution.query.delete()
     Memo.query.delete()
     MemoFile.query.delete()
     MemoReference.query.delete()
@@ -98,6 +105,7 @@ def session(db, request):
     ]
     for memo in memos:
         db.session.add(memo)     
+    Memo.flags_changed('pinned','template')     # the memos were deleted behind the cache's back
     db.session.commit()
     
     memoSign = Memo.find(username='readAllUser',memo_number=4, memo_version='A')
@@ -114,8 +122,12 @@ def session(db, request):
     db.session.add(MemoReference(source_id = memoSign.id, ref_user_id = "readAllUser", ref_memo_number = 1) )
     db.session.add(MemoReference(source_id = memoSign.id, ref_user_id = "readAllUser", ref_memo_number = 1, ref_memo_version = "B") )
 
+    for memo in Memo.query.all():
+        MemoDistribution.update(memo)
     db.session.commit()
 
+    search_index.rebuild(Memo.query.all())
+
     return db.session
 
 
@@ -1,3 +1,10 @@
+import os
+from memos.models.Memo import Memo
+from memos.models.CacheVersion import CacheVersion
+from memos import search as search_index
+from memos import conditional
+
+
 def test_home_page_get(client, session):
     """
     Test base / url
@@ -326,3 +333,157 @@ def test_pinned(client, session):
         response = client.get('/')
         assert b"bg-warning" not in response.data
         
+
+def test_distributed(client, session):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/distributed' page is requested (GET) by avgUser
+    THEN check only the memos with avgUser on the distribution are listed
+    """
+    with client:
+        client.post('/login', data=dict(username='avgUser', password='u'), follow_redirects=True)
+        response = client.get('/distributed')
+
+    assert response.status_code == 200
+    assert b'Memo System - Distributed avgUser' in response.data
+    assert b'readAllUser memo 1-3' in response.data
+    assert b'readAllUser memo 2-1' not in response.data
+    assert b'avgUser memo 2-1' not in response.data
+
+def test_getfile(client, session):
+    """
+    GIVEN a memo with a file attached
+    WHEN the file is requested directly, by range, conditionally and through nginx
+    THEN check the file, the partial content, the 304 and the X-Accel-Redirect header
+    """
+    memo = Memo.find(username='readAllUser',memo_number=4, memo_version='A')
+    mfile = memo.files[0]
+    os.makedirs(memo.get_fullpath(),exist_ok=True)
+    with open(os.path.join(memo.get_fullpath(),mfile.uuid),"wb") as f:
+        f.write(b"0123456789")
+    url = f'/file/memo/readAllUser/4/A/{mfile.uuid}'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == b"0123456789"
+    assert 'testFile.txt' in response.headers['Content-Disposition']
+    etag = response.headers['ETag']
+
+    response = client.get(url, headers={'Range':'bytes=2-5'})
+    assert response.status_code == 206
+    assert response.data == b"2345"
+
+    response = client.get(url, headers={'If-None-Match':etag})
+    assert response.status_code == 304
+
+    assert client.get('/file/memo/readAllUser/4/A/not-a-uuid').status_code == 404
+
+    client.application.config['FILE_ACCEL_REDIRECT'] = '/protected/'
+    try:
+        response = client.get(url)
+    finally:
+        client.application.config['FILE_ACCEL_REDIRECT'] = None
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['X-Accel-Redirect'] == f'/protected/memos/readAllUser/4/A/{mfile.uuid}'
+    assert response.headers['Content-Type'] == 'text/plain'
+
+def test_upload_in_pieces(client, session):
+    """
+    GIVEN a draft memo
+    WHEN a file is uploaded to it in pieces, with one piece sent again
+    THEN check the offsets, the 409 and that the finished file is attached
+    """
+    with client:
+        client.post('/login', data=dict(username='readAllUser', password='u'), follow_redirects=True)
+
+        response = client.post('/upload/readAllUser/3/A', json={'filename':'spec.pdf','size':10})
+        assert response.status_code == 201
+        upload = response.json['upload']
+        assert response.headers['Location'].endswith(f'/upload/{upload}')
+
+        response = client.put(f'/upload/{upload}', data=b'%PDF-', headers={'Content-Range':'bytes 0-4/10'})
+        assert response.status_code == 200
+        assert response.json['offset'] == 5
+
+        response = client.put(f'/upload/{upload}', data=b'%PDF-', headers={'Content-Range':'bytes 0-4/10'})
+        assert response.status_code == 409
+        assert response.json['offset'] == 5
+        assert client.get(f'/upload/{upload}').json == {'offset':5,'size':10}
+
+        response = client.put(f'/upload/{upload}', data=b'12345', headers={'Content-Range':'bytes 5-9/10'})
+        assert response.status_code == 201
+        uuid = response.json['uuid']
+
+        # an active memo can not have files added
+        assert client.post('/upload/readAllUser/4/A', json={'filename':'x.pdf','size':1}).status_code == 403
+
+    memo = Memo.find(username='readAllUser',memo_number=3, memo_version='A')
+    mfile = [mfile for mfile in memo.files if mfile.uuid == uuid][0]
+    assert (mfile.filename,mfile.size,mfile.mimetype) == ('spec.pdf',10,'application/pdf')
+    assert open(mfile.get_path(memo),"rb").read() == b'%PDF-12345'
+
+    with client:
+        client.get('/logout')
+        client.post('/login', data=dict(username='avgUser', password='u'), follow_redirects=True)
+        assert client.post('/upload/readAllUser/3/A', json={'filename':'x.pdf','size':1}).status_code == 403
+        assert client.get(f'/upload/{upload}').status_code == 404
+
+def test_not_modified(client, session, monkeypatch):
+    """
+    The memo lists answer 304 until something changes
+    """
+    response = client.get('/memo')
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and etag.startswith('W/')
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    response = client.get('/memo',headers={'If-None-Match':etag})
+    assert response.status_code == 304 and response.data == b''
+    assert response.headers['ETag'] == etag
+
+    # A deploy with other code or templates tags every page anew
+    with monkeypatch.context() as m:
+        m.setattr(conditional,'_build_id','another build')
+        assert client.get('/memo',headers={'If-None-Match':etag}).status_code == 200
+
+    # Another page has its own tag
+    assert client.get('/memo?showAll=1').headers['ETag'] != etag
+    assert client.get('/template').headers['ETag'] not in (None,etag)
+
+    memo = Memo.find(username='avgUser',memo_number=2,memo_version='A')
+    memo.pinned = True
+    session.commit()
+    response = client.get('/memo',headers={'If-None-Match':etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    # A bulk update changes the pages too... only the version of the table it writes is bumped
+    versions = {name:CacheVersion.get(name) for name in ('pages:memo','pages:user')}
+    Memo.query.filter(Memo.id==memo.id).update({'title':'A new title'})
+    session.commit()
+    assert CacheVersion.get('pages:memo') == versions['pages:memo'] + 1
+    assert CacheVersion.get('pages:user') == versions['pages:user']
+    response = client.get('/memo',headers={'If-None-Match':etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    # A message waiting to be shown is never cached
+    with client.session_transaction() as flask_session:
+        flask_session['_flashes'] = [('info','Waiting')]
+    response = client.get('/memo',headers={'If-None-Match':etag})
+    assert response.status_code == 200 and 'ETag' not in response.headers
+    assert b'Waiting' in response.data
+
+    # Each user has their own page
+    response = client.post('/login',data=dict(username='avgUser', password='u'),follow_redirects=True)
+    assert client.get('/memo',headers={'If-None-Match':etag}).status_code == 200
+
+    # Only search results are tagged... the form is not
+    response = client.get('/search?title=memo')
+    assert response.status_code == 200 and 'ETag' in response.headers
+    assert client.get('/search?title=memo',headers={'If-None-Match':response.headers['ETag']}).status_code == 304
+    # the index is written after the commit... the search results change with it
+    search_index.index_memos([memo.id])
+    assert client.get('/search?title=memo',headers={'If-None-Match':response.headers['ETag']}).status_code == 200
+    assert 'ETag' not in client.get('/search').headers
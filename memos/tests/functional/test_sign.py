@@ -369,6 +369,7 @@ def test_check_inbox_self(client, session):
         assert response.status_code == 200
         assert b'readAllUser memo 4-1' in response.data
         assert b'testFile.txt' not in response.data
+        assert b'Inbox <span class="badge badge-light">1</span>' in response.data
 
 def test_check_inbox_other(client, session):
     """
@@ -387,6 +388,7 @@ def test_check_inbox_other(client, session):
                                 follow_redirects=True)
         assert response.status_code == 200
         assert b'No memos match that criteria' in response.data
+        assert b'Inbox <span' not in response.data
 
         response = client.get('/inbox/adminUser',
                                 follow_redirects=True)
@@ -568,8 +570,11 @@ def test_check_sign_unsign(client, session):
         assert response.status_code == 200
         assert b'Unsign readAllUser-5A Failed' in response.data
 
-        response = client.get('/unsign/memo/readAllUser/5/A',
-                                follow_redirects=True)
+        # ... back on the same page of the list it was unsigned from
+        response = client.get('/unsign/memo/readAllUser/5/A?next_page=memos.inbox&cursor=abc')
+        assert response.status_code == 302
+        assert '/inbox' in response.headers['Location'] and 'cursor=abc' in response.headers['Location']
+        response = client.get('/memo')
         assert response.status_code == 200
         assert b'Unsign readAllUser-5A success' in response.data     
 
@@ -661,6 +666,23 @@ def test_obsolete_badMemo(client, session):
         assert response.status_code == 200
         assert b'Obsolete avgUser-1-Z Failed' in response.data
 
+def test_obsolete_keeps_page(client, session):
+    """
+    Flow:
+        Login
+        Obsolete memo from a later page of the list
+        Back on the same page
+    """
+    with client:
+        response = client.post('/login',
+                                data=dict(username='avgUser', password='u'),
+                                follow_redirects=True)
+        assert response.status_code == 200
+
+        response = client.get('/obsolete/memo/avgUser/3/A?next_page=memos.main&cursor=abc')
+        assert response.status_code == 302
+        assert 'cursor=abc' in response.headers['Location'] and 'page=' not in response.headers['Location'].replace('next_page=','')
+
 def test_obsolete_memo_wo_permission(client, session):
     """
     Flow:
@@ -0,0 +1,77 @@
+import gzip
+import json
+import pytest
+
+from memos import archive
+from memos.models.Memo import Memo
+from memos.models.MemoActivity import MemoActivity
+from memos.models.MemoDistribution import MemoDistribution
+from memos.models.MemoFile import MemoFile
+from memos.models.MemoHistory import MemoHistory
+from memos.models.MemoReference import MemoReference
+from memos.models.MemoSignature import MemoSignature
+from memos.models.User import User
+
+
+def snapshot():
+    memos = {}
+    for memo in Memo.query.all():
+        memos[f"{memo}"] = (memo.title,memo.memo_state,memo.confidential,memo.distribution,memo.create_date,
+                            sorted((sig.signer_id,sig.signed,sig.date_signed) for sig in memo.signers['siglist']),
+                            memo.references['ref_string'],[mfile.filename for mfile in memo.files],
+                            sorted(MemoDistribution.get_emails(memo)))
+    return memos
+
+
+def test_export_load(db, session, tmp_path):
+    MemoHistory.query.delete()      # the conftest leaves the history of the other tests
+    memo = Memo.find(username='readAllUser',memo_number=4,memo_version='A')
+    MemoHistory.activity(memo=memo,memo_activity=MemoActivity.Signoff,user=User.find(username='avgUser'))
+    session.commit()
+    before = snapshot()
+
+    path = str(tmp_path / "store.jsonl.gz")
+    counts = archive.export(path,batch_size=3,log=lambda message: None)
+    assert counts['memo'] == 11 and counts['memo_signature'] == 3 and counts['memo_reference'] == 4
+    with gzip.open(path,'rt') as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[0] == {'archive':'memos','version':1}
+    assert [line['table'] for line in lines if isinstance(line,dict) and 'table' in line] == \
+           ['user','delegate','memo_subscription','memo','memo_signature','memo_reference','memo_file','memo_distribution','memo_history']
+
+    # An archive is only loaded into a database without memos
+    with pytest.raises(archive.InvalidImport):
+        archive.ArchiveLoad(path).run()
+
+    for model in (MemoDistribution,MemoFile,MemoReference,MemoSignature,MemoHistory,Memo):
+        model.query.delete()
+    User.query.filter_by(username='avgUser2b').delete()
+    session.commit()
+
+    logged = []
+    counts = archive.ArchiveLoad(path,batch_size=2,log=logged.append).run()
+    assert counts['user'] == 1 and counts['memo'] == 11
+    assert "Loaded 11 memo rows" in logged
+    assert User.find(username='avgUser2b').email == 'avgUser2@gmail.com'
+    assert snapshot() == before
+
+    # The rows point at the new ids of the memos
+    memo = Memo.find(username='readAllUser',memo_number=4,memo_version='A')
+    assert [(h.memo_ref,h.memo_activity) for h in MemoHistory.query.filter_by(memo_id=memo.id)] == \
+           [('readAllUser-4A',MemoActivity.Signoff)]
+    assert Memo.find(username='avgUser',memo_number=1,memo_version='B').backrefs['reflist'] == ['readAllUser-4-A']
+    with open(memo.meta_path()) as f:
+        assert json.load(f)['title'] == 'readAllUser memo 4-1'
+
+
+def test_load_errors(db, session, tmp_path):
+    path = tmp_path / "store.jsonl"
+    path.write_text('{"table":"memo","columns":["id"]}\n')
+    with pytest.raises(archive.InvalidImport) as e, open(path) as f:
+        next(archive.ArchiveLoad(str(path)).batches(f))
+    assert "is not a memo archive" in str(e.value)
+
+    path.write_text('{"archive":"memos","version":1}\n{"table":"memo","columns":["id","colour"]}\n')
+    with pytest.raises(archive.InvalidImport) as e, open(path) as f:
+        next(archive.ArchiveLoad(str(path)).batches(f))
+    assert str(e.value) == "line 2: memo has no column colour"
@@ -0,0 +1,131 @@
+import hashlib
+import io
+import os
+import pytest
+import threading
+from werkzeug.datastructures import FileStorage
+from memos import blobstore
+from memos import uploads
+from memos.models.Memo import Memo
+from memos.models.MemoFile import MemoFile
+
+
+def test_store_dedupe(db, session, tmp_path):
+    src = tmp_path / "drawing.txt"
+    src.write_bytes(b"the same drawing")
+    sha256 = hashlib.sha256(b"the same drawing").hexdigest()
+
+    assert blobstore.store_file(str(src)) == (sha256,16,'text/plain')
+    assert blobstore.store_file(str(src)) == (sha256,16,'text/plain')
+    assert os.path.exists(src)      # store_file copies
+    assert open(blobstore.path(sha256),"rb").read() == b"the same drawing"
+    assert blobstore.relative_path(sha256) == f"blobs/{sha256[0:2]}/{sha256[2:4]}/{sha256}"
+
+    # nothing is left behind in the temporary directory
+    assert os.listdir(os.path.join(blobstore.root(),"tmp")) == []
+
+    with open(src,"rb") as f:
+        assert blobstore.store_upload(FileStorage(stream=f,filename="drawing.txt")) == (sha256,16,'text/plain')
+
+def test_store_limit(db, session):
+    with pytest.raises(blobstore.UploadError):
+        blobstore.store_stream(io.BytesIO(b"x"*(blobstore.CHUNK+1)),"big.bin",limit=blobstore.CHUNK)
+    assert os.listdir(os.path.join(blobstore.root(),"tmp")) == []
+
+    sha256,size,mimetype = blobstore.store_stream(io.BytesIO(b"x"*blobstore.CHUNK),"big.bin",limit=blobstore.CHUNK)
+    assert size == blobstore.CHUNK
+    assert sha256 == hashlib.sha256(b"x"*blobstore.CHUNK).hexdigest()
+
+def test_sniff():
+    assert blobstore.sniff(b"%PDF-1.7\n","report.txt") == 'application/pdf'
+    assert blobstore.sniff(b"\x89PNG\r\n\x1a\n\0\0","picture") == 'image/png'
+    assert blobstore.sniff(b"PK\x03\x04\x14\0","spec.docx") == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+    assert blobstore.sniff(b"PK\x03\x04\x14\0","spec") == 'application/zip'
+    assert blobstore.sniff(b"<html><script>alert(1)</script>","page.html") == 'text/plain'
+    assert blobstore.sniff("caf\u00e9".encode('utf-8')[:4],"notes") == 'text/plain'
+    assert blobstore.sniff(b"\x00\xff\xfe\x01binary","a.pdf") == 'application/octet-stream'
+
+def test_resumable_upload(db, session):
+    upload_id = uploads.start(1,'avgUser',"spec.pdf",10)
+    upload = uploads.find(upload_id)
+    assert upload['offset'] == 0 and upload['total'] == 10 and upload['user'] == 'avgUser'
+
+    assert uploads.append(upload,0,io.BytesIO(b"%PDF-"))  == 5
+    assert uploads.append(upload,0,io.BytesIO(b"%PDF-"))  is None   # not where the upload is
+    with pytest.raises(blobstore.UploadError):
+        uploads.append(upload,5,io.BytesIO(b"too long..."))
+    assert uploads.find(upload_id)['offset'] == 5
+    assert uploads.append(upload,5,io.BytesIO(b"12345")) == 10
+
+    sha256,size,mimetype = uploads.finish(upload)
+    assert (size,mimetype) == (10,'application/pdf')
+    assert open(blobstore.path(sha256),"rb").read() == b"%PDF-12345"
+    assert uploads.finish(upload) is None
+    assert uploads.find(upload_id) is None
+    assert uploads.find("../../../etc/passwd") is None
+
+    with pytest.raises(blobstore.UploadError):
+        uploads.start(1,'avgUser',"spec.pdf",10,limit=9)
+
+    upload = uploads.find(uploads.start(1,'avgUser',"old.pdf",10))
+    uploads.cleanup(now=os.path.getmtime(os.path.join(uploads.root(),upload['id']))+uploads.MAX_AGE+1)
+    assert uploads.find(upload['id']) is None
+
+def test_reference_count(db, session, tmp_path):
+    src = tmp_path / "spec.txt"
+    src.write_bytes(b"a specification that is attached twice")
+
+    first = Memo.find(username='avgUser',memo_number=2, memo_version='A')
+    second = Memo.find(username='avgUser',memo_number=3, memo_version='A')
+    files = []
+    for memo in (first,second):
+        mfile = MemoFile(memo_id=memo.id,filename="spec.txt")
+        mfile.set_blob(blobstore.store_file(str(src)))
+        mfile.save()
+        files.append(mfile)
+    session.commit()
+
+    path = files[0].get_path(first)
+    assert path == files[1].get_path(second)
+    assert os.path.exists(path)
+    assert Memo.get_file_bytes('avgUser') == 2*len(b"a specification that is attached twice")
+
+    # The blob stays until the last memo file that uses it is removed
+    files[0].remove_file(first)
+    session.commit()
+    assert os.path.exists(path)
+
+    # Nothing is removed before the commit... or at all if it rolls back
+    assert second.cancel(None,validate_user=False)
+    assert os.path.exists(path)
+    session.rollback()
+    assert os.path.exists(path)
+
+    second = Memo.find(username='avgUser',memo_number=3, memo_version='A')
+    assert second.cancel(None,validate_user=False)
+    session.commit()
+    assert not os.path.exists(path)
+
+def test_hold(app, db, session, tmp_path):
+    sha256,size,mimetype = blobstore.store_stream(io.BytesIO(b"uploaded but not committed"))
+    path = blobstore.path(sha256)
+
+    # A blob is not collected while a transaction that may refer to it holds the store
+    hold = blobstore.hold()
+    def collect():
+        with app.app_context():
+            blobstore.collect([sha256],lambda sha256: False)
+    collector = threading.Thread(target=collect)
+    collector.start()
+    collector.join(0.2)
+    assert collector.is_alive() and os.path.exists(path)
+    hold.close()
+    collector.join()
+    assert not os.path.exists(path)
+
+def test_legacy_path(db, session):
+    memo = Memo.find(username='readAllUser',memo_number=4, memo_version='A')
+    mfile = memo.files[0]
+    assert mfile.sha256 is None
+    assert mfile.get_path(memo) == os.path.join(memo.get_fullpath(),mfile.uuid)
+    assert mfile.get_relative_path(memo) == f"memos/readAllUser/4/A/{mfile.uuid}"
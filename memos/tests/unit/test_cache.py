@@ -0,0 +1,75 @@
+import time
+from memos.cache import LRUCache, TTLCache, VersionedCache
+
+
+def test_ttl():
+    cache = TTLCache(ttl=60)
+    cache.set('a',1)
+    cache.set('b',None,ttl=0)
+    assert cache.get('a') == 1
+    assert cache.get('b','expired') == 'expired'
+    assert len(cache) == 1
+
+    cache.delete('a')
+    assert cache.get('a') is None
+
+def test_get_or_load():
+    cache = TTLCache(ttl=60)
+    loads = []
+    def load():
+        loads.append(1)
+        return None         # None is cached too
+    assert cache.get_or_load('a',load) is None
+    assert cache.get_or_load('a',load) is None
+    assert len(loads) == 1
+
+    cache.clear()
+    cache.get_or_load('a',load)
+    assert len(loads) == 2
+
+def test_maxsize():
+    cache = TTLCache(ttl=60,maxsize=2)
+    cache.set('a',1)
+    cache.set('b',2,ttl=0.01)
+    time.sleep(0.02)
+    cache.set('c',3)        # the expired entry goes first
+    assert (cache.get('a'),cache.get('c')) == (1,3)
+    cache.set('d',4)        # then the oldest
+    assert (cache.get('a'),cache.get('c'),cache.get('d')) == (None,3,4)
+
+def test_versioned():
+    versions = {'a':1}
+    checks = []
+    def version(name):
+        checks.append(name)
+        return versions.get(name,0)
+    cache = VersionedCache(version)
+    loads = []
+    def load():
+        loads.append(1)
+        return len(loads)
+
+    assert cache.get_or_load('a',load) == 1
+    assert cache.get_or_load('a',load) == 1         # same version... no load
+    assert len(checks) == 2
+
+    versions['a'] = 2                               # another process changed it
+    assert cache.get_or_load('a',load,interval=60) == 1     # checked less than a minute ago
+    assert cache.get_or_load('a',load) == 2
+    assert len(checks) == 3
+
+    cache.delete('a')
+    assert cache.get_or_load('a',load,interval=60) == 3
+    cache.clear()
+    assert cache.get_or_load('a',load,interval=60) == 4
+
+def test_lru():
+    cache = LRUCache(maxsize=2)
+    cache.set('a',1)
+    cache.set('b',2)
+    assert cache.get('a') == 1      # a is now the most recently used
+    cache.set('c',3)
+    assert (cache.get('a'),cache.get('b'),cache.get('c')) == (1,None,3)
+    assert len(cache) == 2
+    cache.clear()
+    assert cache.get('a','gone') == 'gone'
@@ -0,0 +1,13 @@
+from memos import filelock
+
+
+def test_lock(tmp_path):
+    # Two shared holders at once... the exclusive one once they have closed
+    with open(tmp_path / ".lock","a") as first, open(tmp_path / ".lock","a") as second:
+        if filelock.fcntl is not None:
+            filelock.lock(first,shared=True)
+            filelock.lock(second,shared=True)
+    with open(tmp_path / ".lock","a") as f:
+        filelock.lock(f)
+        f.write("still writable")
+    assert (tmp_path / ".lock").read_text() == "still writable"
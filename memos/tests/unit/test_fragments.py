@@ -0,0 +1,79 @@
+from flask import render_template_string
+
+from memos import fragments
+from memos.models.Memo import Memo
+from memos.models.User import User
+
+
+def render(app, memo, user=None, detail=False, path='/'):
+    with app.test_request_context(path):
+        return render_template_string("{{ memo_card(memo) }}",memo=memo,user=user,delegate=user,detail=detail)
+
+
+def test_viewer_class(db, session):
+    memo = Memo.find(username='avgUser',memo_number=2,memo_version='A')
+    assert fragments.viewer_class(memo,None) == 'anonymous'
+    assert fragments.viewer_class(memo,User.find(username='adminUser')) == 'admin'
+    assert fragments.viewer_class(memo,User.find(username='avgUser')) == 'owner'
+    assert fragments.viewer_class(memo,User.find(username='readAllUser')) == 'reader'
+
+    # Only the memos that can not be signed are cached
+    assert fragments.card_key(Memo.find(username='readAllUser',memo_number=4,memo_version='A')) is None
+    assert fragments.card_key(memo) is not None
+
+    # The cursor is only in the card of a viewer who can obsolete the memo
+    avgUser = User.find(username='avgUser')
+    assert fragments.card_key(memo,cursor='abc') == fragments.card_key(memo,cursor='def')
+    assert fragments.card_key(memo,avgUser,avgUser,cursor='abc') != fragments.card_key(memo,avgUser,avgUser,cursor='def')
+
+
+def test_memo_card(app, db, session):
+    fragments.clear()
+    memo = Memo.find(username='avgUser',memo_number=2,memo_version='A')
+    adminUser = User.find(username='adminUser')
+
+    html = render(app,memo)
+    assert 'avgUser memo 2-1' in html and 'Revise' not in html
+    assert len(fragments._cards) == 1
+    assert render(app,memo) == html
+    assert len(fragments._cards) == 1
+    # ... on every page of the list
+    assert render(app,memo,path='/memo?cursor=abc') == html
+    assert len(fragments._cards) == 1
+
+    # Each class of viewer has its own card
+    admin_html = render(app,memo,adminUser)
+    assert 'Revise' in admin_html and 'Pin' in admin_html
+    assert len(fragments._cards) == 2
+
+    # Pinning it is a new card
+    memo.pinned = True
+    assert 'Unpin' in render(app,memo,adminUser)
+    assert len(fragments._cards) == 3
+
+    # A memo in signoff is rendered every time
+    render(app,Memo.find(username='readAllUser',memo_number=4,memo_version='A'),adminUser)
+    assert len(fragments._cards) == 3
+
+    app.config['FRAGMENT_CACHE_SIZE'] = 0
+    try:
+        fragments.clear()
+        assert render(app,memo) == render(app,memo)
+        assert len(fragments._cards) == 0
+    finally:
+        app.config['FRAGMENT_CACHE_SIZE'] = 2000
+
+def test_renamed_reference(app, db, session):
+    fragments.clear()
+    memo = Memo.find(username='avgUser',memo_number=3,memo_version='A')
+    memo.references = 'avgUser-2A'
+    memo.save()
+    session.commit()
+    assert '/memo/avgUser-2-A' in render(app,memo,detail=True)
+
+    # The card of the memo that cites a renamed memo links to its new name
+    assert Memo.rename('avgUser-2A','avgUser-7A')
+    session.commit()
+    memo = Memo.find(username='avgUser',memo_number=3,memo_version='A')
+    html = render(app,memo,detail=True)
+    assert '/memo/avgUser-7-A' in html and '/memo/avgUser-2-A' not in html
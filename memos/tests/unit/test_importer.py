@@ -0,0 +1,172 @@
+import os
+import json
+import pytest
+
+from memos import importer
+from memos.models.Memo import Memo
+from memos.models.MemoDistribution import MemoDistribution
+from memos.models.MemoState import MemoState
+from memos.models.User import User
+from memos import search as search_index
+
+HEADER = "replace,current-owner,new-owner,confidential,doc,number,rev,title,date\n"
+
+
+def write_csv(tmp_path, lines, files=None):
+    for path,content in (files or {}).items():
+        os.makedirs(tmp_path / "import_system" / os.path.dirname(path),exist_ok=True)
+        (tmp_path / "import_system" / path).write_bytes(content)
+    datacsv = tmp_path / "data.csv"
+    datacsv.write_text(HEADER + ''.join(line + "\n" for line in lines))
+    return str(datacsv)
+
+
+def test_read_csv(tmp_path):
+    datacsv = write_csv(tmp_path,[
+        ",legacy,,,DOC-1,10,A,Good,05/17/22",
+        ",legacy,,,DOC-2,x,A,Bad number,05/17/22",
+        ",legacy,,,DOC-1,10,A,Same memo,05/17/22",
+        ",legacy,,,DOC-3,11,A,No files,yesterday",
+    ],{"legacy/DOC-1/A/a.txt":b"a","legacy/DOC-2/A/b.txt":b"b"})
+
+    # Every problem is reported... and nothing is imported
+    with pytest.raises(importer.InvalidImport) as e:
+        importer.read_csv(datacsv)
+    problems = str(e.value).split('\n')
+    assert problems[0].startswith("line 3: number 'x' is not a number")
+    assert problems[1] == "line 4: legacy-10A is also on line 2"
+    assert "line 5: date 'yesterday' is not a date, there is no directory" in problems[2]
+
+    rows = importer.read_csv(datacsv,start_line=1,user_filter='nobody')
+    assert rows == []
+
+
+def test_import(db, session, tmp_path):
+    datacsv = write_csv(tmp_path,[
+        ",legacy,,,DOC-1,10,A,Legacy one,05/17/22",
+        ",legacy,,avgUser readAllUser@gmail.com someone@else.com,DOC-2,11,A,Legacy two,05/18/22",
+        ",legacy,avgUser,,DOC-3,20,A,Given to avgUser,05/19/22",
+        ",avgUser,,,DOC-4,2,A,Already there,05/19/22",
+    ],{"legacy/DOC-1/A/notes.txt":b"notes","legacy/DOC-1/A/memo.pdf":b"%PDF-1.4 memo",
+       "legacy/DOC-2/A/same.txt":b"notes","legacy/DOC-3/A/three.txt":b"three",
+       "avgUser/DOC-4/A/four.txt":b"four"})
+
+    logged = []
+    stats = importer.CsvImport(datacsv,batch_size=2,workers=2,log=logged.append).run()
+    assert (stats.rows,stats.skipped,stats.files) == (3,1,4)
+    assert 'rows/s' in str(stats) and 'MB/s' in str(stats)
+    assert "Creating new user legacy" in logged
+    assert not os.path.exists(f"{datacsv}.checkpoint")
+
+    assert User.find(username='legacy') is not None
+    memo = Memo.find(username='legacy',memo_number=10,memo_version='A')
+    assert memo.memo_state == MemoState.Active and memo.keywords == 'DOC-1'
+    assert [mfile.filename for mfile in memo.files] == ['memo.pdf','notes.txt']
+    assert memo.files[0].mimetype == 'application/pdf'
+
+    # The same content is stored once
+    two = Memo.find(username='legacy',memo_number=11,memo_version='A')
+    assert two.files[0].sha256 == memo.files[1].sha256
+    assert two.confidential and two.distribution == 'avgUser readAllUser'
+    assert sorted(MemoDistribution.get_emails(two)) == ['avgUser@gmail.com','readAllUser@gmail.com','someone@else.com']
+
+    assert Memo.find(username='avgUser',memo_number=20,memo_version='A').title == 'Given to avgUser'
+    assert Memo.find(username='avgUser',memo_number=2,memo_version='A').title == 'avgUser memo 2-1'
+
+    with open(memo.meta_path()) as f:
+        assert json.load(f)['files'][0][0] == 'memo.pdf'
+    assert sorted(memo_id for memo_id,score in search_index.search(title='Legacy')[0]) == sorted([memo.id,two.id])
+
+
+def test_resume(db, session, tmp_path):
+    datacsv = write_csv(tmp_path,[
+        ",legacy,,,DOC-1,10,A,Legacy one,05/17/22",
+        ",legacy,,,DOC-2,11,A,Legacy two,05/18/22",
+        "yes,avgUser,,,DOC-4,2,A,Replaced,05/19/22",
+    ],{"legacy/DOC-1/A/a.txt":b"a","legacy/DOC-2/A/b.txt":b"b","avgUser/DOC-4/A/c.txt":b"c"})
+
+    # The first line was committed before the import stopped
+    run = importer.CsvImport(datacsv,batch_size=1,log=lambda message: None)
+    run.save_checkpoint(2)
+    stats = run.run(resume=True)
+    assert stats.rows == 2
+    assert Memo.find(username='legacy',memo_number=10,memo_version='A') is None
+    assert Memo.find(username='legacy',memo_number=11,memo_version='A') is not None
+    assert Memo.find(username='avgUser',memo_number=2,memo_version='A').title == 'Replaced'
+
+    # A checkpoint made by another import is not used
+    other = importer.CsvImport(datacsv,user_filter='legacy')
+    run.save_checkpoint(2)
+    with pytest.raises(importer.InvalidImport):
+        other.run(resume=True)
+    os.remove(run.checkpoint)
+
+
+def test_replace_same_files(db, session, tmp_path):
+    datacsv = write_csv(tmp_path,[",legacy,,,DOC-1,10,A,Legacy one,05/17/22"],{"legacy/DOC-1/A/a.txt":b"unchanged"})
+    importer.CsvImport(datacsv,log=lambda message: None).run()
+
+    # The replaced memo releases the blob the new one is given
+    datacsv = write_csv(tmp_path,["yes,legacy,,,DOC-1,10,A,Legacy again,05/17/22"])
+    importer.CsvImport(datacsv,log=lambda message: None).run()
+    memo = Memo.find(username='legacy',memo_number=10,memo_version='A')
+    assert memo.title == 'Legacy again'
+    assert open(memo.files[0].get_path(memo),"rb").read() == b"unchanged"
+
+
+def write_json(tmp_path, path, data):
+    os.makedirs(os.path.dirname(tmp_path / path),exist_ok=True)
+    (tmp_path / path).write_text(data if isinstance(data,str) else json.dumps(data))
+
+
+def test_parse_json(tmp_path):
+    write_json(tmp_path,"a/meta.json",{'userid':'avgUser','number':'1','version':'a1','memo_state':'MemoState.Lost',
+                                        'active_date':'yesterday','signers':[['avgUser']],'files':[[1,2]]})
+    memo,errors = importer.parse_json(str(tmp_path / "a/meta.json"))
+    assert errors == ["'number' invalid type str must be type int","Version a1 invalid format must be [a-zA-Z]+",
+                      "Memostate=MemoState.Lost illegal string","'active_date' 'yesterday' must be MM/DD/YYYY",
+                      "Illegal signer ['avgUser']","Illegal file [1, 2]"]
+
+    write_json(tmp_path,"b/c/meta.json","{not json")
+    assert importer.parse_json(str(tmp_path / "b/c/meta.json"))[1][0].startswith("JSON Invalid")
+    assert importer.find_jsons(str(tmp_path)) == [str(tmp_path / "a/meta.json"),str(tmp_path / "b/c/meta.json")]
+
+
+def test_json_import(db, session, tmp_path):
+    # 1-cites-2 is found first but cites a memo that is imported with it
+    write_json(tmp_path,"1-cites-2/meta.json",{'userid':'avgUser','number':50,'version':'a','title':'Cites 51',
+        'memo_state':'MemoState.Active','active_date':'05/17/2022','references':'avgUser-51 avgUser-2',
+        'signers':[['readAllUser','05/16/2022']],'files':[['notes.txt']]})
+    (tmp_path / "1-cites-2/notes.txt").write_bytes(b"notes")
+    write_json(tmp_path,"2/meta.json",{'userid':'avgUser','number':51,'version':'A','title':'Cited',
+        'memo_state':'MemoState.Active','confidential':True,'distribution':'readAllUser'})
+    write_json(tmp_path,"3/meta.json",{'userid':'avgUser','title':'Next number','memo_state':'MemoState.Obsolete'})
+    write_json(tmp_path,"4/meta.json",{'userid':'nobody','number':1,'title':'No owner'})
+    write_json(tmp_path,"5/meta.json",{'userid':'avgUser','number':60,'title':'Cites a memo with a problem','references':'nobody-1'})
+    write_json(tmp_path,"6/meta.json",{'userid':'avgUser','number':2,'version':'A','title':'Already there'})
+    write_json(tmp_path,"7/meta.json",{'userid':'avgUser','number':70,'files':[['missing.pdf']]})
+
+    logged = []
+    run = importer.JsonImport(str(tmp_path),workers=2,log=logged.append)
+    stats = run.run(dry_run=True)
+    assert stats.rows == 0 and stats.skipped == 4
+    assert Memo.find(username='avgUser',memo_number=51) is None
+    assert "3 memos can be imported, 4 files have problems" in logged
+    assert run.problems[str(tmp_path / "4/meta.json")] == ["userid nobody not in database"]
+    assert run.problems[str(tmp_path / "5/meta.json")] == ["Invalid references = ['nobody-1']"]
+    assert run.problems[str(tmp_path / "6/meta.json")] == ["avgUser-2A already exists"]
+    assert run.problems[str(tmp_path / "7/meta.json")][0].startswith("File does not exist")
+
+    run = importer.JsonImport(str(tmp_path),batch_size=1,workers=2,log=logged.append)
+    stats = run.run()
+    assert (stats.rows,stats.files) == (3,1)
+
+    cited = Memo.find(username='avgUser',memo_number=51,memo_version='A')
+    cites = Memo.find(username='avgUser',memo_number=50,memo_version='A')
+    assert cited.id < cites.id          # the memo that is cited went in first
+    assert cites.references['ref_string'] == 'avgUser-51 avgUser-2'
+    assert cited.backrefs['reflist'] == ['avgUser-50-A']
+    assert [(sig.signer_id,sig.signed) for sig in cites.signers['siglist']] == [('readAllUser',True)]
+    assert cites.files[0].filename == 'notes.txt' and cites.active_date.year == 2022
+    assert MemoDistribution.get_emails(cited) == ['readAllUser@gmail.com']
+    assert Memo.find(username='avgUser',memo_number=71,memo_version='A').memo_state == MemoState.Obsolete   # after the highest number in the tree
@@ -0,0 +1,25 @@
+import subprocess
+import sys
+from memos import importtime
+
+
+def test_parse():
+    stderr = """import time: self [us] | cumulative | imported package
+import time:       200 |        200 |   _io
+import time:       100 |        300 | io
+import time:        50 |         50 |     flask.json
+import time:       400 |        450 |   flask
+import time:        20 |        470 | memos
+junk
+"""
+    rows = importtime.parse(stderr)
+    assert rows == [('_io',200,200,1),('io',100,300,0),('flask.json',50,50,2),('flask',400,450,1),('memos',20,470,0)]
+    assert importtime.total(rows) == 770
+    assert importtime.packages(rows) == [('memos',470),('flask',450),('io',300),('_io',200)]
+    assert importtime.report(rows,top=1).splitlines() == ["     0.5 ms  memos","     0.8 ms  total"]
+
+def test_startup_is_lazy():
+    code = "import test_settings_local\n" + importtime.STARTUP + \
+        "import sys\nprint(' '.join(m for m in ('flask_migrate','alembic','markdown','PIL','numpy','flask_simpleldap') if m in sys.modules))"
+    result = subprocess.run([sys.executable,"-c",code],capture_output=True,text=True,check=True)
+    assert result.stdout.strip() == ''
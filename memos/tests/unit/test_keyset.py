@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+
+from memos import keyset
+from memos.models.Memo import Memo
+from memos.models.MemoHistory import MemoHistory
+from memos.models.MemoActivity import MemoActivity
+from memos.models.MemoState import MemoState
+from memos.models.User import User
+
+
+def test_token(app):
+    keys = (Memo.action_date,Memo.id)
+    when = datetime(2022,5,17,10,11,12,13)
+    token = keyset.encode('next',[when,7])
+    assert keyset.decode(token,keys) == ('next',[when,7])
+
+    assert keyset.decode(None,keys) is None
+    assert keyset.decode('',keys) is None
+    assert keyset.decode(token[:-2],keys) is None            # the signature does not match
+    assert keyset.decode(token,(Memo.id,)) is None            # made for another order
+    assert keyset.decode(keyset.encode('sideways',[when,7]),keys) is None
+
+
+def test_memo_pages(db, session):
+    # Every memo has the same action date... so the order comes down to the id
+    same = datetime.utcnow() - timedelta(days=1)
+    for memo in Memo.query.all():
+        memo.action_date = same
+    session.commit()
+    everything = [memo.id for memo in Memo.query.order_by(Memo.action_date.desc(),Memo.id.desc())]
+
+    seen = []
+    page = Memo.get_memo_list(showAll=True,pagesize=4,count_limit=100)
+    assert page.total == 11 and page.total_exact
+    assert not page.has_prev
+    pages = [page]
+    while page.has_next:
+        page = Memo.get_memo_list(showAll=True,pagesize=4,cursor=page.next_token)
+        assert page.total is None
+        pages.append(page)
+    for page in pages:
+        seen = seen + [memo.id for memo in page.items]
+    assert seen == everything
+    assert [len(page.items) for page in pages] == [4,4,3]
+
+    # ... and back again
+    page = Memo.get_memo_list(showAll=True,pagesize=4,cursor=pages[-1].prev_token)
+    assert [memo.id for memo in page.items] == [memo.id for memo in pages[1].items]
+    assert page.has_next and page.has_prev
+    page = Memo.get_memo_list(showAll=True,pagesize=4,cursor=page.prev_token)
+    assert [memo.id for memo in page.items] == [memo.id for memo in pages[0].items]
+    assert page.has_next and not page.has_prev
+
+    # The count stops at the limit
+    page = Memo.get_memo_list(showAll=True,pagesize=4,count_limit=5)
+    assert page.total == 5 and not page.total_exact
+
+    # A token that was not made here is the first page
+    assert [memo.id for memo in Memo.get_memo_list(showAll=True,pagesize=4,cursor='junk').items] == everything[:4]
+
+
+def test_history_pages(db, session):
+    avgUser = User.find(username='avgUser')
+    memo = Memo.find(username='avgUser',memo_number=2,memo_version='A')
+    for i in range(5):
+        MemoHistory.activity(memo=memo,memo_activity=MemoActivity.Sign,user=avgUser)
+    session.commit()
+    newest = [mh.id for mh in MemoHistory.query.order_by(MemoHistory.id.desc()).limit(5)]
+
+    page = MemoHistory.get_history(pagesize=3)
+    assert [mh.id for mh in page.items] == newest[:3]
+    page = MemoHistory.get_history(pagesize=3,cursor=page.next_token)
+    assert [mh.id for mh in page.items][:2] == newest[3:]
+
+
+def test_distributed_pages(db, session):
+    active = Memo.query.filter(Memo.memo_state==MemoState.Active).all()
+    for memo in active:
+        memo.distribution = 'avgUser2'
+        memo.save()
+    session.commit()
+    newest = [memo.id for memo in sorted(active,key=lambda memo: (memo.action_date,memo.id),reverse=True)]
+
+    avgUser2 = User.find(username='avgUser2')
+    page = Memo.get_distributed(avgUser2,pagesize=2,count_limit=100)
+    assert [memo.id for memo in page.items] == newest[:2] and page.total == 5
+    page = Memo.get_distributed(avgUser2,cursor=page.next_token,pagesize=2)
+    assert [memo.id for memo in page.items] == newest[2:4]
+    page = Memo.get_distributed(avgUser2,cursor=page.next_token,pagesize=2)
+    assert [memo.id for memo in page.items] == newest[4:] and not page.has_next
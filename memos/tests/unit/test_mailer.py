@@ -0,0 +1,83 @@
+import threading
+from datetime import datetime, timedelta
+from memos import mail, mailer
+from memos.background import Worker
+from memos.models.MailOutbox import MailOutbox
+
+
+def test_queue_batches(db, session):
+    recipients = [f"user{i}@test.local" for i in range(5)] + ["user0@test.local", ""]
+    MailOutbox.queue("Subject","sender@test.local",recipients,"Body",reply_to="owner@test.local",batch=2)
+    assert session.info['mail_queued']
+    session.commit()
+    assert 'mail_queued' not in session.info
+
+    queued = MailOutbox.query.order_by(MailOutbox.id).all()
+    assert [entry.recipients for entry in queued] == [
+        "user0@test.local,user1@test.local","user2@test.local,user3@test.local","user4@test.local"]
+
+def test_send_pending(db, session):
+    mailer.queue("Published",["avgUser@gmail.com","adminUser@gmail.com"],"The memo",reply_to="readAllUser@gmail.com")
+    session.commit()
+
+    with mail.record_messages() as outbox:
+        assert mailer.send_pending() == 1
+        assert mailer.send_pending() == 0
+
+    assert len(outbox) == 1
+    assert outbox[0].subject == "Published"
+    assert outbox[0].recipients == ["avgUser@gmail.com","adminUser@gmail.com"]
+    assert outbox[0].reply_to == "readAllUser@gmail.com"
+    assert MailOutbox.query.one().sent is not None
+
+def test_send_retry(db, session):
+    # flask_mail will not send a message without a sender
+    MailOutbox.queue("No sender",None,["avgUser@gmail.com"],"Body")
+    session.commit()
+
+    assert mailer.send_pending() == 0
+    entry = MailOutbox.query.one()
+    assert entry.attempts == 1
+    assert entry.sent is None
+    assert entry.error
+    assert entry.next_attempt > datetime.utcnow() + timedelta(seconds=20)
+
+    # not due yet
+    assert mailer.send_pending() == 0
+    assert MailOutbox.query.one().attempts == 1
+
+    entry.attempts = mailer.MAX_ATTEMPTS - 1
+    entry.next_attempt = datetime.utcnow()
+    session.commit()
+    assert mailer.send_pending() == 0
+    assert MailOutbox.query.one().next_attempt is None
+
+def test_backoff():
+    assert mailer.backoff(1) == timedelta(seconds=30)
+    assert mailer.backoff(3) == timedelta(minutes=2)
+    assert mailer.backoff(20) == timedelta(hours=1)
+
+def test_connection_lost(db, session, monkeypatch):
+    class Connection:
+        def __enter__(self):
+            return self
+        def send(self, message):
+            raise Exception("recipient refused")
+        def __exit__(self, *args):
+            raise Exception("connection lost")
+    monkeypatch.setattr(mail,'connect',Connection)
+
+    mailer.queue("Published",["avgUser@gmail.com"],"The memo")
+    session.commit()
+    assert mailer.send_pending() == 0
+
+    # the message that failed is only counted once when the connection then fails
+    entry = MailOutbox.query.one()
+    assert entry.attempts == 1
+    assert entry.error == "recipient refused"
+
+def test_worker_polls(app):
+    # a started worker runs every interval without being woken
+    ran = threading.Event()
+    Worker('memos-test',ran.set,interval=0.05).start(app)
+    assert ran.wait(5)
@@ -1,5 +1,13 @@
+import json
+import os
+from sqlalchemy import event
 from memos.models.User import User
 from memos.models.Memo import Memo
+from memos.models.MemoActivity import MemoActivity
+from memos.models.MemoHistory import MemoHistory
+from memos.models.MemoReference import MemoReference
+from memos.models.MemoState import MemoState
+from memos.models.CacheVersion import CacheVersion
 
 
 def test___repr__(db, session):
@@ -143,9 +151,147 @@ def test_create_revise(db, session):
 def test_get_inbox(db, session):
     assert not Memo.get_inbox(user=None)
 
+    adminUser = User.find(username='adminUser')
+    avgUser = User.find(username='avgUser')
+    memo = Memo.find(username='readAllUser',memo_number=4,memo_version='A')
+    assert [m.id for m in Memo.get_inbox(adminUser).items] == [memo.id]
+    assert Memo.get_inbox_count(adminUser) == 1
+    assert Memo.get_inbox_count(avgUser) == 0           # already signed
+    assert Memo.get_inbox_count(None) == 0
+
+    # Once adminUser signs it leaves the inbox
+    assert memo.sign(adminUser,adminUser)
+    assert Memo.get_inbox(adminUser).items == []
+    assert Memo.get_inbox_count(adminUser) == 0
+
 def test_get_drafts(db, session):
     assert not Memo.get_drafts(user=None)
 
+def test_preload(db, session):
+    adminUser = User.find(username='adminUser')
+    avgUser = User.find(username='avgUser')
+
+    # avgUser is a delegate for adminUser... so the answers depend on the delegation set
+    memo_list = Memo.get_memo_list(username='readAllUser',showAll=True,pagesize=20)
+    expected = {}
+    for memo in memo_list.items:
+        expected[memo.id] = (memo.can_sign(adminUser,avgUser),memo.can_unsign(avgUser,avgUser),
+                             memo.can_reject(adminUser,avgUser),memo.can_revise(avgUser),
+                             [file.uuid for file in memo.files],len(memo.signers['siglist']),memo.can_access(adminUser,avgUser))
+
+    Memo.preload(memo_list.items,adminUser,avgUser)
+
+    statements = []
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine,'before_cursor_execute',count_statements)
+    try:
+        for memo in memo_list.items:
+            assert expected[memo.id] == (memo.can_sign(adminUser,avgUser),memo.can_unsign(avgUser,avgUser),
+                             memo.can_reject(adminUser,avgUser),memo.can_revise(avgUser),
+                             [file.uuid for file in memo.files],len(memo.signers['siglist']),memo.can_access(adminUser,avgUser))
+            assert memo.user.username == 'readAllUser'
+    finally:
+        event.remove(db.engine,'before_cursor_execute',count_statements)
+
+    # Everything on the page came from the preload
+    assert statements == []
+
+    # The preload is dropped when the session expires the memo
+    session.commit()
+    assert all(not hasattr(memo,'_page') for memo in memo_list.items)
+
+def test_loader_options(app, db, session):
+    def render(memo_list):
+        return [(str(memo),[sig.signer_id for sig in memo.signers['siglist']],memo.references['reflist'],
+                 memo.backrefs['reflist'],[file.filename for file in memo.files]) for memo in memo_list.items]
+
+    statements = []
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    expected = None
+    for loading in ('selectin','joined'):
+        app.config['RELATIONSHIP_LOADING'] = loading
+        counts = []
+        for memo_number in (4,None):   # one memo... and all of them
+            session.expire_all()
+            event.listen(db.engine,'before_cursor_execute',count_statements)
+            try:
+                memo_list = Memo.get_memo_list(username='readAllUser',memo_number=memo_number,showAll=True,pagesize=20,detail=True)
+                counts.append(len(statements))
+                page = render(memo_list)
+                assert len(statements) == counts[-1]       # the page is drawn from what was loaded
+            finally:
+                event.remove(db.engine,'before_cursor_execute',count_statements)
+                statements.clear()
+        assert counts[0] == counts[1]
+        if expected is None:
+            expected = page
+        assert page == expected
+    app.config['RELATIONSHIP_LOADING'] = 'selectin'
+
+    assert expected[0] == ('readAllUser-4A',['readAllUser','adminUser','avgUser'],['avgUser-1-B','avgUser-2'],[],['testFile.txt'])
+    assert ('readAllUser-1B',[],[],['readAllUser-3-A'],[]) in expected
+
+def test_citation_graph(db, session):
+    assert MemoReference.citation_graph() == {'avgUser-1-B':['readAllUser-4-A'], 'avgUser-2':['readAllUser-4-A'],
+                                              'readAllUser-1':['readAllUser-3-A'], 'readAllUser-1-B':['readAllUser-3-A']}
+    assert MemoReference.citation_graph('avgUser',2) == {'avgUser-2':['readAllUser-4-A']}
+
+    # The references of a cancelled memo go with it
+    readAllUser = User.find(username='readAllUser')
+    assert Memo.find(username='readAllUser',memo_number=3,memo_version='A').cancel(readAllUser)
+    assert MemoReference.citation_graph('readAllUser') == {}
+    assert Memo.find(username='readAllUser',memo_number=1,memo_version='B').backrefs['reflist'] == []
+
+    # ... and the references to a renamed memo follow it
+    assert Memo.rename('avgUser-1-B','avgUser-5-A')
+    assert MemoReference.citation_graph('avgUser') == {'avgUser-5-A':['readAllUser-4-A'], 'avgUser-2':['readAllUser-4-A']}
+    assert Memo.find(username='avgUser',memo_number=5,memo_version='A').backrefs['reflist'] == ['readAllUser-4-A']
+    assert 'avgUser-5-A' in Memo.find(username='readAllUser',memo_number=4,memo_version='A').references['reflist']
+
+def test_pinned_cache(app, db, session):
+    memo = Memo.find(username='avgUser',memo_number=2,memo_version='A')
+    assert Memo.get_pinned().total == 0
+    assert Memo.get_templates().items == []
+
+    statements = []
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine,'before_cursor_execute',count_statements)
+    try:
+        assert Memo.get_pinned().items == []
+        assert Memo.get_templates(count_limit=100).total == 0
+        assert Memo.get_pinned().items == []
+    finally:
+        event.remove(db.engine,'before_cursor_execute',count_statements)
+    assert statements == []
+
+    memo.pinned = True
+    memo.save()
+    session.commit()
+    assert [m.id for m in Memo.get_pinned().items] == [memo.id]
+
+    # Another worker unpins it... this one sees it once it checks the version again
+    Memo.query.filter_by(id=memo.id).update({'pinned':False})
+    CacheVersion.bump('pinned')
+    session.commit()
+    assert Memo.get_pinned().total == 1
+    app.config['LIST_CACHE_INTERVAL'] = 0
+    try:
+        assert Memo.get_pinned().total == 0
+    finally:
+        app.config['LIST_CACHE_INTERVAL'] = 5
+
+    # Making it a template is seen right away in this worker
+    memo = Memo.find(username='avgUser',memo_number=2,memo_version='A')
+    memo.config_template(True)
+    assert [m.id for m in Memo.get_templates().items] == [memo.id]
+    assert memo.cancel(None,validate_user=False)
+    session.commit()
+    assert Memo.get_templates().items == []
+
 def test_parse_reference(db, session):
     # Test with number a version smashed together
     ref = Memo.parse_reference('avgUser-2a')
@@ -195,4 +341,67 @@ def test_config_template(db, session):
     memoActive = Memo.find(username='readAllUser',memo_number=1, memo_version='C')
     assert memoActive.template is True
     
-    
\ No newline at end of file
+    
+def test_obsolete_previous(db, session):
+    # Every earlier version is still Active... they are all obsoleted by the same statements
+    for version in ('A','B'):
+        Memo.find(username='readAllUser',memo_number=1,memo_version=version).memo_state = MemoState.Active
+    memoC = Memo.find(username='readAllUser',memo_number=1,memo_version='C')
+    memoD = Memo(number=1,version='D',title="readAllUser memo 1-4",user_id='readAllUser',memo_state=MemoState.Active)
+    session.add(memoD)
+    session.flush()
+
+    statements = []
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine,'before_cursor_execute',count_statements)
+    try:
+        memoD.obsolete_previous(acting=User.find(username='readAllUser'))
+        memoD.config_confidential()
+    finally:
+        event.remove(db.engine,'before_cursor_execute',count_statements)
+    assert len(statements) <= 6     # the same statements however many versions there are
+
+    assert memoC.memo_state == MemoState.Obsolete and memoD.memo_state == MemoState.Active
+    assert [memo.confidential for memo in memoD.versions().order_by(Memo.version)] == [True,True,True,True]
+    history = MemoHistory.query.filter(MemoHistory.memo_id.in_([memo.id for memo in memoD.versions()]),
+                                       MemoHistory.memo_activity == MemoActivity.Obsolete).all()
+    assert sorted(h.memo_ref for h in history) == ['readAllUser-1A','readAllUser-1B','readAllUser-1C']
+    assert {h.ref_user_id for h in history} == {'readAllUser'}
+
+    # The meta data files are written with the new state when it commits
+    session.commit()
+    with open(memoC.meta_path()) as f:
+        meta = json.load(f)
+    assert (meta['memo_state'],meta['confidential']) == ('MemoState.Obsolete',True)
+
+def test_config_template_unset(db, session):
+    memoActive = Memo.find(username='readAllUser',memo_number=1, memo_version='C')
+    memoActive.config_template(True)
+    assert [m.id for m in Memo.get_templates().items] == [memoActive.id]
+    version = CacheVersion.get('template')
+
+    # Nothing changes... so the workers keep their templates
+    memoActive.config_template(None)
+    assert CacheVersion.get('template') == version
+
+    memoActive.config_template(False)
+    assert Memo.get_templates().items == []
+    assert not any(memo.template for memo in memoActive.versions())
+
+def test_rename_legacy_file(db, session):
+    # A file from before the blobstore is copied into the directory of the new memo
+    memo = Memo.find(username='readAllUser',memo_number=4,memo_version='A')
+    mfile = memo.files[0]
+    assert mfile.sha256 is None
+    os.makedirs(memo.get_fullpath(),exist_ok=True)
+    with open(mfile.get_path(memo),"wb") as f:
+        f.write(b"a file from before the blobstore")
+
+    assert Memo.rename('readAllUser-4A','avgUser-9A')
+    session.commit()
+    renamed = Memo.find(username='avgUser',memo_number=9,memo_version='A')
+    assert [f.uuid for f in renamed.files] == [mfile.uuid]
+    with open(renamed.files[0].get_path(renamed),"rb") as f:
+        assert f.read() == b"a file from before the blobstore"
+    assert Memo.find(username='readAllUser',memo_number=4,memo_version='A') is None
@@ -0,0 +1,64 @@
+from memos.models.Memo import Memo
+from memos.models.MemoDistribution import MemoDistribution
+from memos.models.User import User
+
+def test_update(db, session):
+    memo = Memo.find(username='readAllUser',memo_number=2, memo_version='A')
+    memo.distribution = 'avgUser, adminUser@gmail.com;someone@else.com bogusUser'
+    memo.save()
+
+    rows = MemoDistribution.query.filter_by(memo_id=memo.id).all()
+    assert sorted((row.user_id or '',row.email) for row in rows) == [
+        ('','someone@else.com'),('adminUser','adminUser@gmail.com'),('avgUser','avgUser@gmail.com')]
+
+def test_update_only_when_changed(db, session):
+    memo = Memo.find(username='readAllUser',memo_number=1, memo_version='C')
+    avgUser = User.find(username='avgUser')
+    assert MemoDistribution.is_distributed(memo.id,avgUser)
+
+    # The rows are only rebuilt when the distribution is assigned
+    MemoDistribution.delete(memo)
+    memo.save()
+    assert not MemoDistribution.is_distributed(memo.id,avgUser)
+
+    memo.distribution = 'avgUser'
+    memo.save()
+    assert MemoDistribution.is_distributed(memo.id,avgUser)
+
+def test_is_distributed(db, session):
+    memo = Memo.find(username='readAllUser',memo_number=1, memo_version='C')
+    avgUser = User.find(username='avgUser')
+    avgUser2 = User.find(username='avgUser2')
+
+    assert MemoDistribution.is_distributed(memo.id,avgUser)
+    assert not MemoDistribution.is_distributed(memo.id,avgUser2)
+    assert not MemoDistribution.is_distributed(memo.id,None)
+
+def test_get_access(db, session):
+    confidential = Memo.find(username='readAllUser',memo_number=1, memo_version='C')
+    other = Memo.find(username='readAllUser',memo_number=2, memo_version='A')
+
+    assert MemoDistribution.get_access([confidential.id,other.id],{'avgUser','avgUser2'}) == {(confidential.id,'avgUser')}
+    assert MemoDistribution.get_access([],{'avgUser'}) == set()
+    assert MemoDistribution.get_access([confidential.id],set()) == set()
+
+def test_cancel(db, session):
+    memo = Memo.find(username='readAllUser',memo_number=3, memo_version='A')
+    memo.distribution = 'avgUser'
+    memo.save()
+    memo_id = memo.id
+
+    assert memo.cancel(None,validate_user=False)
+    assert MemoDistribution.query.filter_by(memo_id=memo_id).count() == 0
+
+def test_get_emails(db, session):
+    memo = Memo.find(username='readAllUser',memo_number=1, memo_version='C')
+    assert MemoDistribution.get_emails(memo) == ['avgUser@gmail.com']
+
+def test_get_distributed(db, session):
+    avgUser = User.find(username='avgUser')
+    avgUser2 = User.find(username='avgUser2')
+
+    assert Memo.get_distributed(None) is None
+    assert [f"{memo}" for memo in Memo.get_distributed(avgUser).items] == ['readAllUser-1C']
+    assert Memo.get_distributed(avgUser2,count_limit=100).total == 0
@@ -0,0 +1,63 @@
+import json
+import os
+
+from memos import metadata
+from memos.models.Memo import Memo
+
+
+def read_meta(memo):
+    with open(memo.meta_path()) as f:
+        return json.load(f)
+
+
+def count_writes(monkeypatch):
+    writes = []
+    write_meta = Memo.write_meta
+    def counted(path, js):
+        writes.append(path)
+        write_meta(path,js)
+    monkeypatch.setattr(Memo,'write_meta',staticmethod(counted))
+    return writes
+
+
+def test_write_once(db, session, monkeypatch):
+    writes = count_writes(monkeypatch)
+    memo = Memo.find(username='avgUser',memo_number=2,memo_version='A')
+    memo.title = 'First'
+    memo.save()
+    memo.title = 'Second'
+    memo.save()
+    assert writes == []
+    session.commit()
+    assert len(writes) == 1
+    assert read_meta(memo)['title'] == 'Second'
+    assert not [name for name in os.listdir(os.path.dirname(memo.meta_path())) if name.endswith('.tmp')]
+
+    # Nothing is written for a transaction that is rolled back
+    memo.save()
+    session.rollback()
+    session.commit()
+    assert len(writes) == 1
+
+
+def test_deferred(app, db, session, monkeypatch):
+    writes = count_writes(monkeypatch)
+    woken = []
+    monkeypatch.setattr(metadata.worker,'wake',woken.append)
+    monkeypatch.setattr(app,'testing',False)
+
+    memo = Memo.find(username='avgUser',memo_number=3,memo_version='A')
+    with app.test_request_context('/'):
+        memo.title = 'In a request'
+        memo.save()
+        memo.save()
+        session.commit()
+    assert writes == [] and woken == [app]
+
+    # The worker writes it once with what was committed
+    assert metadata.write_pending() == 1
+    assert writes == [memo.meta_path()]
+    assert read_meta(memo)['title'] == 'In a request'
+    assert metadata.write_pending() == 0
+
+    assert metadata.write_all() == Memo.query.count()
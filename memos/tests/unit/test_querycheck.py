@@ -0,0 +1,45 @@
+from memos import querycheck
+from memos.models.Memo import Memo
+from memos.models.MemoDistribution import MemoDistribution
+from memos.models.MemoSignature import MemoSignature
+from memos.models.User import User, Delegate
+
+
+def test_full_scans(db, session):
+    with db.engine.connect() as conn:
+        assert querycheck.full_scans(conn,"SELECT * FROM memo WHERE keywords = ?",('Joe',)) == ['memo']
+        assert querycheck.full_scans(conn,"SELECT * FROM memo WHERE user_id = ? AND number = ?",('avgUser',1)) == []
+        assert querycheck.full_scans(conn,"DELETE FROM memo WHERE keywords = 'x'") == []
+
+def test_hot_paths(db, session):
+    memo = Memo.find(username='readAllUser',memo_number=4, memo_version='A')
+    adminUser = User.find(username='adminUser')
+    avgUser = User.find(username='avgUser')
+
+    # The delegation graph is read whole on purpose... and then cached
+    Delegate.graph()
+
+    scans = []
+    check_plan = querycheck.install(db.engine,lambda table,statement: scans.append((table,statement)))
+    try:
+        assert Memo.find(username='readAllUser',memo_number=4, memo_version='A') is memo
+        assert Memo.get_memo_list(pagesize=10,count_limit=100).total == 5
+        assert len(Memo.get_memo_list(pagesize=2,cursor=Memo.get_memo_list(pagesize=2).next_token).items) == 2
+        assert MemoSignature.is_signer(memo.id,avgUser)['is_signer']
+        assert len(MemoSignature.get_signatures(adminUser,signed=False)) == 1
+        assert [memo.id for memo in Memo.get_inbox(adminUser,count_limit=100).items] == [memo.id]
+        assert Memo.get_inbox_count(adminUser) == 1
+        assert Delegate.is_delegate(adminUser,avgUser)
+        assert Delegate.get_delegated_users(avgUser) == [adminUser]
+        assert len(memo.files) == 1
+        assert memo.references['ref_string'] != ''
+        assert Memo.find(username='avgUser',memo_number=2, memo_version='A').backrefs['ref_string'] == 'readAllUser-4-A'
+        assert Memo.get_distributed(avgUser,count_limit=100).total == 1
+        assert MemoDistribution.is_distributed(memo.id,avgUser) is False
+        Memo.preload([memo],adminUser,avgUser)
+        assert Memo.get_pinned().total == 0
+        assert Memo.get_templates(count_limit=100).total == 0
+    finally:
+        querycheck.uninstall(db.engine,check_plan)
+
+    assert scans == []
@@ -0,0 +1,189 @@
+import zipfile
+from memos import blobstore
+from memos import search as search_index
+from memos.models.Memo import Memo
+from memos.models.MemoFile import MemoFile
+from memos.models.User import User
+
+
+def write_pdf(path, text):
+    """A one page pdf with text on it"""
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+               b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+               b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream),stream),
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number,body in enumerate(objects,1):
+        offsets.append(len(pdf))
+        pdf = pdf + b"%d 0 obj\n%s\nendobj\n" % (number,body)
+    xref = len(pdf)
+    pdf = pdf + b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects)+1)
+    pdf = pdf + b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf = pdf + b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects)+1,xref)
+    path.write_bytes(pdf)
+
+
+def test_match_expression():
+    assert search_index.match_expression() is None
+    assert search_index.match_expression(title='  ') is None
+    assert search_index.match_expression(title='avg memo') == 'title : ("avg"* AND "memo"*)'
+    # quotes and fts5 operators from the user are not passed through
+    assert search_index.match_expression(keywords='a" OR b') == 'keywords : ("a"* AND "OR"* AND "b"*)'
+    assert search_index.match_expression(title='x',text='y') == 'title : ("x"*) AND ("y"*)'
+
+def test_extract_text(tmp_path):
+    txt = tmp_path / "plain.txt"
+    txt.write_text("some plain words")
+    assert search_index.extract_text(str(txt)) == "some plain words"
+
+    docx = tmp_path / "document.docx"
+    with zipfile.ZipFile(docx,"w") as zf:
+        zf.writestr("word/document.xml",'<w:document><w:body><w:p><w:r><w:t>Flux</w:t></w:r></w:p><w:p><w:r><w:t>capacitor</w:t></w:r></w:p></w:body></w:document>')
+        zf.writestr("word/styles.xml",'<w:styles>ignored</w:styles>')
+    assert search_index.extract_text(str(docx)).split() == ['Flux','capacitor']
+
+    pdf = tmp_path / "report.pdf"
+    write_pdf(pdf,"Dirigible maintenance schedule")
+    assert search_index.extract_text(str(pdf)).split() == ['Dirigible','maintenance','schedule']
+
+    unknown = tmp_path / "picture.jpg"
+    unknown.write_bytes(b'\xff\xd8\xff')
+    assert search_index.extract_text(str(unknown)) == ''
+
+def test_search_ranked(db, session):
+    admin = User.find(username='adminUser')
+    memos = Memo.search(title='memo',pagesize=100,user=admin)
+    assert memos.total == 11
+    first = Memo.search(title='avgUser memo',pagesize=2,user=admin)
+    memos = Memo.search(title='avgUser memo',cursor=first.next_token,pagesize=2,user=admin)
+    assert memos.total == 5
+    assert len(memos.items) == 2
+
+    # the pages follow the rank from the token of the page before... and back again
+    pages = [first,memos,Memo.search(title='avgUser memo',cursor=memos.next_token,pagesize=2,user=admin)]
+    assert [len(page.items) for page in pages] == [2,2,1] and not pages[2].has_next
+    ranked = Memo.search(title='avgUser memo',pagesize=100,user=admin).items
+    assert [memo.id for page in pages for memo in page.items] == [memo.id for memo in ranked]
+    back = Memo.search(title='avgUser memo',cursor=pages[2].prev_token,pagesize=2,user=admin)
+    assert [memo.id for memo in back.items] == [memo.id for memo in memos.items]
+    assert Memo.search(title='avgUser memo',pagesize=2,user=admin,count_limit=3).total_exact is False
+
+    # multi-field queries must match all of the fields
+    memos = Memo.search(title='memo 4',keywords='Outstanding',pagesize=100)
+    assert [f"{memo}" for memo in memos.items] == ['readAllUser-4A']
+    memos = Memo.search(title='memo 4',keywords='Average',pagesize=100)
+    assert memos.total == 0
+
+def test_search_confidential(app, db, session, tmp_path):
+    # readAllUser-2A is confidential... its text only matches for the viewers that can open it
+    memo = Memo.find(username='readAllUser',memo_number=2, memo_version='A')
+    document = tmp_path / "secret.txt"
+    document.write_text("The classified zeppelin budget")
+    mfile = MemoFile(memo_id=memo.id,filename="secret.txt")
+    mfile.set_blob(blobstore.store_file(str(document)))
+    mfile.save()
+    search_index.file_attached(memo,mfile)
+    session.commit()
+
+    assert Memo.search(text='classified').total == 0
+    assert Memo.search(text='classified',user=User.find(username='avgUser')).total == 0
+    assert Memo.search(text='classified',user=User.find(username='readAllUser')).total == 1
+
+    # anonymous and avgUser2 see 8 of the 11, avgUser also sees its own and the one it is on the distribution of
+    assert Memo.search(title='memo',pagesize=100).total == 8
+    assert Memo.search(title='memo',pagesize=100,user=User.find(username='avgUser')).total == 10
+    memos = Memo.search(title='memo',pagesize=5,user=User.find(username='avgUser2'))
+    memos = Memo.search(title='memo',cursor=memos.next_token,pagesize=5,user=User.find(username='avgUser2'))
+    assert memos.total == 8 and len(memos.items) == 3
+    assert not any(memo.confidential for memo in memos.items)
+
+    # the readers in the index are the users can_access lets in
+    memos = Memo.query.all()
+    for username in ('avgUser','avgUser2','readAllUser','adminUser'):
+        user = User.find(username=username)
+        found = {memo.id for memo in Memo.search(title='memo',pagesize=100,user=user).items}
+        assert found == {memo.id for memo in memos if memo.can_access(user,user)}
+        hidden = Memo.hidden_from(user)
+        hidden = set() if hidden is None else {memo_id for memo_id, in hidden}
+        assert hidden == {memo.id for memo in memos if not memo.can_access(user,user)}
+
+    # ... and follow the memo when its distribution changes
+    memo.distribution = 'avgUser2'
+    memo.save()
+    session.commit()
+    assert Memo.search(text='classified',user=User.find(username='avgUser2')).total == 1
+
+    app.config['ENABLE_ALL_CONFIDENTIAL'] = True
+    try:
+        assert Memo.search(title='memo').total == 0
+        assert Memo.search(title='memo',user=User.find(username='avgUser2')).total == 9
+    finally:
+        app.config.pop('ENABLE_ALL_CONFIDENTIAL')
+
+def test_search_file_text(db, session, tmp_path):
+    memo = Memo.find(username='avgUser',memo_number=2, memo_version='A')
+    document = tmp_path / "minutes.txt"
+    document.write_text("The quarterly zeppelin budget review")
+
+    mfile = MemoFile(memo_id=memo.id,filename="minutes.txt")
+    mfile.set_blob(blobstore.store_file(str(document)))
+    mfile.save()
+    search_index.file_attached(memo,mfile)
+
+    # the index is written when the transaction commits
+    assert Memo.search(text='zeppelin budget').total == 0
+    session.commit()
+    memos = Memo.search(text='zeppelin budget')
+    assert [f"{memo}" for memo in memos.items] == ['avgUser-2A']
+
+    # the title and keywords are updated by save without losing the text of the files
+    memo.title = "Renamed memo"
+    memo.save()
+    session.commit()
+    assert Memo.search(text='zeppelin').total == 1
+    assert Memo.search(title='Renamed').total == 1
+
+    # ... and not at all if it rolls back
+    memo.title = "Forgotten memo"
+    memo.save()
+    session.rollback()
+    assert Memo.search(title='Forgotten').total == 0
+
+    mfile = MemoFile.query.filter_by(memo_id=memo.id,_fname="minutes.txt").first()
+    mfile.remove_file(memo)
+    session.commit()
+    assert Memo.search(text='zeppelin').total == 0
+
+    assert memo.cancel(None,validate_user=False)
+    session.commit()
+    assert Memo.search(title='Renamed').total == 0
+
+def test_search_recover(db, session):
+    memo = Memo.find(username='avgUser',memo_number=2, memo_version='A')
+
+    # A change noted for the worker... whose process died before it was written
+    db.session.execute(Memo.__table__.update().where(Memo.__table__.c.id==memo.id).values(title='Recovered memo'))
+    session.commit()
+    search_index._journal([('memos',{memo.id})])
+    assert Memo.search(title='Recovered').total == 0
+
+    # ... is left to its own process for a while
+    assert search_index.recover() == 0
+    assert search_index.recover(age=0) == 1
+    assert Memo.search(title='Recovered').total == 1
+    assert search_index.recover(age=0) == 0
+
+def test_search_pdf(db, session, tmp_path):
+    memo = Memo.find(username='avgUser',memo_number=3, memo_version='A')
+    document = tmp_path / "report.pdf"
+    write_pdf(document,"Dirigible maintenance schedule")
+
+    mfile = MemoFile(memo_id=memo.id,filename="report.pdf")
+    mfile.set_blob(blobstore.store_file(str(document)))
+    mfile.save()
+    search_index.file_attached(memo,mfile)
+    session.commit()
+    assert [f"{memo}" for memo in Memo.search(text='dirigible').items] == ['avgUser-3A']
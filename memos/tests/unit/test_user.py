@@ -1,3 +1,5 @@
+from sqlalchemy import event
+from memos.models import User as user_module
 from memos.models.User import Delegate, User, load_user
 import time
 
@@ -109,6 +111,34 @@ def test_user_valid_usernames(db, session):
     assert v["non_users"]
     assert len(v["valid_users"]) == 3
 
+def test_user_resolve(db, session):
+    User.find(username='avgUser')   # already in the session... still only one query
+
+    statements = []
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine,'before_cursor_execute',count_statements)
+    try:
+        v = User.resolve(['readAllUser','avgUser','adminUser','avgUser','avgUser2@gmail.com','nobody@nowhere.com','typo',''])
+    finally:
+        event.remove(db.engine,'before_cursor_execute',count_statements)
+    assert len(statements) == 1
+
+    assert v['valid_usernames'] == ['adminUser','avgUser','avgUser2','readAllUser']
+    assert [user.username for user in v['valid_users']] == v['valid_usernames']
+    assert v['invalid_usernames'] == ['typo']
+    assert v['email_addrs'] == ['adminUser@gmail.com','avgUser2@gmail.com','avgUser@gmail.com','nobody@nowhere.com','readAllUser@gmail.com']
+    assert v['non_users']
+
+    # The names and emails match in any case... as they do in the MySQL and SQL Server collations
+    v = User.resolve(['AVGUSER','ReadAllUser@Gmail.com'])
+    assert v['valid_usernames'] == ['avgUser','readAllUser']
+    assert v['invalid_usernames'] == [] and not v['non_users']
+    assert v['email_addrs'] == ['ReadAllUser@Gmail.com','avgUser@gmail.com']
+    assert sorted(user.username for user in User.lookup(['AvgUser','ADMINUSER@GMAIL.COM'])) == ['adminUser','avgUser']
+
+    assert User.resolve([]) == {'valid_usernames':[],'invalid_usernames':[],'valid_users':[],'email_addrs':[],'non_users':False}
+
 def test_user_is_admin(db, session):
     assert User.is_admin('adminUser')
     assert not User.is_admin('readAllUser')
@@ -121,3 +151,75 @@ def test_user_find(db, session):
     assert not User.find(None)
     assert not User.find('badUser')
     assert User.find('avgUser')
+
+def test_delegate_graph(db, session):
+    adminUser = User.find(username='adminUser')
+    readAllUser = User.find(username='readAllUser')
+    avgUser = User.find(username='avgUser')
+    Delegate.graph()
+
+    statements = []
+    def count_statements(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine,'before_cursor_execute',count_statements)
+    try:
+        for i in range(10):
+            assert Delegate.is_delegate(adminUser,avgUser)
+            assert not Delegate.is_delegate(avgUser,readAllUser)
+    finally:
+        event.remove(db.engine,'before_cursor_execute',count_statements)
+    assert statements == []
+
+    # Changing the table drops the cached graph
+    Delegate.add(avgUser,readAllUser)
+    assert Delegate.is_delegate(avgUser,readAllUser)
+    session.rollback()
+    assert not Delegate.is_delegate(avgUser,readAllUser)
+
+    adminUser.delegates = 'readAllUser'
+    session.commit()
+    assert Delegate.is_delegate(adminUser,readAllUser)
+    assert not Delegate.is_delegate(adminUser,avgUser)
+    assert Delegate.get_delegated_users(avgUser) == []
+
+class DirectoryServer:
+    """Answers get_object_details like flask_simpleldap... and counts the lookups"""
+    def __init__(self):
+        self.lookups = []
+
+    def get_object_details(self, username):
+        self.lookups.append(username)
+        if username.lower() == 'ldapuser':
+            return {'sAMAccountName':[b'ldapUser'], 'mail':[b'ldapUser@gmail.com'], 'memberOf':[b'CN=A-GRP,DC=local']}
+        return None
+
+def test_find_ldap_cache(db, session, monkeypatch):
+    server = DirectoryServer()
+    monkeypatch.setattr(user_module,'ldap',server)
+    monkeypatch.setenv('LDAP_ADMIN_GRP','CN=A-GRP')
+    monkeypatch.setenv('LDAP_READ_GRP','CN=R-GRP')
+    monkeypatch.setenv('LDAP_USER_NAME','sAMAccountName')
+    monkeypatch.setenv('LDAP_EMAIL','mail')
+    User.forget()
+    try:
+        user = User.find(username='ldapuser')
+        assert (user.username,user.email,user.admin,user.readAll) == ('ldapUser','ldapUser@gmail.com',True,False)
+        assert User.find(username='ldapuser') is user
+        assert User.find(username='ldapUser') is user
+        assert server.lookups == ['ldapuser']
+
+        # A name LDAP does not know is only looked up once
+        assert User.find(username='typo') is None
+        assert User.find(username='typo') is None
+        assert server.lookups == ['ldapuser','typo']
+
+        # Users in the database are not looked up... and keep the roles they were given
+        assert User.find(username='adminUser').admin and not User.find(username='avgUser').readAll
+        assert server.lookups == ['ldapuser','typo']
+
+        User.forget('typo')
+        assert User.find(username='typo') is None
+        assert server.lookups == ['ldapuser','typo','typo']
+    finally:
+        User.forget()
+        session.rollback()